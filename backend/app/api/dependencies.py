@@ -1,10 +1,15 @@
 """
 Dependencies for API routes.
 """
-from typing import Generator
-from fastapi import Depends, HTTPException, status
+import os
+import hmac
+from typing import Generator, Optional
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
+# Token expected in the X-Admin-Token header of admin requests; admin access is off when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
 # Optional authentication dependency (for future use)
 security = HTTPBearer(auto_error=False)
 
@@ -22,6 +27,17 @@ async def get_current_user(
     return {"user_id": "anonymous"}
 
 
+def is_admin_token(token: Optional[str]) -> bool:
+    """Whether `token` matches ADMIN_TOKEN (always False when no token is configured)."""
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Reject requests without the admin token."""
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+
+
 def get_db():
     """
     Database dependency.
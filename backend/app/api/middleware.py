@@ -0,0 +1,59 @@
+"""
+ASGI middleware for the API.
+"""
+from urllib.parse import parse_qs
+from starlette.requests import Request
+from app.api.dependencies import is_admin_token
+from app.services.profiling import profiled, should_sample, valid_profile_id, new_profile_id
+
+_TRUE = ("1", "true", "yes")
+
+
+def profile_requested(request: Request) -> bool:
+    """Whether an admin asked to profile the request (see ProfilingMiddleware)."""
+    return bool(getattr(request.state, "profile", False))
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests flagged by an admin, and a sample of all others.
+    
+    A request is profiled when it has `X-Profile: 1` or `?profile=1` together
+    with a valid `X-Admin-Token` header, or at random at PROFILE_SAMPLE_RATE.
+    The profile is stored under "request-" and a new ID, or the request's
+    `X-Request-ID` when an admin asked for it, and the ID is returned in the
+    `X-Profile-Id` response header. The flag is left in
+    `request.state.profile` so routes can profile the work they queue.
+    Requests that are not profiled only pay for the header check.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        flag = headers.get(b"x-profile", b"").decode("latin-1").lower()
+        if not flag and b"profile=" in scope.get("query_string", b""):
+            flag = parse_qs(scope["query_string"].decode("latin-1")).get("profile", [""])[0].lower()
+        requested = flag in _TRUE and is_admin_token(headers.get(b"x-admin-token", b"").decode("latin-1") or None)
+        if not requested and not should_sample():
+            return await self.app(scope, receive, send)
+        
+        # Only admins choose the ID; sampled requests cannot overwrite other profiles
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") if requested else ""
+        profile_id = f"request-{request_id}"
+        if not request_id or not valid_profile_id(profile_id):
+            profile_id = new_profile_id("request")
+        scope.setdefault("state", {})["profile"] = requested
+        
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile_id.encode("latin-1"))
+                ]
+            await send(message)
+        
+        async with profiled(profile_id, "request", f"{scope['method']} {scope['path']}"):
+            await self.app(scope, receive, send_with_id)
@@ -0,0 +1,23 @@
+import asyncio
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+from typing import List
+from app.models.schemas import ProfileInfo
+from app.services.profiling import profile_store
+
+router = APIRouter()
+
+
+@router.get("/profiles", response_model=List[ProfileInfo])
+async def list_profiles():
+    """List stored request and prediction profiles, newest first."""
+    return await asyncio.to_thread(profile_store.list)
+
+
+@router.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str):
+    """Download a profile as folded stacks, ready for flamegraph.pl, inferno or speedscope."""
+    path = profile_store.path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
@@ -1,36 +1,113 @@
+import asyncio
+from typing import List
+import numpy as np
 from fastapi import APIRouter, HTTPException
-from app.models.schemas import AnalyticsData, ModelMetrics, TimeSeriesDataPoint, RegionalStats
+from app.models.schemas import AnalyticsData, ModelMetrics, TimeSeriesDataPoint, RegionalStats, RegionDefinition
+from app.services.zonal_stats import (
+    zonal_stats,
+    bounds_geometry,
+    validate_geometry,
+    IndexedRegion,
+    YIELD,
+    URBAN_EXTENT,
+)
 
 router = APIRouter()
 
+# Yield changing by less than this share of its mean per year counts as stable
+STABLE_TREND_THRESHOLD = 0.005
+
+
+@router.put("/regions/{region_id}", response_model=RegionDefinition)
+async def put_region(region_id: str, region: RegionDefinition):
+    """
+    Define or replace a region for analytics. Its statistics are computed in
+    the background over all indexed rasters.
+    """
+    if region.geometry is not None:
+        try:
+            validate_geometry(region.geometry)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        geometry = region.geometry
+    elif region.bounds is not None:
+        geometry = bounds_geometry(region.bounds)
+    else:
+        raise HTTPException(status_code=400, detail="Either bounds or geometry is required")
+    indexed = await asyncio.to_thread(zonal_stats.put_region, region_id, region.name, geometry)
+    zonal_stats.schedule_refresh()
+    return _region_definition(indexed)
+
+
+@router.get("/regions", response_model=List[RegionDefinition])
+async def list_regions():
+    """List regions defined for analytics, including those named in prediction requests."""
+    regions = await asyncio.to_thread(zonal_stats.list_regions)
+    return [_region_definition(region) for region in regions]
+
+
+@router.delete("/regions/{region_id}")
+async def delete_region(region_id: str):
+    if not await asyncio.to_thread(zonal_stats.delete_region, region_id):
+        raise HTTPException(status_code=404, detail="Region not found")
+    return {"message": "Region deleted"}
+
+
+def _region_definition(region: IndexedRegion) -> RegionDefinition:
+    return RegionDefinition(id=region.id, name=region.name, geometry=region.geometry)
+
 
 @router.get("/region/{region_id}", response_model=AnalyticsData)
 async def get_region_analytics(region_id: str):
-    """Get analytics data for a specific region."""
-    # TODO: Implement actual analytics calculation
-    # This would aggregate data from predictions and historical data
+    """
+    Get yield and urban extent by year for a region, read from the zonal
+    statistics index. While uploads, predictions or region changes are still
+    being aggregated (in the background), the current series is returned
+    with `pending` set.
+    """
+    if await asyncio.to_thread(zonal_stats.get_region, region_id) is None:
+        raise HTTPException(status_code=404, detail="Region not found")
+    pending = await asyncio.to_thread(zonal_stats.has_pending)
+    if pending:
+        zonal_stats.schedule_refresh()
+    series = await asyncio.to_thread(zonal_stats.region_series, region_id)
     
-    # Mock data for now
     time_series = [
-        TimeSeriesDataPoint(year=1992, crop_yield=3.5, urbanExtent=0.1),
-        TimeSeriesDataPoint(year=2000, crop_yield=3.2, urbanExtent=0.15),
-        TimeSeriesDataPoint(year=2010, crop_yield=2.9, urbanExtent=0.25),
-        TimeSeriesDataPoint(year=2016, crop_yield=2.7, urbanExtent=0.3),
+        TimeSeriesDataPoint(year=year, crop_yield=values.get(YIELD), urbanExtent=values.get(URBAN_EXTENT))
+        for year, values in series.items()
     ]
+    yields = [(point.year, point.crop_yield) for point in time_series if point.crop_yield is not None]
+    extents = [point.urbanExtent for point in time_series if point.urbanExtent is not None]
     
     regional_stats = RegionalStats(
-        averageYield=3.075,
-        totalUrbanExtent=0.2,
-        yieldTrend="decreasing",
+        averageYield=float(np.mean([value for _, value in yields])) if yields else None,
+        totalUrbanExtent=extents[-1] if extents else None,
+        yieldTrend=_trend(yields),
     )
     
     return AnalyticsData(
         regionId=region_id,
         timeSeries=time_series,
         regionalStats=regional_stats,
+        pending=pending,
     )
 
 
+def _trend(points: List[tuple]) -> str:
+    """Classify the least-squares slope of (year, value) points."""
+    if len(points) < 2:
+        return "stable"
+    years = np.array([year for year, _ in points], dtype=np.float64)
+    values = np.array([value for _, value in points], dtype=np.float64)
+    mean = float(values.mean())
+    if mean == 0:
+        return "stable"
+    relative = float(np.polyfit(years, values, 1)[0]) / abs(mean)
+    if abs(relative) < STABLE_TREND_THRESHOLD:
+        return "stable"
+    return "increasing" if relative > 0 else "decreasing"
+
+
 @router.get("/metrics", response_model=ModelMetrics)
 async def get_model_metrics():
     """Get model performance metrics."""
@@ -41,4 +118,3 @@ async def get_model_metrics():
         mse=0.4743,
         accuracy=None,
     )
-
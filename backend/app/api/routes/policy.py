@@ -1,7 +1,23 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 import uuid
-from datetime import datetime
-from app.models.schemas import PolicySimulation
+import asyncio
+from typing import Optional
+from pydantic import ValidationError
+from app.models.schemas import (
+    PolicySimulation,
+    UrbanPolicy,
+    ImpactMetrics,
+    PredictionRequest,
+    PredictionResponse,
+    PredictionStatus,
+)
+from app.api.middleware import profile_requested
+from app.services.job_queue import job_queue
+from app.services.prediction_jobs import submit_prediction
+from app.services.raster_store import raster_store
+from app.services.executor import decode_executor
+from app.services.policy import validate_policy
+from app.services.scenario_comparison import compare_rasters
 
 router = APIRouter()
 
@@ -10,33 +26,97 @@ simulations_store: dict[str, PolicySimulation] = {}
 
 
 @router.post("/simulate", response_model=PolicySimulation)
-async def simulate_policy(simulation_data: dict):
-    """Simulate policy impact on crop yields."""
-    simulation_id = str(uuid.uuid4())
+async def simulate_policy(simulation_data: dict, http_request: Request):
+    """
+    Simulate policy impact on crop yields.
+    
+    The baseline prediction's request is re-run with the policy applied to
+    its urban expansion data. The simulation is predicted tile by tile
+    through the tile result cache, so only tiles the policy changes are
+    sent to the model again when the baseline (or an earlier simulation of
+    it) was predicted with the same tiling. Simulations are tiled even when
+    the baseline request disabled tiling, unless `tiled` is given.
+    """
+    baseline_id = simulation_data.get("baselinePredictionId")
+    if not baseline_id:
+        raise HTTPException(status_code=400, detail="baselinePredictionId is required")
+    baseline_request = await asyncio.to_thread(job_queue.get_request, baseline_id)
+    if baseline_request is None:
+        raise HTTPException(status_code=404, detail="Baseline prediction not found")
+    
+    try:
+        policy = UrbanPolicy(
+            urbanGrowthBoundaries=simulation_data.get("urbanGrowthBoundaries"),
+            zoningRegulations=simulation_data.get("zoningRegulations"),
+        )
+        validate_policy(policy)
+    except (ValidationError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
+    update = {"policy": policy, "tiled": True}
+    for field in ("tiled", "tileSize", "tileOverlap"):
+        if simulation_data.get(field) is not None:
+            update[field] = simulation_data[field]
+    try:
+        # Validated like a new request, so tiling overrides respect the same bounds
+        request = PredictionRequest.model_validate({**baseline_request.model_dump(), **update})
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    prediction = await submit_prediction(request, profile=profile_requested(http_request))
+    
+    simulation_id = str(uuid.uuid4())
     simulation = PolicySimulation(
         id=simulation_id,
         name=simulation_data.get("name", "Policy Simulation"),
-        urbanGrowthBoundaries=simulation_data.get("urbanGrowthBoundaries"),
-        zoningRegulations=simulation_data.get("zoningRegulations"),
-        prediction=None,  # Would be generated by model
-        impactMetrics=simulation_data.get("impactMetrics"),
+        baselinePredictionId=baseline_id,
+        urbanGrowthBoundaries=policy.urbanGrowthBoundaries,
+        zoningRegulations=policy.zoningRegulations,
+        prediction=prediction,
+        impactMetrics=None,
     )
     
     simulations_store[simulation_id] = simulation
     
-    # TODO: Trigger prediction based on policy simulation
-    # This would involve modifying urban expansion data based on policy
-    # and running the model
-    
     return simulation
 
 
 @router.get("/{simulation_id}", response_model=PolicySimulation)
 async def get_simulation(simulation_id: str):
-    """Get policy simulation by ID."""
+    """
+    Get policy simulation by ID. Once its prediction has completed, impact
+    metrics are computed against the baseline prediction.
+    """
     if simulation_id not in simulations_store:
         raise HTTPException(status_code=404, detail="Simulation not found")
     
-    return simulations_store[simulation_id]
+    simulation = simulations_store[simulation_id]
+    if simulation.prediction is not None and simulation.impactMetrics is None:
+        prediction = await asyncio.to_thread(job_queue.get, simulation.prediction.id) or simulation.prediction
+        simulation.prediction = prediction
+        if prediction.status == PredictionStatus.completed:
+            simulation.impactMetrics = await _impact_metrics(simulation.baselinePredictionId, prediction)
+    
+    return simulation
 
+
+async def _impact_metrics(baseline_id: Optional[str], prediction: PredictionResponse) -> Optional[dict]:
+    """Yield change and affected area of a simulation relative to its baseline, per pixel."""
+    baseline = await asyncio.to_thread(job_queue.get, baseline_id) if baseline_id else None
+    if baseline is None or baseline.status != PredictionStatus.completed:
+        return None
+    baseline_path = raster_store.raster_path(baseline.id)
+    simulation_path = raster_store.raster_path(prediction.id)
+    if not baseline_path.exists() or not simulation_path.exists():
+        return None
+    
+    summary = (await decode_executor.run(
+        compare_rasters, str(baseline_path), {"simulation": str(simulation_path)}, 0.0, []
+    ))["simulation"]
+    baseline_mean = summary["baselineMean"]
+    if summary["meanDelta"] is None or not baseline_mean:
+        return None
+    return ImpactMetrics(
+        yieldLossPercentage=-summary["meanDelta"] / baseline_mean * 100,
+        affectedArea=summary["areaAboveThresholdKm2"] or 0.0,
+        priorityAreas=[],
+    ).model_dump()
@@ -1,116 +1,302 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from typing import List
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+import os
 import uuid
+import asyncio
 from datetime import datetime
 from app.models.schemas import (
     PredictionRequest,
     PredictionResponse,
     PredictionStatus,
-    ModelMetrics,
+    Page,
+    BatchPredictionRequest,
+    BatchPredictionResponse,
 )
-from app.services.ml_service import MLService
-from app.services.data_processor import DataProcessor
-from app.services.file_handler import FileHandler
+from app.api.middleware import profile_requested
+from app.services.job_queue import job_queue
+from app.services.executor import decode_executor
+from app.services.raster_store import (
+    raster_store,
+    raster_info,
+    render_tile,
+    TILE_CACHE_CONTROL,
+    TILE_ZOOM_LIMIT,
+)
+from app.services.progress_events import progress_broker, TERMINAL_STATUSES
+from app.utils.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    decode_cursor,
+    encode_cursor,
+    ndjson_response,
+    parse_csv,
+    project,
+    to_timestamp,
+)
+from app.services.prediction_memo import PREDICTION_MEMO_TTL, request_fingerprint
+from app.services.prediction_jobs import submit_prediction
 
 router = APIRouter()
-ml_service = MLService()
-data_processor = DataProcessor()
-file_handler = FileHandler()
 
-# In-memory storage for predictions (in production, use a database)
-predictions_store: dict[str, PredictionResponse] = {}
+# Maximum number of items in one batch prediction request
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+# Maximum number of predictions watched by one event stream
+MAX_EVENT_STREAM_IDS = 100
+# Seconds between keep-alive comments on idle event streams
+EVENT_STREAM_KEEPALIVE = 15.0
 
 
-async def process_prediction(prediction_id: str, request: PredictionRequest):
-    """Background task to process prediction."""
-    try:
-        # Update status to processing
-        predictions_store[prediction_id].status = PredictionStatus.processing
-        
-        # Load and process data files
-        urban_file = file_handler.get_file_path(request.urbanDataId, "urban")
-        temp_file = file_handler.get_file_path(request.temperatureDataId, "climate")
-        prec_file = file_handler.get_file_path(request.precipitationDataId, "climate")
-        
-        if not all([urban_file, temp_file, prec_file]):
-            raise Exception("One or more data files not found")
-        
-        # Process data
-        urban_data = await data_processor.process_urban_data(str(urban_file))
-        temp_data = await data_processor.process_climate_data(str(temp_file), "temperature")
-        prec_data = await data_processor.process_climate_data(str(prec_file), "precipitation")
-        
-        historical_yield_data = None
-        if request.historicalYieldDataId:
-            hist_file = file_handler.get_file_path(request.historicalYieldDataId, "historical-yields")
-            if hist_file:
-                historical_yield_data = await data_processor.process_climate_data(str(hist_file), "yield")
-        
-        # Prepare model input
-        model_input = data_processor.prepare_model_input(
-            urban_data=urban_data,
-            temperature_data=temp_data,
-            precipitation_data=prec_data,
-            historical_yield_data=historical_yield_data,
-        )
-        
-        # Call ML model service
-        model_output = await ml_service.predict(model_input)
-        
-        # Update prediction with results
-        prediction = predictions_store[prediction_id]
-        prediction.status = PredictionStatus.completed
-        prediction.predictionMap = model_output.get("prediction_map")
-        prediction.metrics = ModelMetrics(
-            mae=model_output.get("mae", 0.0),
-            rmse=model_output.get("rmse", 0.0),
-            mse=model_output.get("mse", 0.0),
-            accuracy=model_output.get("accuracy"),
-        ) if model_output.get("metrics") else None
-        prediction.confidence = model_output.get("confidence")
-        prediction.completedAt = datetime.utcnow().isoformat()
-        
-    except Exception as e:
-        prediction = predictions_store[prediction_id]
-        prediction.status = PredictionStatus.failed
-        prediction.error = str(e)
-        prediction.completedAt = datetime.utcnow().isoformat()
+@router.post("", response_model=PredictionResponse)
+async def create_prediction(request: PredictionRequest, http_request: Request):
+    """
+    Create a new crop yield prediction request.
+    
+    Identical requests share one computation: a request matching one that is
+    still queued or running returns that prediction, and one matching a
+    recently completed prediction returns the stored result. Requests
+    profiled on an admin's request also profile the prediction run.
+    """
+    return await submit_prediction(request, profile=profile_requested(http_request))
 
 
-@router.post("", response_model=PredictionResponse)
-async def create_prediction(
-    request: PredictionRequest,
-    background_tasks: BackgroundTasks,
-):
-    """Create a new crop yield prediction request."""
-    prediction_id = str(uuid.uuid4())
-    
-    # Create initial prediction response
-    prediction = PredictionResponse(
-        id=prediction_id,
-        status=PredictionStatus.pending,
-        createdAt=datetime.utcnow().isoformat(),
+@router.post("/batch", response_model=BatchPredictionResponse)
+async def create_prediction_batch(request: BatchPredictionRequest, http_request: Request):
+    """
+    Create predictions for several (year, region) combinations at once.
+    
+    Every item becomes a regular prediction (deduplicated like single
+    requests), queued as one batch: a worker claims the batch's items
+    together, reads each uploaded file once for all of them and runs their
+    model calls concurrently.
+    """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400, detail=f"A batch may contain at most {BATCH_MAX_ITEMS} items"
+        )
+    
+    batch_id = str(uuid.uuid4())
+    created_at = datetime.utcnow().isoformat()
+    shared = request.model_dump(exclude={"items"})
+    items = []
+    for item in request.items:
+        item_request = PredictionRequest(**shared, year=item.year, region=item.region)
+        prediction = PredictionResponse(
+            id=str(uuid.uuid4()),
+            status=PredictionStatus.pending,
+            createdAt=created_at,
+        )
+        items.append((item_request, prediction, request_fingerprint(item_request)))
+    
+    predictions = await asyncio.to_thread(
+        job_queue.enqueue_batch,
+        batch_id, items, reuse_within=PREDICTION_MEMO_TTL, profile=profile_requested(http_request),
     )
+    return _batch_response(batch_id, predictions)
+
+
+@router.get("/batch/{batch_id}", response_model=BatchPredictionResponse)
+async def get_prediction_batch(batch_id: str):
+    """Get a batch with the current status of each of its predictions."""
+    predictions = await asyncio.to_thread(job_queue.get_batch, batch_id)
+    if predictions is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
     
-    predictions_store[prediction_id] = prediction
+    return _batch_response(batch_id, predictions)
+
+
+def _batch_response(batch_id: str, predictions: List[PredictionResponse]) -> BatchPredictionResponse:
+    counts: Dict[str, int] = {}
+    for prediction in predictions:
+        counts[prediction.status.value] = counts.get(prediction.status.value, 0) + 1
+    statuses = {prediction.status for prediction in predictions}
+    if statuses == {PredictionStatus.pending}:
+        status = PredictionStatus.pending
+    elif statuses - TERMINAL_STATUSES:
+        status = PredictionStatus.processing
+    elif statuses == {PredictionStatus.completed}:
+        status = PredictionStatus.completed
+    elif PredictionStatus.failed in statuses:
+        status = PredictionStatus.failed
+    else:
+        status = PredictionStatus.cancelled
+    return BatchPredictionResponse(id=batch_id, status=status, counts=counts, items=predictions)
+
+
+@router.get("/events")
+async def stream_prediction_events(ids: str = Query(..., description="Comma-separated prediction IDs")):
+    """
+    Stream status, stage and progress updates for one or more predictions as
+    server-sent events.
     
-    # Start background processing
-    background_tasks.add_task(process_prediction, prediction_id, request)
+    Each event is a `prediction` event whose data is the full prediction
+    JSON. The current state of every prediction is sent first; the stream
+    ends once all of them are completed, failed or cancelled.
+    """
+    prediction_ids = list(dict.fromkeys(parse_csv(ids) or []))
+    if not prediction_ids or len(prediction_ids) > MAX_EVENT_STREAM_IDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Provide between 1 and {MAX_EVENT_STREAM_IDS} prediction IDs",
+        )
+    current = {
+        prediction_id: await asyncio.to_thread(job_queue.get, prediction_id)
+        for prediction_id in prediction_ids
+    }
+    missing = [prediction_id for prediction_id, prediction in current.items() if prediction is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Prediction not found: {', '.join(missing)}")
     
-    return prediction
+    queue = progress_broker.subscribe(prediction_ids, current)
+    
+    async def events() -> AsyncIterator[str]:
+        try:
+            active = set(prediction_ids)
+            updates = list(current.values())
+            while True:
+                for prediction in updates:
+                    yield f"event: prediction\ndata: {prediction.model_dump_json()}\n\n"
+                    if prediction.status in TERMINAL_STATUSES:
+                        active.discard(prediction.id)
+                if not active:
+                    return
+                try:
+                    updates = [await asyncio.wait_for(queue.get(), EVENT_STREAM_KEEPALIVE)]
+                except asyncio.TimeoutError:
+                    updates = []
+                    yield ": keep-alive\n\n"
+        finally:
+            progress_broker.unsubscribe(prediction_ids, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/{prediction_id}", response_model=PredictionResponse)
 async def get_prediction(prediction_id: str):
     """Get prediction by ID."""
-    if prediction_id not in predictions_store:
+    prediction = await asyncio.to_thread(job_queue.get, prediction_id)
+    if prediction is None:
         raise HTTPException(status_code=404, detail="Prediction not found")
     
-    return predictions_store[prediction_id]
+    return prediction
 
 
-@router.get("", response_model=List[PredictionResponse])
-async def list_predictions():
-    """List all predictions."""
-    return list(predictions_store.values())
+@router.post("/{prediction_id}/cancel", response_model=PredictionResponse)
+async def cancel_prediction(prediction_id: str):
+    """Cancel a pending or running prediction."""
+    prediction = await asyncio.to_thread(job_queue.cancel, prediction_id)
+    if prediction is None:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+    
+    return prediction
+
 
+@router.get("", response_model=Page)
+async def list_predictions(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    status: Optional[str] = Query(None, description="Comma-separated statuses"),
+    createdAfter: Optional[datetime] = None,
+    createdBefore: Optional[datetime] = None,
+    region: Optional[str] = Query(None, description="Region name of the request"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,status"),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """
+    List predictions in creation order, one page at a time.
+    
+    Pass `nextCursor` from a page as `cursor` to get the next one. With
+    `format=ndjson` all matching predictions (or `limit` of them) are
+    streamed as newline-delimited JSON instead, fetched from the queue in
+    pages so the full list is never held in memory.
+    """
+    statuses = parse_csv(status)
+    if statuses and not statuses <= {s.value for s in PredictionStatus}:
+        raise HTTPException(status_code=400, detail=f"Unknown status in '{status}'")
+    selected = parse_csv(fields)
+    filters = {
+        "statuses": statuses,
+        "created_after": to_timestamp(createdAfter),
+        "created_before": to_timestamp(createdBefore),
+        "region": region,
+    }
+    # Predictions sort by (created_at epoch seconds, id)
+    after = decode_cursor(cursor, (float, str))
+    
+    if format == "ndjson":
+        def stream() -> Iterator[dict]:
+            key, remaining = after, limit
+            while remaining is None or remaining > 0:
+                size = MAX_PAGE_SIZE if remaining is None else min(remaining, MAX_PAGE_SIZE)
+                items, key = job_queue.page(size, key, **filters)
+                for item in items:
+                    yield project(item, selected)
+                if remaining is not None:
+                    remaining -= len(items)
+                if key is None:
+                    break
+        
+        return ndjson_response(stream())
+    
+    items, next_key = await asyncio.to_thread(
+        job_queue.page, limit or DEFAULT_PAGE_SIZE, after, **filters
+    )
+    return Page(
+        items=[project(item, selected) for item in items],
+        nextCursor=encode_cursor(next_key) if next_key else None,
+    )
+
+
+@router.get("/{prediction_id}/tiles.json")
+async def get_prediction_tilejson(prediction_id: str, request: Request):
+    """Describe a prediction's map tiles (TileJSON)."""
+    info = await decode_executor.run(raster_info, str(raster_store.raster_path(prediction_id)))
+    if info is None:
+        raise HTTPException(status_code=404, detail="Prediction map not found")
+    
+    base_url = str(request.url).split("?")[0].rsplit("/", 1)[0]
+    return {
+        "tilejson": "2.2.0",
+        "scheme": "xyz",
+        "tiles": [base_url + "/tiles/{z}/{x}/{y}.png"],
+        **info,
+    }
+
+
+@router.get("/{prediction_id}/tiles/{z}/{x}/{y}.png")
+async def get_prediction_tile(prediction_id: str, z: int, x: int, y: int, request: Request):
+    """
+    Get one map tile of a prediction as a PNG.
+    
+    Tiles are rendered on first request and cached. Responses carry an ETag
+    and Cache-Control, and `If-None-Match` requests for unchanged tiles get
+    a 304 without a body.
+    """
+    # Bound the zoom before computing 2 ** z
+    if not 0 <= z <= TILE_ZOOM_LIMIT or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Tile coordinates out of range")
+    version = await asyncio.to_thread(raster_store.etag, prediction_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Prediction map not found")
+    
+    etag = f'"{version}-{z}-{x}-{y}"'
+    headers = {"ETag": etag, "Cache-Control": TILE_CACHE_CONTROL}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    content = await asyncio.to_thread(raster_store.cached_tile, prediction_id, z, x, y)
+    if content is None:
+        try:
+            rendered = await decode_executor.run(
+                render_tile, str(raster_store.raster_path(prediction_id)), z, x, y
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Prediction map not found")
+        content = await asyncio.to_thread(raster_store.keep_tile, prediction_id, z, x, y, rendered)
+    return Response(content=content, media_type="image/png", headers=headers)
@@ -1,13 +1,33 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from typing import Any, Dict, Iterator, List, Optional
 import uuid
+import asyncio
+from pathlib import Path
 from datetime import datetime
+from itertools import islice
 from app.models.schemas import (
+    PredictionStatus,
     Scenario,
     ScenarioComparisonRequest,
     UrbanExpansionData,
     ClimateData,
+    Page,
 )
+from app.utils.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    decode_cursor,
+    encode_cursor,
+    ndjson_response,
+    parse_csv,
+    project,
+    to_timestamp,
+)
+from app.services.executor import decode_executor
+from app.services.file_handler import FileHandler
+from app.services.job_queue import job_queue
+from app.services.raster_store import raster_store
+from app.services.scenario_comparison import compare_rasters
 
 router = APIRouter()
 
@@ -60,10 +80,52 @@ async def get_scenario(scenario_id: str):
     return scenarios_store[scenario_id]
 
 
-@router.get("", response_model=List[Scenario])
-async def list_scenarios():
-    """List all scenarios."""
-    return list(scenarios_store.values())
+@router.get("", response_model=Page)
+async def list_scenarios(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    createdAfter: Optional[datetime] = None,
+    createdBefore: Optional[datetime] = None,
+    region: Optional[str] = Query(None, description="Region of the scenario's urban data"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,name"),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """
+    List scenarios in creation order, one page at a time.
+    
+    Pagination, projection and `format=ndjson` streaming work as for
+    predictions. Project away `predictions` to skip embedded results.
+    """
+    # Scenarios sort by (createdAt ISO string, id)
+    after = decode_cursor(cursor, (str, str))
+    created_after = to_timestamp(createdAfter)
+    created_before = to_timestamp(createdBefore)
+    selected = parse_csv(fields)
+    
+    def matching() -> Iterator[Scenario]:
+        for scenario in sorted(scenarios_store.values(), key=lambda s: (s.createdAt, s.id)):
+            if after is not None and (scenario.createdAt, scenario.id) <= after:
+                continue
+            created = to_timestamp(datetime.fromisoformat(scenario.createdAt))
+            if created_after is not None and created < created_after:
+                continue
+            if created_before is not None and created >= created_before:
+                continue
+            if region and scenario.urbanData.region != region:
+                continue
+            yield scenario
+    
+    if format == "ndjson":
+        selected_scenarios = islice(matching(), limit)
+        return ndjson_response(project(scenario, selected) for scenario in selected_scenarios)
+    
+    page = list(islice(matching(), (limit or DEFAULT_PAGE_SIZE) + 1))
+    items = page[:limit or DEFAULT_PAGE_SIZE]
+    last = items[-1] if len(page) > len(items) else None
+    return Page(
+        items=[project(scenario, selected) for scenario in items],
+        nextCursor=encode_cursor((last.createdAt, last.id)) if last else None,
+    )
 
 
 @router.patch("/{scenario_id}", response_model=Scenario)
@@ -97,7 +159,16 @@ async def delete_scenario(scenario_id: str):
 
 @router.post("/compare")
 async def compare_scenarios(request: ScenarioComparisonRequest):
-    """Compare multiple scenarios."""
+    """
+    Compare scenarios pixel by pixel against the first one.
+    
+    For each other scenario, its urban raster and the raster of its latest
+    completed prediction are differenced from the baseline's on the
+    baseline's grid, and summarized as mean, spread, extremes, percentiles
+    and the area whose difference exceeds the threshold. Urban rasters are
+    compared as urban (value above 0) or not, so `meanDelta` is the change
+    in urban share. Scenarios without a raster get an `error` entry.
+    """
     scenarios = []
     for scenario_id in request.scenarioIds:
         if scenario_id not in scenarios_store:
@@ -107,13 +178,26 @@ async def compare_scenarios(request: ScenarioComparisonRequest):
             )
         scenarios.append(scenarios_store[scenario_id])
     
-    # Calculate differences (simplified)
+    baseline = scenarios[0] if scenarios else None
+    others = scenarios[1:]
+    urban_paths = {s.id: FileHandler.get_file_path(s.urbanData.id, "urban") for s in scenarios}
+    yield_paths = {s.id: await asyncio.to_thread(_prediction_raster, s) for s in scenarios}
+    try:
+        yield_differences = await _compare(
+            baseline, others, yield_paths, request.yieldThreshold, request, binarize=False
+        )
+        urban_differences = await _compare(
+            baseline, others, urban_paths, request.urbanThreshold, request, binarize=True
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     differences = {
         "scenario_count": len(scenarios),
+        "baselineId": baseline.id if baseline else None,
         "comparison_metrics": {
-            # This would contain actual comparison logic
-            "yield_differences": {},
-            "urban_extent_differences": {},
+            "yield_differences": yield_differences,
+            "urban_extent_differences": urban_differences,
         },
     }
     
@@ -122,3 +206,41 @@ async def compare_scenarios(request: ScenarioComparisonRequest):
         "differences": differences,
     }
 
+
+def _prediction_raster(scenario: Scenario) -> Optional[Path]:
+    """Stored raster of the scenario's latest completed prediction, if any."""
+    for prediction in reversed(scenario.predictions or []):
+        current = job_queue.get(prediction.id) or prediction
+        path = raster_store.raster_path(prediction.id)
+        if current.status == PredictionStatus.completed and path.exists():
+            return path
+    return None
+
+
+async def _compare(
+    baseline: Optional[Scenario],
+    others: List[Scenario],
+    paths: Dict[str, Optional[Path]],
+    threshold: float,
+    request: ScenarioComparisonRequest,
+    binarize: bool,
+) -> Dict[str, Dict[str, Any]]:
+    if baseline is None or not others:
+        return {}
+    if paths[baseline.id] is None:
+        return {s.id: {"error": "Baseline scenario has no raster to compare"} for s in others}
+    results: Dict[str, Dict[str, Any]] = {
+        s.id: {"error": "Scenario has no raster to compare"} for s in others if paths[s.id] is None
+    }
+    available = {s.id: str(paths[s.id]) for s in others if paths[s.id] is not None}
+    if available:
+        results.update(await decode_executor.run(
+            compare_rasters,
+            str(paths[baseline.id]),
+            available,
+            threshold,
+            request.percentiles,
+            request.differenceRasterSize,
+            binarize,
+        ))
+    return {s.id: results[s.id] for s in others}
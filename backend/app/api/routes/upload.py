@@ -1,7 +1,9 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from typing import Optional
+import asyncio
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Form, HTTPException
+from typing import Any, Awaitable, Callable, Dict, Optional
 from app.models.schemas import UrbanExpansionData, ClimateData, HistoricalYieldData, ClimateDataType
-from app.services.file_handler import FileHandler
+from app.services.file_handler import FileHandler, SavedFile
+from app.services.zonal_stats import zonal_stats
 from app.utils.validation import validate_tiff_file, validate_netcdf_file, read_tiff_metadata, read_netcdf_metadata
 from datetime import datetime
 
@@ -9,8 +11,33 @@ router = APIRouter()
 file_handler = FileHandler()
 
 
+async def _file_metadata(
+    saved: SavedFile,
+    read_metadata: Callable[[str], Awaitable[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """
+    Read an upload's metadata once per content and store it as the file's
+    sidecar, so later stages plan their reads without opening the file.
+    Reading also validates the file (400 if it cannot be opened).
+    """
+    metadata = await asyncio.to_thread(FileHandler.find_file_metadata, saved.checksum) if saved.duplicate else None
+    if metadata is None:
+        try:
+            metadata = await read_metadata(saved.path)
+        except HTTPException:
+            # Unreadable upload; do not keep it
+            record = FileHandler.get_file_record(saved.file_id)
+            if record is not None:
+                FileHandler.delete_file(saved.file_id, record.subdirectory)
+            raise
+    if 'note' not in metadata:
+        await asyncio.to_thread(FileHandler.save_file_metadata, saved.path, metadata)
+    return metadata
+
+
 @router.post("/urban", response_model=UrbanExpansionData)
 async def upload_urban_expansion(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     year: Optional[int] = Form(None),
     region: Optional[str] = Form(None),
@@ -22,13 +49,21 @@ async def upload_urban_expansion(
         raise HTTPException(status_code=400, detail=error_msg)
     
     # Save file
-    file_path, file_id = await file_handler.save_upload_file(file, "urban")
+    saved = await file_handler.save_upload_file(
+        file, "urban", {"filename": file.filename, "year": year, "region": region}
+    )
+    
+    # Read metadata (already validated when identical content was first uploaded)
+    metadata = await _file_metadata(saved, read_tiff_metadata)
+    await asyncio.to_thread(file_handler.update_metadata, saved.file_id, {"raster": metadata})
     
-    # Read metadata
-    metadata = await read_tiff_metadata(file_path)
+    # Urban extent by region for this year, aggregated after the response
+    if year is not None:
+        await asyncio.to_thread(zonal_stats.add_source, saved.file_id, "urban", saved.path, year)
+        background_tasks.add_task(zonal_stats.refresh)
     
     return UrbanExpansionData(
-        id=file_id,
+        id=saved.file_id,
         filename=file.filename or "unknown.tiff",
         uploadedAt=datetime.utcnow().isoformat(),
         year=year,
@@ -58,13 +93,16 @@ async def upload_climate_data(
         raise HTTPException(status_code=400, detail=error_msg)
     
     # Save file
-    file_path, file_id = await file_handler.save_upload_file(file, "climate")
+    saved = await file_handler.save_upload_file(
+        file, "climate", {"filename": file.filename, "type": climate_type.value, "year": year}
+    )
     
-    # Read metadata (optional)
-    # metadata = await read_netcdf_metadata(file_path)
+    # Read metadata: grid, variables and years
+    metadata = await _file_metadata(saved, read_netcdf_metadata)
+    await asyncio.to_thread(file_handler.update_metadata, saved.file_id, {"years": metadata.get("years", [])})
     
     return ClimateData(
-        id=file_id,
+        id=saved.file_id,
         filename=file.filename or "unknown.nc",
         type=climate_type,
         uploadedAt=datetime.utcnow().isoformat(),
@@ -74,6 +112,7 @@ async def upload_climate_data(
 
 @router.post("/historical-yields", response_model=HistoricalYieldData)
 async def upload_historical_yields(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
 ):
     """Upload historical crop yield data (NetCDF format)."""
@@ -83,13 +122,21 @@ async def upload_historical_yields(
         raise HTTPException(status_code=400, detail=error_msg)
     
     # Save file
-    file_path, file_id = await file_handler.save_upload_file(file, "historical-yields")
+    saved = await file_handler.save_upload_file(
+        file, "historical-yields", {"filename": file.filename}
+    )
+    
+    # Read metadata: grid, variables and years
+    metadata = await _file_metadata(saved, read_netcdf_metadata)
+    years = metadata.get("years", [])
+    await asyncio.to_thread(file_handler.update_metadata, saved.file_id, {"years": years})
     
-    # TODO: Extract years from NetCDF file
-    years = []
+    # Yield by region and year, aggregated after the response
+    await asyncio.to_thread(zonal_stats.add_source, saved.file_id, "yield", saved.path)
+    background_tasks.add_task(zonal_stats.refresh)
     
     return HistoricalYieldData(
-        id=file_id,
+        id=saved.file_id,
         filename=file.filename or "unknown.nc",
         uploadedAt=datetime.utcnow().isoformat(),
         years=years,
@@ -1,17 +1,64 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import os
 from dotenv import load_dotenv
 
-from app.api.routes import predictions, upload, scenarios, analytics, policy
-
 load_dotenv()
 
+from app.api.routes import predictions, upload, scenarios, analytics, policy, admin
+from app.api.dependencies import require_admin
+from app.api.middleware import ProfilingMiddleware
+from app.services.ml_service import ml_service
+from app.services.executor import decode_executor
+from app.services.file_handler import file_index
+from app.services.progress_events import progress_broker
+from app.services.zonal_stats import zonal_stats
+from app.services.job_queue import job_queue
+from app.services.array_cache import array_cache
+from app.services.prediction_memo import prediction_memo
+from app.services.tile_cache import tile_result_cache
+from app.services.regridding import regridder
+from app.services import metrics
+from app.worker import PredictionWorker
+from app.models.schemas import PredictionStatus
+
+# Prediction jobs run by the API process itself; set to 0 when running
+# separate workers with `python -m app.worker`
+INLINE_PREDICTION_WORKERS = int(os.getenv("INLINE_PREDICTION_WORKERS", "1"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled HTTP client to the model service, shared by all routes
+    await ml_service.start()
+    # Rebuild the upload index from the manifest and upload directory
+    await asyncio.to_thread(file_index.load)
+    # Index uploads made before the analytics index existed (no-op for known files)
+    await asyncio.to_thread(
+        zonal_stats.register_uploads,
+        file_index.records("urban"),
+        file_index.records("historical-yields"),
+    )
+    worker = None
+    if INLINE_PREDICTION_WORKERS > 0:
+        worker = PredictionWorker(concurrency=INLINE_PREDICTION_WORKERS)
+        worker.start()
+    yield
+    if worker:
+        await worker.stop()
+    await progress_broker.close()
+    await ml_service.close()
+    decode_executor.shutdown()
+
+
 app = FastAPI(
     title="URBAN API",
     description="API for Urban Expansion and Crop Yield Analysis",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS configuration
@@ -22,6 +69,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Opt-in sampling profiles of requests (see app/services/profiling.py)
+app.add_middleware(ProfilingMiddleware)
 
 # Include routers
 app.include_router(upload.router, prefix="/api/upload", tags=["upload"])
@@ -29,6 +78,9 @@ app.include_router(predictions.router, prefix="/api/predictions", tags=["predict
 app.include_router(scenarios.router, prefix="/api/scenarios", tags=["scenarios"])
 app.include_router(policy.router, prefix="/api/policy", tags=["policy"])
 app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
+app.include_router(
+    admin.router, prefix="/api/admin", tags=["admin"], dependencies=[Depends(require_admin)]
+)
 
 
 @app.get("/")
@@ -38,7 +90,30 @@ async def root():
 
 @app.get("/api/health")
 async def health():
-    return {"status": "healthy"}
+    return {"status": "healthy", "decodeQueue": decode_executor.stats()}
+
+
+@app.get("/api/metrics")
+async def prometheus_metrics():
+    """Stage timings, bytes read, cache hit rates and queue state in the Prometheus text format."""
+    job_counts = await asyncio.to_thread(job_queue.stats)
+    for status in PredictionStatus:
+        metrics.jobs.set(job_counts.get(status.value, 0), status=status.value)
+    decode = decode_executor.stats()
+    metrics.decode_tasks.set(decode["queued"], state="queued")
+    metrics.decode_tasks.set(decode["running"], state="running")
+    metrics.model_requests_in_flight.set(ml_service.in_flight)
+    # Stage timings of jobs completed by any worker, from the queue database
+    await asyncio.to_thread(job_queue.load_timing_histograms)
+    for name, cache in (
+        ("array", array_cache),
+        ("prediction_memo", prediction_memo),
+        ("tile_result", tile_result_cache),
+        ("regrid", regridder),
+    ):
+        metrics.cache_hits.set(cache.hits, cache=name)
+        metrics.cache_misses.set(cache.misses, cache=name)
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.exception_handler(Exception)
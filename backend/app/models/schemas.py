@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, ValidationInfo, model_validator
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
@@ -14,6 +14,14 @@ class PredictionStatus(str, Enum):
     processing = "processing"
     completed = "completed"
     failed = "failed"
+    cancelled = "cancelled"
+
+
+class PredictionStage(str, Enum):
+    load = "load"
+    prepare = "prepare"
+    inference = "inference"
+    stitch = "stitch"
 
 
 class UrbanExpansionData(BaseModel):
@@ -53,6 +61,30 @@ class Region(BaseModel):
     code: Optional[str] = None
 
 
+class UrbanPolicy(BaseModel):
+    """Land-use policy applied to the urban expansion input of a prediction."""
+    # GeoJSON (WGS84) areas where urban growth is allowed; urban pixels outside revert to non-urban
+    urbanGrowthBoundaries: Optional[Dict[str, Any]] = None
+    # {"nonUrbanValue": 0, "zones": [{"geometry": GeoJSON, "value": 0..1}]}; zones set the urban value inside them
+    zoningRegulations: Optional[Dict[str, Any]] = None
+
+
+def _check_tile_overlap(request, info: ValidationInfo):
+    """
+    Overlap must stay below half a tile, or tiles would be mostly context.
+    Requests read back from the job queue (context {"stored": True}) are not
+    checked, so jobs queued before this limit still run.
+    """
+    if request.tileOverlap is None or (info.context or {}).get("stored"):
+        return request
+    # Imported here: the tiling service imports these schemas
+    from app.services.tiled_inference import TILED_INFERENCE_TILE_SIZE
+    tile_size = request.tileSize or TILED_INFERENCE_TILE_SIZE
+    if request.tileOverlap >= tile_size // 2:
+        raise ValueError(f"tileOverlap must be less than half of tileSize ({tile_size // 2})")
+    return request
+
+
 class PredictionRequest(BaseModel):
     urbanDataId: str
     temperatureDataId: str
@@ -60,6 +92,37 @@ class PredictionRequest(BaseModel):
     historicalYieldDataId: Optional[str] = None
     year: int
     region: Optional[Region] = None
+    # Tiled inference; tiling is used automatically for large inputs when not set
+    tiled: Optional[bool] = None
+    tileSize: Optional[int] = Field(None, ge=64, le=8192)
+    tileOverlap: Optional[int] = Field(None, ge=0)
+    # Policy what-if: applied to the urban input; predicted tile by tile, reusing cached tile results
+    policy: Optional[UrbanPolicy] = None
+    
+    @model_validator(mode="after")
+    def check_tile_overlap(self, info: ValidationInfo):
+        return _check_tile_overlap(self, info)
+
+
+class BatchPredictionItem(BaseModel):
+    year: int
+    region: Optional[Region] = None
+
+
+class BatchPredictionRequest(BaseModel):
+    """Predictions for several (year, region) combinations over the same uploaded files."""
+    urbanDataId: str
+    temperatureDataId: str
+    precipitationDataId: str
+    historicalYieldDataId: Optional[str] = None
+    items: List[BatchPredictionItem] = Field(..., min_length=1)
+    tiled: Optional[bool] = None
+    tileSize: Optional[int] = Field(None, ge=64, le=8192)
+    tileOverlap: Optional[int] = Field(None, ge=0)
+    
+    @model_validator(mode="after")
+    def check_tile_overlap(self, info: ValidationInfo):
+        return _check_tile_overlap(self, info)
 
 
 class ModelMetrics(BaseModel):
@@ -69,15 +132,44 @@ class ModelMetrics(BaseModel):
     accuracy: Optional[float] = None
 
 
+class PredictionTimings(BaseModel):
+    total: float  # Seconds from the start of processing to completion
+    stages: Dict[str, float]  # Seconds per pipeline stage, summed over tiles and retries
+    bytesRead: int  # Bytes of processed input arrays loaded (decoded or from the array cache)
+
+
 class PredictionResponse(BaseModel):
     id: str
     status: PredictionStatus
     predictionMap: Optional[str] = None  # Base64 encoded or URL
+    tileUrl: Optional[str] = None  # XYZ tile URL template for stored prediction rasters
     metrics: Optional[ModelMetrics] = None
     confidence: Optional[float] = None
     createdAt: str
     completedAt: Optional[str] = None
     error: Optional[str] = None
+    stage: Optional[PredictionStage] = None  # Pipeline stage while processing
+    progress: Optional[float] = None  # 0-1, reported while tiles complete
+    tilesTotal: Optional[int] = None
+    tilesCompleted: Optional[int] = None
+    tilesCached: Optional[int] = None  # Tiles served from the tile result cache instead of the model
+    timings: Optional[PredictionTimings] = None  # Set on completion
+
+
+class ProfileInfo(BaseModel):
+    id: str  # Request or prediction ID
+    kind: str  # "request" or "prediction"
+    target: str  # e.g. "POST /api/predictions", or the prediction's job
+    startedAt: str
+    duration: float  # Seconds profiled
+    samples: int
+
+
+class BatchPredictionResponse(BaseModel):
+    id: str
+    status: PredictionStatus  # Overall status derived from the items
+    counts: Dict[str, int]  # Number of items per status
+    items: List[PredictionResponse]  # In request order
 
 
 class Scenario(BaseModel):
@@ -92,13 +184,26 @@ class Scenario(BaseModel):
     updatedAt: str
 
 
+class Page(BaseModel):
+    """One page of a cursor-paginated listing; items may be projected to selected fields."""
+    items: List[Dict[str, Any]]
+    nextCursor: Optional[str] = None
+
+
 class ScenarioComparisonRequest(BaseModel):
-    scenarioIds: List[str]
+    scenarioIds: List[str]  # The first scenario is the baseline the others are compared to
+    # Pixels whose difference exceeds these (in absolute value) count towards the area above threshold
+    yieldThreshold: float = Field(0.0, ge=0)
+    urbanThreshold: float = Field(0.0, ge=0)
+    percentiles: List[float] = Field(default_factory=lambda: [5.0, 25.0, 50.0, 75.0, 95.0])
+    # Return difference rasters downsampled to at most this many pixels per side
+    differenceRasterSize: Optional[int] = Field(None, ge=16, le=2048)
 
 
 class PolicySimulation(BaseModel):
     id: str
     name: str
+    baselinePredictionId: Optional[str] = None
     urbanGrowthBoundaries: Optional[Dict[str, Any]] = None  # GeoJSON
     zoningRegulations: Optional[Dict[str, Any]] = None
     prediction: Optional[PredictionResponse] = None
@@ -115,18 +220,29 @@ class TimeSeriesDataPoint(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
     
     year: int
-    crop_yield: float = Field(alias="yield")
-    urbanExtent: float
+    # None for years without data for the metric
+    crop_yield: Optional[float] = Field(None, alias="yield")
+    urbanExtent: Optional[float] = None  # Share of the region's pixels that are urban
 
 
 class RegionalStats(BaseModel):
-    averageYield: float
-    totalUrbanExtent: float
+    averageYield: Optional[float] = None
+    totalUrbanExtent: Optional[float] = None  # Urban extent in the latest year with data
     yieldTrend: str  # 'increasing' | 'decreasing' | 'stable'
 
 
+class RegionDefinition(BaseModel):
+    """A region for analytics, given by bounds or a GeoJSON geometry in WGS84."""
+    id: Optional[str] = None
+    name: str
+    bounds: Optional[RegionBounds] = None
+    geometry: Optional[Dict[str, Any]] = None
+
+
 class AnalyticsData(BaseModel):
     regionId: str
     timeSeries: List[TimeSeriesDataPoint]
     regionalStats: RegionalStats
+    # Sources or regions are still being aggregated; the series may be incomplete
+    pending: bool = False
 
@@ -0,0 +1,147 @@
+import os
+import json
+import threading
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional
+import numpy as np
+
+CACHE_DIR = Path(os.getenv("ARRAY_CACHE_DIR", "cache/arrays"))
+# Total size of cached arrays on disk before least recently used entries are evicted
+ARRAY_CACHE_MAX_BYTES = int(os.getenv("ARRAY_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+
+class ArrayCache:
+    """
+    Disk cache of processed arrays, opened memory-mapped on hits.
+    
+    Each entry is a ``.npy`` file holding the array plus a ``.json`` file with
+    the remaining fields of the processed result (shape, transform, CRS, ...).
+    Entries are keyed by source ID and processing parameters and evicted in
+    least recently used order once the cache exceeds its size budget.
+    """
+    
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_bytes: int = ARRAY_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        # put() runs in worker threads; guards the index, not the file writes
+        self._lock = threading.RLock()
+    
+    def _load_index(self):
+        """Rebuild the LRU index from files on disk, least recently used first."""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self.cache_dir.exists():
+                return
+            entries = []
+            for data_path in self.cache_dir.glob("*.npy"):
+                stat = data_path.stat()
+                entries.append((stat.st_mtime, data_path.stem, stat.st_size))
+            for _, key, size in sorted(entries):
+                self._entries[key] = size
+                self._total_bytes += size
+    
+    @staticmethod
+    def make_key(source_id: str, kind: str, params: Dict[str, Any]) -> str:
+        """Build a cache key from a source ID and processing parameters."""
+        payload = json.dumps([source_id, kind, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, source_id: str, kind: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return the cached result with a memory-mapped ``data`` array, or None."""
+        if not self._loaded:
+            self._load_index()
+        key = self.make_key(source_id, kind, params)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+        try:
+            with open(self.cache_dir / f"{key}.json") as f:
+                result = json.load(f)
+            result["data"] = np.load(self.cache_dir / f"{key}.npy", mmap_mode="r")
+        except (OSError, ValueError):
+            # Entry removed or corrupted outside the cache; treat as a miss
+            with self._lock:
+                self._remove(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        # Bump mtime so recency survives restarts
+        os.utime(self.cache_dir / f"{key}.npy")
+        return result
+    
+    def put(self, source_id: str, kind: str, params: Dict[str, Any], result: Dict[str, Any]):
+        """Store a processed result whose ``data`` field is a NumPy array."""
+        if not self._loaded:
+            self._load_index()
+        key = self.make_key(source_id, kind, params)
+        data = np.asarray(result["data"])
+        if data.nbytes > self.max_bytes:
+            return
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        
+        metadata = {k: v for k, v in result.items() if k != "data"}
+        data_path = self.cache_dir / f"{key}.npy"
+        # Write to temporary names and rename so readers never see partial files
+        temp_data_path = self.cache_dir / f".{key}.npy.part"
+        temp_meta_path = self.cache_dir / f".{key}.json.part"
+        with open(temp_data_path, "wb") as f:
+            np.save(f, data)
+        with open(temp_meta_path, "w") as f:
+            json.dump(metadata, f, default=str)
+        os.replace(temp_meta_path, self.cache_dir / f"{key}.json")
+        os.replace(temp_data_path, data_path)
+        
+        size = data_path.stat().st_size
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+    
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+    
+    def _remove(self, key: str):
+        self._total_bytes -= self._entries.pop(key, 0)
+        # Open memory maps stay valid after unlink on POSIX systems; on Windows
+        # the file may still be in use, in which case it is left for later
+        for suffix in (".npy", ".json"):
+            try:
+                (self.cache_dir / f"{key}{suffix}").unlink(missing_ok=True)
+            except OSError:
+                pass
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current cache size."""
+        if not self._loaded:
+            self._load_index()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+# Shared instance used by DataProcessor
+array_cache = ArrayCache()
@@ -1,7 +1,11 @@
 import numpy as np
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple, Iterator, List, NamedTuple
 try:
     import rasterio
+    from rasterio.warp import transform_bounds
+    from rasterio.errors import WindowError
+    from rasterio.transform import Affine
+    from rasterio.windows import Window, from_bounds
     HAS_RASTERIO = True
 except ImportError:
     HAS_RASTERIO = False
@@ -10,75 +14,620 @@ try:
     HAS_XARRAY = True
 except ImportError:
     HAS_XARRAY = False
+try:
+    import dask  # noqa: F401
+    HAS_DASK = True
+except ImportError:
+    HAS_DASK = False
+import os
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
+from app.services.array_cache import array_cache
+from app.services.executor import decode_executor
+from app.services.regridding import align_model_input
+from app.services.file_handler import read_file_metadata
+from app.services.metrics import input_bytes, array_nbytes
+from app.models.schemas import RegionBounds
+
+# Region bounds in PredictionRequest are given in WGS84 longitude/latitude
+REGION_CRS = "EPSG:4326"
+LAT_NAMES = ('lat', 'latitude', 'y')
+LON_NAMES = ('lon', 'longitude', 'x')
+# Version of the climate result layout in the array cache; bump it when the
+# fields change so entries written by older code are not served (2: lat/lon/crs)
+CLIMATE_RESULT_FORMAT = 2
+
+# Number of NetCDF datasets kept open between requests
+NETCDF_HANDLE_CACHE_SIZE = int(os.getenv("NETCDF_HANDLE_CACHE_SIZE", "8"))
+# Batch regions are read in one window while its area is at most this many times theirs
+BATCH_REGION_MAX_OVERREAD = float(os.getenv("BATCH_REGION_MAX_OVERREAD", "2.0"))
+
+
+class _DatasetCache:
+    """
+    Small LRU of open xarray datasets, keyed by path and modification time.
+    
+    Readers hold a dataset through `acquire`; a dataset evicted while held
+    is closed when its last reader releases it.
+    """
+    
+    def __init__(self, max_size: int = NETCDF_HANDLE_CACHE_SIZE):
+        self.max_size = max_size
+        self._datasets: "OrderedDict[tuple, Any]" = OrderedDict()
+        # Readers per open dataset (by id), and evicted datasets still being read
+        self._readers: Dict[int, int] = {}
+        self._retired: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def acquire(self, file_path: str) -> Iterator[Any]:
+        stat = os.stat(file_path)
+        key = (file_path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key in self._datasets:
+                self._datasets.move_to_end(key)
+                ds = self._datasets[key]
+            else:
+                # Lazy, chunked backing with dask; without it xarray still loads on access only
+                ds = xr.open_dataset(file_path, chunks={} if HAS_DASK else None)
+                self._datasets[key] = ds
+                while len(self._datasets) > self.max_size:
+                    _, evicted = self._datasets.popitem(last=False)
+                    if self._readers.get(id(evicted)):
+                        self._retired[id(evicted)] = evicted
+                    else:
+                        evicted.close()
+            self._readers[id(ds)] = self._readers.get(id(ds), 0) + 1
+        try:
+            yield ds
+        finally:
+            with self._lock:
+                self._readers[id(ds)] -= 1
+                if not self._readers[id(ds)]:
+                    del self._readers[id(ds)]
+                    retired = self._retired.pop(id(ds), None)
+                    if retired is not None:
+                        retired.close()
+
+
+_open_datasets = _DatasetCache()
+
+
+class RasterGrid(NamedTuple):
+    """Georeferencing of a raster, as needed to plan windowed reads."""
+    crs: str
+    transform: Any
+    width: int
+    height: int
 
 
 class DataProcessor:
     """Process geospatial data for model input."""
     
     @staticmethod
-    async def process_urban_data(file_path: str) -> Dict[str, Any]:
-        """Process urban expansion TIFF file."""
+    def _raster_grid(file_path: str) -> Optional[RasterGrid]:
+        """Grid of an uploaded raster from its metadata sidecar, without opening it."""
+        metadata = read_file_metadata(file_path)
+        if not metadata or not metadata.get('transform') or metadata.get('crs') in (None, "", "None"):
+            return None
+        return RasterGrid(metadata['crs'], Affine(*metadata['transform'][:6]), metadata['width'], metadata['height'])
+    
+    @staticmethod
+    def _region_window(src, bounds: RegionBounds):
+        """
+        Convert region bounds to a pixel window of the raster, clipped to its
+        extent. `src` is an open dataset or a RasterGrid.
+        """
+        left, bottom, right, top = transform_bounds(
+            REGION_CRS, src.crs, bounds.west, bounds.south, bounds.east, bounds.north
+        )
+        window = from_bounds(left, bottom, right, top, transform=src.transform)
+        window = window.round_offsets().round_lengths()
+        full = Window(0, 0, src.width, src.height)
+        try:
+            return window.intersection(full)
+        except WindowError:
+            raise Exception("Region does not overlap the raster extent")
+    
+    @staticmethod
+    def _region_slice(data_array, bounds: RegionBounds, lon_360: Optional[bool] = None):
+        """
+        Select region bounds from a lat/lon gridded DataArray. `lon_360` says
+        whether the grid uses 0-360 longitudes; by default it is detected.
+        """
+        lat = next((d for d in data_array.dims if d.lower() in LAT_NAMES), None)
+        lon = next((d for d in data_array.dims if d.lower() in LON_NAMES), None)
+        if lat is None or lon is None:
+            return data_array
+        
+        west, east = bounds.west, bounds.east
+        if lon_360 is None:
+            lon_360 = float(data_array[lon].max()) > 180
+        lats = data_array[lat].values
+        lat_slice = slice(bounds.south, bounds.north) if lats[0] <= lats[-1] else slice(bounds.north, bounds.south)
+        if lon_360 and east - west >= 360:
+            subset = data_array.sel({lat: lat_slice})
+        elif lon_360 and west % 360 > east % 360:
+            # Region crosses the prime meridian of a 0-360 grid: join its western
+            # part, shifted to negative longitudes, to its eastern part
+            western = data_array.sel({lat: lat_slice, lon: slice(west % 360, None)})
+            western = western.assign_coords({lon: western[lon] - 360})
+            eastern = data_array.sel({lat: lat_slice, lon: slice(None, east % 360)})
+            subset = xr.concat([western, eastern], dim=lon)
+        else:
+            if lon_360:
+                # Grid uses 0-360 longitudes
+                west, east = west % 360, east % 360
+            subset = data_array.sel({lat: lat_slice, lon: slice(west, east)})
+        if subset.sizes[lat] == 0 or subset.sizes[lon] == 0:
+            raise Exception("Region does not overlap the climate grid")
+        return subset
+    
+    @staticmethod
+    def time_dim(data_array) -> Optional[str]:
+        """Name of a DataArray's time dimension, or None without one."""
+        return next(
+            (d for d in data_array.dims
+             if 'time' in d.lower() or d.lower() in ('year', 'years')
+             or np.issubdtype(data_array[d].dtype, np.datetime64)),
+            None,
+        )
+    
+    @staticmethod
+    def time_years(times):
+        """Year of each value of a time coordinate."""
+        # Decoded datetimes (numpy or cftime) expose .dt; otherwise assume a numeric year axis
+        return times.dt.year if times.dtype.kind in 'Mo' else times
+    
+    @staticmethod
+    def years(data_array) -> List[int]:
+        """Distinct years on a DataArray's time axis, in order; empty without one."""
+        time_dim = DataProcessor.time_dim(data_array)
+        if time_dim is None:
+            return []
+        return sorted({int(year) for year in DataProcessor.time_years(data_array[time_dim]).values})
+    
+    @staticmethod
+    def _select_year(data_array, year: Optional[int], time_steps: Optional[Dict[str, List[int]]] = None):
+        """
+        Select the time step(s) of the given year, averaging if there are several.
+        `time_steps` maps time dimensions to the year of each step (from the
+        upload's metadata), so the time axis need not be decoded.
+        
+        Without a year (or without a time axis) the first step is used, as before.
+        """
+        time_dim = DataProcessor.time_dim(data_array)
+        if time_dim is None or year is None:
+            if len(data_array.dims) > 2:
+                return data_array.isel({data_array.dims[0]: 0})
+            return data_array
+        
+        steps = (time_steps or {}).get(time_dim)
+        if steps is not None and len(steps) == data_array.sizes[time_dim]:
+            mask = np.asarray(steps) == year
+        else:
+            mask = (DataProcessor.time_years(data_array[time_dim]) == year).values
+        if not mask.any():
+            raise Exception(f"No time steps for year {year} in NetCDF file")
+        selected = data_array.isel({time_dim: np.flatnonzero(mask)})
+        if selected.sizes[time_dim] > 1:
+            return selected.mean(dim=time_dim)
+        return selected.isel({time_dim: 0})
+    
+    @staticmethod
+    def union_bounds(regions: List[Optional[RegionBounds]]) -> Optional[RegionBounds]:
+        """Smallest bounds covering all regions; None (full extent) if any region is None."""
+        if not regions or any(bounds is None for bounds in regions):
+            return None
+        return RegionBounds(
+            north=max(b.north for b in regions),
+            south=min(b.south for b in regions),
+            east=max(b.east for b in regions),
+            west=min(b.west for b in regions),
+        )
+    
+    @staticmethod
+    def _area(bounds: RegionBounds) -> float:
+        return max(bounds.east - bounds.west, 0.0) * max(bounds.north - bounds.south, 0.0)
+    
+    @staticmethod
+    def group_regions(
+        regions: List[Optional[RegionBounds]],
+        max_overread: float = BATCH_REGION_MAX_OVERREAD,
+    ) -> List[List[int]]:
+        """
+        Group region indices so each group is read as one window: the bounds
+        of a group cover at most `max_overread` times the summed area of its
+        regions, so regions far apart are read separately. A None region
+        (full extent) covers all others, so then all are read together.
+        """
+        if any(bounds is None for bounds in regions):
+            return [list(range(len(regions)))] if regions else []
+        groups: List[Tuple[List[int], float]] = []
+        for index, bounds in sorted(enumerate(regions), key=lambda item: (item[1].west, item[1].south)):
+            area = DataProcessor._area(bounds)
+            for position, (indices, total) in enumerate(groups):
+                union = DataProcessor.union_bounds([regions[i] for i in indices] + [bounds])
+                if DataProcessor._area(union) <= max_overread * (total + area):
+                    groups[position] = (indices + [index], total + area)
+                    break
+            else:
+                groups.append(([index], area))
+        return [sorted(indices) for indices, _ in groups]
+    
+    @staticmethod
+    def _urban_result(data: np.ndarray, transform, crs, data_bounds) -> Dict[str, Any]:
+        # Normalize data to 0-1 range if needed
+        if data.max() > 1.0:
+            data = data / data.max()
+        return {
+            'data': data,
+            'shape': data.shape,
+            'transform': list(transform),
+            'crs': str(crs),
+            'bounds': list(data_bounds),
+        }
+    
+    @staticmethod
+    def _read_urban(file_path: str, bounds: Optional[RegionBounds]) -> Dict[str, Any]:
+        """Decode and normalize the urban TIFF (blocking; runs on the decode pool)."""
         if not HAS_RASTERIO:
             raise Exception("rasterio is required for processing TIFF files. Please install it following instructions in WINDOWS_SETUP.md")
         try:
+            # Plan the window from the upload's metadata, failing before opening if it is empty
+            grid = DataProcessor._raster_grid(file_path)
+            window = DataProcessor._region_window(grid, bounds) if grid and bounds else None
             with rasterio.open(file_path) as src:
-                data = src.read(1)  # Read first band
-                transform = src.transform
-                crs = src.crs
+                if bounds:
+                    window = window or DataProcessor._region_window(src, bounds)
+                    data = src.read(1, window=window)  # Read first band, region only
+                    transform = src.window_transform(window)
+                    data_bounds = src.window_bounds(window)
+                else:
+                    data = src.read(1)  # Read first band
+                    transform = src.transform
+                    data_bounds = src.bounds
+                result = DataProcessor._urban_result(data, transform, src.crs, data_bounds)
+        except Exception as e:
+            raise Exception(f"Error processing urban data: {str(e)}")
+        return result
+    
+    @staticmethod
+    def _read_urban_regions(file_path: str, regions: List[Optional[RegionBounds]]) -> List[Dict[str, Any]]:
+        """
+        Decode the urban TIFF once per group of nearby `regions` (see
+        `group_regions`), over the union of the group, and crop one result
+        per region, each identical to `_read_urban` for that region.
+        """
+        if not HAS_RASTERIO:
+            raise Exception("rasterio is required for processing TIFF files. Please install it following instructions in WINDOWS_SETUP.md")
+        try:
+            # Plan all windows from the upload's metadata when it has it
+            grid = DataProcessor._raster_grid(file_path)
+            results: List[Optional[Dict[str, Any]]] = [None] * len(regions)
+            with rasterio.open(file_path) as src:
+                grid = grid or src
+                for group in DataProcessor.group_regions(regions):
+                    group_results = DataProcessor._crop_urban_regions(src, grid, [regions[i] for i in group])
+                    for index, result in zip(group, group_results):
+                        results[index] = result
+        except Exception as e:
+            raise Exception(f"Error processing urban data: {str(e)}")
+        return results
+    
+    @staticmethod
+    def _crop_urban_regions(src, grid, regions: List[Optional[RegionBounds]]) -> List[Dict[str, Any]]:
+        """Read the union of `regions` from an open raster and crop each region from it."""
+        union = DataProcessor.union_bounds(regions)
+        union_window = (
+            DataProcessor._region_window(grid, union) if union
+            else Window(0, 0, grid.width, grid.height)
+        )
+        windows = [
+            DataProcessor._region_window(grid, bounds) if bounds
+            else Window(0, 0, grid.width, grid.height)
+            for bounds in regions
+        ]
+        union_data = src.read(1, window=union_window)
+        row0, col0 = int(union_window.row_off), int(union_window.col_off)
+        
+        results = []
+        for window in windows:
+            rows, cols = window.toslices()
+            r0, r1 = rows.start - row0, rows.stop - row0
+            c0, c1 = cols.start - col0, cols.stop - col0
+            if r0 >= 0 and c0 >= 0 and r1 <= union_data.shape[0] and c1 <= union_data.shape[1]:
+                data = union_data[r0:r1, c0:c1]
+            else:
+                # Rounding left the window just outside the union; read it directly
+                data = src.read(1, window=window)
+            results.append(DataProcessor._urban_result(
+                data, src.window_transform(window), src.crs, src.window_bounds(window)
+            ))
+        return results
+    
+    @staticmethod
+    def _read_climate(
+        file_path: str,
+        variable: str,
+        bounds: Optional[RegionBounds],
+        year: Optional[int],
+    ) -> Dict[str, Any]:
+        """Decode the selected NetCDF slice (blocking; runs on the decode pool)."""
+        if not HAS_XARRAY:
+            raise Exception("xarray is required for processing NetCDF files. Please install it.")
+        try:
+            metadata = read_file_metadata(file_path) or {}
+            with DataProcessor.open_climate_variable(file_path, variable) as data_array:
+                if bounds:
+                    data_array = DataProcessor._region_slice(
+                        data_array, bounds, DataProcessor._lon_360(data_array, metadata)
+                    )
                 
-                # Normalize data to 0-1 range if needed
-                if data.max() > 1.0:
-                    data = data / data.max()
+                data_array = DataProcessor._select_year(data_array, year, metadata.get('time_steps'))
+                data_array = DataProcessor._drop_extra_dims(data_array)
                 
-                return {
-                    'data': data.tolist(),
-                    'shape': data.shape,
-                    'transform': list(transform),
-                    'crs': str(crs),
-                    'bounds': list(src.bounds),
-                }
+                # Only the selected slice is read (and computed, if dask-backed)
+                result = DataProcessor._climate_result(data_array)
         except Exception as e:
-            raise Exception(f"Error processing urban data: {str(e)}")
+            raise Exception(f"Error processing climate data: {str(e)}")
+        return result
     
     @staticmethod
-    async def process_climate_data(file_path: str, variable: str) -> Dict[str, Any]:
-        """Process climate NetCDF file."""
+    def _read_climate_regions(
+        file_path: str,
+        variable: str,
+        regions: List[Optional[RegionBounds]],
+        year: Optional[int],
+    ) -> List[Dict[str, Any]]:
+        """
+        Read the `year` slice once per group of nearby `regions` (see
+        `group_regions`), over the union of the group, and cut one result
+        per region from it in memory.
+        """
         if not HAS_XARRAY:
             raise Exception("xarray is required for processing NetCDF files. Please install it.")
         try:
-            ds = xr.open_dataset(file_path)
-            
-            # Try to find the variable (common names: temp, temperature, prec, precipitation, etc.)
-            var_name = None
-            for v in ds.variables:
-                if variable.lower() in v.lower() or v.lower() in variable.lower():
-                    var_name = v
-                    break
-            
-            if not var_name:
-                var_name = list(ds.data_vars)[0] if ds.data_vars else None
-            
-            if not var_name:
-                raise Exception("Could not find climate variable in NetCDF file")
-            
-            data_array = ds[var_name]
-            
-            # Convert to numpy and get first time slice if 3D
-            if len(data_array.dims) > 2:
-                data = data_array.isel({data_array.dims[0]: 0}).values
-            else:
-                data = data_array.values
-            
-            ds.close()
-            
-            return {
-                'data': data.tolist() if isinstance(data, np.ndarray) else data,
-                'shape': data.shape if hasattr(data, 'shape') else None,
-                'variable': var_name,
-            }
+            metadata = read_file_metadata(file_path) or {}
+            results: List[Optional[Dict[str, Any]]] = [None] * len(regions)
+            with DataProcessor.open_climate_variable(file_path, variable) as full_array:
+                # Decide on the full grid; a union slice may not show 0-360 longitudes
+                lon_360 = DataProcessor._lon_360(full_array, metadata)
+                for group in DataProcessor.group_regions(regions):
+                    group_regions = [regions[i] for i in group]
+                    data_array = full_array
+                    union = DataProcessor.union_bounds(group_regions)
+                    if union:
+                        data_array = DataProcessor._region_slice(data_array, union, lon_360)
+                    data_array = DataProcessor._drop_extra_dims(
+                        DataProcessor._select_year(data_array, year, metadata.get('time_steps'))
+                    )
+                    data_array = data_array.load()
+                    for index, bounds in zip(group, group_regions):
+                        subset = DataProcessor._region_slice(data_array, bounds, lon_360) if bounds else data_array
+                        results[index] = DataProcessor._climate_result(subset)
         except Exception as e:
             raise Exception(f"Error processing climate data: {str(e)}")
+        return results
+    
+    @staticmethod
+    def _lon_360(data_array, metadata: Dict[str, Any]) -> bool:
+        """Whether the grid uses 0-360 longitudes, from the upload's metadata when known."""
+        lon = next((d for d in data_array.dims if d.lower() in LON_NAMES), None)
+        if lon is None:
+            return False
+        coordinate = metadata.get('coordinates', {}).get(lon)
+        if coordinate is not None:
+            return coordinate['max'] > 180
+        return float(data_array[lon].max()) > 180
+    
+    @staticmethod
+    @contextmanager
+    def open_climate_variable(file_path: str, variable: str) -> Iterator[Any]:
+        """
+        Open a NetCDF file (cached) and yield the DataArray for `variable`.
+        
+        The dataset stays open until the block exits, even if it is evicted
+        from the cache meanwhile, so read what is needed inside the block.
+        """
+        with _open_datasets.acquire(file_path) as ds:
+            yield DataProcessor._climate_variable(ds, file_path, variable)
+    
+    @staticmethod
+    def _climate_variable(ds, file_path: str, variable: str):
+        """The DataArray for `variable` in the open dataset of `file_path`."""
+        # Variable names from the upload's metadata; the dataset's otherwise
+        metadata = read_file_metadata(file_path) or {}
+        names = list(metadata.get('variables') or ds.variables)
+        data_names = list(metadata.get('data_variables') or ds.data_vars)
+        
+        # Try to find the variable (common names: temp, temperature, prec, precipitation, etc.)
+        var_name = None
+        for v in names:
+            if variable.lower() in v.lower() or v.lower() in variable.lower():
+                var_name = v
+                break
+        
+        if not var_name:
+            var_name = data_names[0] if data_names else None
+        
+        if not var_name:
+            raise Exception("Could not find climate variable in NetCDF file")
+        
+        return ds[var_name]
+    
+    @staticmethod
+    def _drop_extra_dims(data_array):
+        # Drop any remaining extra dimensions (e.g. vertical level)
+        while len(data_array.dims) > 2:
+            data_array = data_array.isel({data_array.dims[0]: 0})
+        return data_array
+    
+    @staticmethod
+    def _climate_result(data_array) -> Dict[str, Any]:
+        data = np.asarray(data_array.values)
+        result = {
+            'data': data,
+            'shape': data.shape if hasattr(data, 'shape') else None,
+            'variable': data_array.name,
+        }
+        # Cell-center coordinates, for aligning the grid with the urban raster
+        lat = next((d for d in data_array.dims if d.lower() in LAT_NAMES), None)
+        lon = next((d for d in data_array.dims if d.lower() in LON_NAMES), None)
+        if lat and lon and tuple(data_array.dims) == (lat, lon):
+            result['lat'] = data_array[lat].values.astype(np.float64).tolist()
+            result['lon'] = data_array[lon].values.astype(np.float64).tolist()
+            result['crs'] = REGION_CRS
+        return result
+    
+    @staticmethod
+    async def process_urban_data(
+        file_path: str,
+        cache_key: Optional[str] = None,
+        bounds: Optional[RegionBounds] = None,
+    ) -> Dict[str, Any]:
+        """
+        Process urban expansion TIFF file.
+        
+        If bounds are given, only the raster window covering the region is read
+        (normalization then uses the window maximum). If cache_key (file ID or
+        content hash) is given, the normalized array is served from the array
+        cache when available and stored there otherwise.
+        """
+        params = {
+            'band': 1,
+            'normalize': True,
+            'bounds': bounds.model_dump() if bounds else None,
+        }
+        if cache_key:
+            cached = await asyncio.to_thread(array_cache.get, cache_key, 'urban', params)
+            if cached is not None:
+                input_bytes.inc(array_nbytes(cached), kind='urban', source='cache')
+                return cached
+        result = await decode_executor.run(DataProcessor._read_urban, file_path, bounds)
+        input_bytes.inc(array_nbytes(result), kind='urban', source='file')
+        
+        if cache_key:
+            await asyncio.to_thread(array_cache.put, cache_key, 'urban', params, result)
+        return result
+    
+    @staticmethod
+    def _climate_params(variable: str, year: Optional[int], bounds: Optional[RegionBounds]) -> Dict[str, Any]:
+        """Array cache parameters of a climate result, including its layout version."""
+        return {
+            'format': CLIMATE_RESULT_FORMAT,
+            'variable': variable,
+            'year': year,
+            'bounds': bounds.model_dump() if bounds else None,
+        }
+    
+    @staticmethod
+    async def process_climate_data(
+        file_path: str,
+        variable: str,
+        cache_key: Optional[str] = None,
+        bounds: Optional[RegionBounds] = None,
+        year: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Process climate NetCDF file, using the array cache if cache_key is given.
+        
+        The dataset is opened lazily (and kept open for later requests); only the
+        time step(s) for `year` and, if bounds are given, the lat/lon slice
+        covering the region are computed.
+        """
+        params = DataProcessor._climate_params(variable, year, bounds)
+        if cache_key:
+            cached = await asyncio.to_thread(array_cache.get, cache_key, 'climate', params)
+            if cached is not None:
+                input_bytes.inc(array_nbytes(cached), kind='climate', source='cache')
+                return cached
+        result = await decode_executor.run(
+            DataProcessor._read_climate, file_path, variable, bounds, year
+        )
+        input_bytes.inc(array_nbytes(result), kind='climate', source='file')
+        
+        if cache_key:
+            await asyncio.to_thread(array_cache.put, cache_key, 'climate', params, result)
+        return result
+    
+    @staticmethod
+    async def process_urban_regions(
+        file_path: str,
+        regions: List[Optional[RegionBounds]],
+        cache_key: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Process the urban TIFF for several regions, reading nearby regions together.
+        
+        Results match `process_urban_data` for each region and share its cache
+        entries; only regions missing from the cache are read, together.
+        """
+        return await DataProcessor._process_regions(
+            regions,
+            cache_key,
+            'urban',
+            lambda bounds: {
+                'band': 1,
+                'normalize': True,
+                'bounds': bounds.model_dump() if bounds else None,
+            },
+            lambda missing: decode_executor.run(DataProcessor._read_urban_regions, file_path, missing),
+        )
+    
+    @staticmethod
+    async def process_climate_regions(
+        file_path: str,
+        variable: str,
+        regions: List[Optional[RegionBounds]],
+        cache_key: Optional[str] = None,
+        year: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Process one year of a climate NetCDF file for several regions, reading
+        nearby regions together. Shares cache entries with
+        `process_climate_data`.
+        """
+        return await DataProcessor._process_regions(
+            regions,
+            cache_key,
+            'climate',
+            lambda bounds: DataProcessor._climate_params(variable, year, bounds),
+            lambda missing: decode_executor.run(
+                DataProcessor._read_climate_regions, file_path, variable, missing, year
+            ),
+        )
+    
+    @staticmethod
+    async def _process_regions(regions, cache_key, kind, make_params, read_missing) -> List[Dict[str, Any]]:
+        results: List[Optional[Dict[str, Any]]] = [None] * len(regions)
+        if cache_key:
+            # All lookups in one thread hop
+            results = await asyncio.to_thread(
+                lambda: [array_cache.get(cache_key, kind, make_params(bounds)) for bounds in regions]
+            )
+        input_bytes.inc(array_nbytes([result for result in results if result is not None]), kind=kind, source='cache')
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            # Identical regions are read once
+            unique = list(dict.fromkeys(
+                regions[index].model_dump_json() if regions[index] else None for index in missing
+            ))
+            read = await read_missing([RegionBounds.model_validate_json(b) if b else None for b in unique])
+            by_region = dict(zip(unique, read))
+            input_bytes.inc(array_nbytes(read), kind=kind, source='file')
+            for index in missing:
+                bounds = regions[index]
+                result = by_region[bounds.model_dump_json() if bounds else None]
+                results[index] = result
+            if cache_key:
+                for key, result in by_region.items():
+                    bounds = RegionBounds.model_validate_json(key) if key else None
+                    await asyncio.to_thread(array_cache.put, cache_key, kind, make_params(bounds), result)
+        return results
     
     @staticmethod
     def prepare_model_input(
@@ -87,29 +636,146 @@ class DataProcessor:
         precipitation_data: Dict[str, Any],
         historical_yield_data: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
-        """Prepare input data for URBAN model."""
-        return {
+        """
+        Prepare input data for URBAN model.
+        
+        Climate and yield grids are resampled onto the urban raster's grid
+        (see INPUT_ALIGNMENT in app/services/regridding.py), reusing cached
+        index maps for grid pairs seen before. This is CPU-bound; run it off
+        the event loop.
+        
+        Arrays are kept as NumPy arrays; MLService encodes them into the
+        binary wire format (or lists for the JSON fallback) when sending.
+        """
+        return align_model_input({
             'urban_expansion': urban_data,
             'temperature': temperature_data,
             'precipitation': precipitation_data,
             'historical_yields': historical_yield_data,
-        }
+        })
     
     @staticmethod
-    def segment_global_data(data: np.ndarray, segment_size: int = 32) -> list:
-        """Segment global data into smaller chunks (as described in paper)."""
-        segments = []
+    def _tile_view(
+        data: np.ndarray,
+        segment_size: int,
+        pad_mode: str,
+        pad_value: float,
+        overlap: int = 0,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return all tiles of `data` as an (n_y, n_x, size + 2 * overlap, ...)
+        strided view plus their (x, y) core positions in row-major tile order.
+        Edges are padded; no data is copied unless padding is needed.
+        """
+        data = np.asarray(data)
         height, width = data.shape
+        pad_y = -height % segment_size
+        pad_x = -width % segment_size
+        if pad_y or pad_x or overlap:
+            padding = ((overlap, pad_y + overlap), (overlap, pad_x + overlap))
+            if pad_mode == 'constant':
+                data = np.pad(data, padding, mode='constant', constant_values=pad_value)
+            else:
+                data = np.pad(data, padding, mode=pad_mode)
         
-        for y in range(0, height, segment_size):
-            for x in range(0, width, segment_size):
-                segment = data[y:y+segment_size, x:x+segment_size]
-                if segment.size > 0:
-                    segments.append({
-                        'data': segment.tolist(),
-                        'position': (x, y),
-                        'shape': segment.shape,
-                    })
-        
-        return segments
-
+        n_y = (height + pad_y) // segment_size
+        n_x = (width + pad_x) // segment_size
+        window = segment_size + 2 * overlap
+        row_stride, col_stride = data.strides
+        tiles = np.lib.stride_tricks.as_strided(
+            data,
+            shape=(n_y, n_x, window, window),
+            strides=(row_stride * segment_size, col_stride * segment_size, row_stride, col_stride),
+            writeable=False,
+        )
+        
+        ys, xs = np.meshgrid(
+            np.arange(n_y) * segment_size, np.arange(n_x) * segment_size, indexing='ij'
+        )
+        positions = np.stack([xs.ravel(), ys.ravel()], axis=1)
+        return tiles, positions
+    
+    @staticmethod
+    def tile_windows(shape: Tuple[int, int], tile_size: int, overlap: int = 0) -> np.ndarray:
+        """
+        Return an (n_tiles, 8) array of tile geometry for an array of `shape`:
+        the core window (x0, y0, x1, y1) followed by the same window grown by
+        `overlap` on each side, both clipped to the array extent.
+        """
+        height, width = shape
+        ys, xs = np.meshgrid(
+            np.arange(0, height, tile_size), np.arange(0, width, tile_size), indexing='ij'
+        )
+        x0, y0 = xs.ravel(), ys.ravel()
+        x1, y1 = np.minimum(x0 + tile_size, width), np.minimum(y0 + tile_size, height)
+        return np.stack([
+            x0, y0, x1, y1,
+            np.maximum(x0 - overlap, 0), np.maximum(y0 - overlap, 0),
+            np.minimum(x1 + overlap, width), np.minimum(y1 + overlap, height),
+        ], axis=1)
+    
+    @staticmethod
+    def _valid_tiles(tiles: np.ndarray, nodata: Optional[float]) -> np.ndarray:
+        """Boolean mask of tiles that contain at least one valid (non-nodata, non-NaN) pixel."""
+        invalid = np.zeros(tiles.shape, dtype=bool)
+        if nodata is not None:
+            invalid |= tiles == nodata
+        if np.issubdtype(tiles.dtype, np.floating):
+            invalid |= np.isnan(tiles)
+        return ~invalid.all(axis=(1, 2))
+    
+    @staticmethod
+    def segment_global_data(
+        data: np.ndarray,
+        segment_size: int = 32,
+        pad_mode: str = 'constant',
+        pad_value: float = 0,
+        skip_nodata: bool = False,
+        nodata: Optional[float] = None,
+        overlap: int = 0,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Segment global data into smaller chunks (as described in paper).
+        
+        Returns one contiguous (n_tiles, segment_size, segment_size) batch of
+        tiles and an (n_tiles, 2) array of their (x, y) pixel positions. Edge
+        tiles are padded with `pad_mode` (any np.pad mode; 'constant' uses
+        `pad_value`). With `overlap`, each tile also includes that many pixels
+        of its neighbours on every side. With `skip_nodata`, tiles that are
+        entirely `nodata`/NaN are dropped.
+        """
+        view, positions = DataProcessor._tile_view(data, segment_size, pad_mode, pad_value, overlap)
+        tiles = view.reshape(-1, *view.shape[2:])
+        if skip_nodata:
+            valid = DataProcessor._valid_tiles(tiles, nodata)
+            return tiles[valid], positions[valid]
+        return tiles, positions
+    
+    @staticmethod
+    def iter_segment_batches(
+        data: np.ndarray,
+        segment_size: int = 32,
+        batch_size: int = 1024,
+        pad_mode: str = 'constant',
+        pad_value: float = 0,
+        skip_nodata: bool = False,
+        nodata: Optional[float] = None,
+        overlap: int = 0,
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Yield (tiles, positions) batches of at most `batch_size` tiles, for
+        streaming inference without materializing every tile at once.
+        """
+        view, positions = DataProcessor._tile_view(data, segment_size, pad_mode, pad_value, overlap)
+        n_x = view.shape[1]
+        for start in range(0, len(positions), batch_size):
+            index = np.arange(start, min(start + batch_size, len(positions)))
+            # Gather just this batch from the strided view
+            batch = view[index // n_x, index % n_x]
+            batch_positions = positions[start:start + batch_size]
+            if skip_nodata:
+                valid = DataProcessor._valid_tiles(batch, nodata)
+                if not valid.any():
+                    continue
+                batch, batch_positions = batch[valid], batch_positions[valid]
+            yield batch, batch_positions
@@ -0,0 +1,131 @@
+import os
+import asyncio
+import threading
+import weakref
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Dict, Optional
+import numpy as np
+
+# "thread" or "process" pool for blocking raster/NetCDF decoding
+DECODE_EXECUTOR = os.getenv("DECODE_EXECUTOR", "thread").lower()
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Arrays at least this large are returned from worker processes through shared memory
+SHARED_MEMORY_MIN_BYTES = int(os.getenv("SHARED_MEMORY_MIN_BYTES", str(1024 * 1024)))
+
+
+def _export_shared_arrays(result: Any) -> Any:
+    """
+    In a worker process: move large arrays into shared memory, anywhere in
+    nested dicts and lists (e.g. one result per region, or a model input).
+    """
+    if isinstance(result, dict):
+        return {key: _export_shared_arrays(value) for key, value in result.items()}
+    if isinstance(result, list):
+        return [_export_shared_arrays(value) for value in result]
+    if isinstance(result, np.ndarray) and result.nbytes >= SHARED_MEMORY_MIN_BYTES:
+        shm = shared_memory.SharedMemory(create=True, size=result.nbytes)
+        np.ndarray(result.shape, dtype=result.dtype, buffer=shm.buf)[...] = result
+        # The parent process takes ownership and unlinks the segment
+        resource_tracker.unregister(shm._name, "shared_memory")
+        exported = ("__shared_array__", shm.name, result.shape, result.dtype.str)
+        shm.close()
+        return exported
+    return result
+
+
+def _import_shared_arrays(result: Any) -> Any:
+    """In the parent process: map shared-memory arrays back into NumPy without copying."""
+    if isinstance(result, dict):
+        return {key: _import_shared_arrays(value) for key, value in result.items()}
+    if isinstance(result, list):
+        return [_import_shared_arrays(value) for value in result]
+    if isinstance(result, tuple) and len(result) == 4 and result[0] == "__shared_array__":
+        _, name, shape, dtype = result
+        shm = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        # Unlink now; the mapping stays valid until the array is garbage collected
+        shm.unlink()
+        weakref.finalize(array, shm.close)
+        return array
+    return result
+
+
+def _run_exported(fn: Callable, args: tuple) -> Any:
+    return _export_shared_arrays(fn(*args))
+
+
+class BlockingExecutor:
+    """
+    Runs blocking decode work off the event loop.
+    
+    At most `workers` jobs are handed to the pool at once; the rest wait in
+    an asyncio queue, whose depth is reported by `stats()`. With a process
+    pool, large result arrays come back through shared memory.
+    """
+    
+    def __init__(self, mode: str = DECODE_EXECUTOR, workers: int = DECODE_WORKERS):
+        self.mode = mode
+        self.workers = workers
+        self._pool: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+    
+    def _get_pool(self) -> Executor:
+        with self._lock:
+            if self._pool is None:
+                if self.mode == "process":
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                else:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="decode"
+                    )
+            return self._pool
+    
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run fn(*args) on the decode pool and return its result."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        loop = asyncio.get_running_loop()
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        try:
+            if self.mode == "process":
+                result = await loop.run_in_executor(self._get_pool(), _run_exported, fn, args)
+                return _import_shared_arrays(result)
+            return await loop.run_in_executor(self._get_pool(), fn, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._slots.release()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return pool mode, size and queue depth."""
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+        }
+    
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+# Shared instance for DataProcessor and metadata readers
+decode_executor = BlockingExecutor()
@@ -1,19 +1,84 @@
 import os
+import json
 import uuid
 import shutil
+import hashlib
+from functools import lru_cache
 from pathlib import Path
 from fastapi import UploadFile, HTTPException
-from typing import Optional
+from typing import Optional, NamedTuple, Dict, Any
 import aiofiles
+from app.services.file_index import FileIndex, FileRecord, new_record
 
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Uploads are streamed to disk in chunks of this size (bytes)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Maximum upload size in bytes; 0 disables the limit
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", "0"))
+
+# Content-addressed storage: each distinct upload is stored once under its SHA-256
+BLOB_DIR = UPLOAD_DIR / "blobs"
+
+# Append-only record of every upload; loaded into memory for lookups by ID
+UPLOAD_MANIFEST = Path(os.getenv("UPLOAD_MANIFEST", str(UPLOAD_DIR / "manifest.jsonl")))
+file_index = FileIndex(UPLOAD_DIR, BLOB_DIR, UPLOAD_MANIFEST)
+
+
+def metadata_path(path) -> Path:
+    """Sidecar holding the metadata of an upload; the leading dot keeps it out of the file index."""
+    path = Path(path)
+    return path.with_name(f".{path.name}.meta.json")
+
+
+@lru_cache(maxsize=128)
+def _load_metadata(path: str, mtime_ns: int) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_file_metadata(path) -> Optional[Dict[str, Any]]:
+    """
+    Metadata extracted from an upload when it was saved (see
+    app/utils/validation.py), or None if it has none. Parsed once per
+    sidecar version; treat the result as read-only.
+    """
+    sidecar = metadata_path(path)
+    try:
+        return _load_metadata(str(sidecar), sidecar.stat().st_mtime_ns)
+    except (OSError, ValueError):
+        return None
+
+
+class SavedFile(NamedTuple):
+    path: str
+    file_id: str
+    checksum: str
+    duplicate: bool  # True if the content was already stored
+
 
 class FileHandler:
     @staticmethod
-    async def save_upload_file(file: UploadFile, subdirectory: str = "") -> tuple[str, str]:
-        """Save uploaded file and return file path and generated ID."""
+    def _blob_path(checksum: str) -> Path:
+        return BLOB_DIR / checksum[:2] / checksum
+    
+    @staticmethod
+    async def save_upload_file(
+        file: UploadFile,
+        subdirectory: str = "",
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> SavedFile:
+        """
+        Save uploaded file and return its path, generated ID and SHA-256 checksum.
+        
+        The upload is streamed to a temporary file in UPLOAD_CHUNK_SIZE chunks,
+        hashed and size-checked as it arrives. New content is moved into the blob
+        store; if the blob already exists the temporary file is discarded. The
+        upload ID is then hard-linked to the blob, so identical uploads share
+        one copy on disk. The file is recorded in the file index along with
+        `metadata`.
+        """
         file_id = str(uuid.uuid4())
         file_ext = Path(file.filename or "").suffix
         filename = f"{file_id}{file_ext}"
@@ -22,32 +87,104 @@ class FileHandler:
         save_dir.mkdir(exist_ok=True, parents=True)
         
         file_path = save_dir / filename
+        # Leading dot keeps partial uploads out of get_file_path lookups
+        temp_path = save_dir / f".{filename}.part"
         
         try:
-            async with aiofiles.open(file_path, 'wb') as f:
-                content = await file.read()
-                await f.write(content)
+            checksum = hashlib.sha256()
+            size = 0
+            async with aiofiles.open(temp_path, 'wb') as f:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if MAX_UPLOAD_SIZE and size > MAX_UPLOAD_SIZE:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"File exceeds maximum upload size of {MAX_UPLOAD_SIZE} bytes"
+                        )
+                    checksum.update(chunk)
+                    await f.write(chunk)
+            
+            content_hash = checksum.hexdigest()
+            blob_path = FileHandler._blob_path(content_hash)
+            duplicate = blob_path.exists()
+            if duplicate:
+                temp_path.unlink()
+            else:
+                blob_path.parent.mkdir(exist_ok=True, parents=True)
+                os.replace(temp_path, blob_path)
             
-            return str(file_path), file_id
+            try:
+                os.link(blob_path, file_path)
+            except OSError:
+                # Filesystem without hard link support: fall back to a private copy
+                shutil.copyfile(blob_path, file_path)
+            
+            file_index.put(new_record(file_id, file_path, subdirectory, content_hash, metadata))
+            return SavedFile(str(file_path), file_id, content_hash, duplicate)
+        except HTTPException:
+            temp_path.unlink(missing_ok=True)
+            raise
         except Exception as e:
+            temp_path.unlink(missing_ok=True)
             raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
     
     @staticmethod
     def get_file_path(file_id: str, subdirectory: str = "") -> Optional[Path]:
         """Get file path from file ID."""
-        save_dir = UPLOAD_DIR / subdirectory
-        for file_path in save_dir.glob(f"{file_id}.*"):
-            return file_path
+        record = file_index.get(file_id, subdirectory)
+        return Path(record.path) if record else None
+    
+    @staticmethod
+    def get_file_record(file_id: str) -> Optional[FileRecord]:
+        """Get the indexed path, size, type, hash and metadata of an upload."""
+        return file_index.get(file_id)
+    
+    @staticmethod
+    def get_content_hash(file_id: str) -> Optional[str]:
+        """Get the SHA-256 content hash of an uploaded file, if known."""
+        record = file_index.get(file_id)
+        return record.checksum if record else None
+    
+    @staticmethod
+    def update_metadata(file_id: str, metadata: Dict[str, Any]) -> Optional[FileRecord]:
+        """Merge metadata into an upload's index record."""
+        return file_index.update_metadata(file_id, metadata)
+    
+    @staticmethod
+    def save_file_metadata(path, metadata: Dict[str, Any]):
+        """Write an upload's metadata sidecar (atomically, next to the file)."""
+        sidecar = metadata_path(path)
+        temp_path = sidecar.with_name(f"{sidecar.name}.{uuid.uuid4().hex}.part")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, default=str)
+        os.replace(temp_path, sidecar)
+    
+    @staticmethod
+    def find_file_metadata(checksum: str) -> Optional[Dict[str, Any]]:
+        """Metadata of any upload with this content, so identical uploads are read once."""
+        for record in file_index.with_checksum(checksum):
+            metadata = read_file_metadata(record.path)
+            if metadata is not None:
+                return metadata
         return None
     
     @staticmethod
     def delete_file(file_id: str, subdirectory: str = "") -> bool:
-        """Delete file by ID."""
-        file_path = FileHandler.get_file_path(file_id, subdirectory)
-        if file_path and file_path.exists():
-            file_path.unlink()
-            return True
-        return False
+        """Delete file by ID, removing its blob once no other upload references it."""
+        record = file_index.get(file_id, subdirectory)
+        if record is None:
+            return False
+        file_index.remove(file_id)
+        file_path = Path(record.path)
+        metadata_path(file_path).unlink(missing_ok=True)
+        if not file_path.exists():
+            return False
+        file_path.unlink()
+        if record.checksum:
+            blob_path = FileHandler._blob_path(record.checksum)
+            if blob_path.exists() and blob_path.stat().st_nlink == 1:
+                blob_path.unlink()
+        return True
     
     @staticmethod
     def cleanup_old_files(max_age_days: int = 7):
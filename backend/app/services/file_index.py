@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    # Windows: the manifest is only locked between threads of one process
+    HAS_FCNTL = False
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class FileRecord(NamedTuple):
+    file_id: str
+    path: str
+    subdirectory: str
+    size: int
+    file_type: str  # file extension without the dot, e.g. "tif" or "nc"
+    checksum: Optional[str]
+    metadata: Dict[str, Any]
+    uploaded_at: float
+
+
+def _hash_file(path: Path) -> str:
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class FileIndex:
+    """
+    In-memory index of uploaded files, persisted as an append-only manifest.
+    
+    Each save or delete appends one JSON line to the manifest, so other
+    processes (e.g. prediction workers) pick up new uploads by reading the
+    lines added since their last read. `load()` replays the manifest and
+    reconciles it with the upload directory, so files added or removed while
+    the manifest was not being written are still indexed correctly.
+    
+    Appends take a shared lock on a lock file next to the manifest and
+    `load()` an exclusive one, so no process appends to a manifest that
+    another is compacting (the line would be lost with the old file).
+    """
+    
+    def __init__(self, upload_dir: Path, blob_dir: Path, manifest_path: Optional[Path] = None):
+        self.upload_dir = upload_dir
+        self.blob_dir = blob_dir
+        self.manifest_path = manifest_path or upload_dir / "manifest.jsonl"
+        self._records: Dict[str, FileRecord] = {}
+        # File IDs by content hash, to find uploads with the same content
+        self._by_checksum: Dict[str, Set[str]] = {}
+        self._offset = 0
+        self._manifest_id: Optional[tuple] = None
+        self._loaded = False
+        self._lock = threading.RLock()
+    
+    def _manifest_identity(self) -> Optional[tuple]:
+        try:
+            stat = self.manifest_path.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_dev, stat.st_ino)
+    
+    def _set(self, record: FileRecord):
+        self._drop(record.file_id)
+        self._records[record.file_id] = record
+        if record.checksum:
+            self._by_checksum.setdefault(record.checksum, set()).add(record.file_id)
+    
+    def _drop(self, file_id: str) -> Optional[FileRecord]:
+        record = self._records.pop(file_id, None)
+        if record is not None and record.checksum:
+            file_ids = self._by_checksum.get(record.checksum, set())
+            file_ids.discard(file_id)
+            if not file_ids:
+                self._by_checksum.pop(record.checksum, None)
+        return record
+    
+    def _apply(self, entry: Dict[str, Any]):
+        if entry.get("op") == "delete":
+            self._drop(entry["file_id"])
+        else:
+            self._set(FileRecord(**entry["record"]))
+    
+    def _read_new_entries(self):
+        """Apply manifest lines written since the last read (by any process)."""
+        identity = self._manifest_identity()
+        if identity is None:
+            return
+        if identity != self._manifest_id:
+            # Manifest was rewritten by a rebuild; replay it from the start
+            self._records.clear()
+            self._by_checksum.clear()
+            self._offset = 0
+            self._manifest_id = identity
+        with open(self.manifest_path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Partially written line; read it next time
+                    break
+                self._offset += len(line)
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, TypeError, KeyError):
+                    continue
+    
+    @contextmanager
+    def _manifest_lock(self, exclusive: bool):
+        """Inter-process lock on the manifest: shared for appends, exclusive for rewrites."""
+        if not HAS_FCNTL:
+            yield
+            return
+        self.manifest_path.parent.mkdir(exist_ok=True, parents=True)
+        lock_path = self.manifest_path.with_name(f".{self.manifest_path.name}.lock")
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _append(self, entry: Dict[str, Any]):
+        self.manifest_path.parent.mkdir(exist_ok=True, parents=True)
+        line = json.dumps(entry, default=str) + "\n"
+        # One write per line in append mode, so concurrent writers do not interleave
+        with self._manifest_lock(exclusive=False):
+            with open(self.manifest_path, "a", encoding="utf-8") as f:
+                f.write(line)
+    
+    def load(self):
+        """Replay the manifest and reconcile it with the files on disk."""
+        with self._lock, self._manifest_lock(exclusive=True):
+            self._read_new_entries()
+            on_disk = dict(self._scan())
+            changed = False
+            for file_id in list(self._records):
+                if file_id not in on_disk:
+                    self._drop(file_id)
+                    changed = True
+            blob_hashes = None
+            for file_id, path in on_disk.items():
+                if file_id in self._records:
+                    continue
+                if blob_hashes is None:
+                    blob_hashes = self._blob_hashes()
+                self._set(self._record_from_disk(file_id, path, blob_hashes))
+                changed = True
+            if changed or self._manifest_id is None:
+                self._rewrite()
+            self._loaded = True
+    
+    def _scan(self) -> Iterator[tuple]:
+        """Yield (file_id, path) for every upload on disk, excluding blobs and partial files."""
+        if not self.upload_dir.exists():
+            return
+        for root, dirs, files in os.walk(self.upload_dir):
+            root_path = Path(root)
+            if root_path == self.blob_dir:
+                dirs[:] = []
+                continue
+            for name in files:
+                path = root_path / name
+                if name.startswith(".") or path == self.manifest_path:
+                    continue
+                yield Path(name).stem, path
+    
+    def _blob_hashes(self) -> Dict[tuple, str]:
+        """Map blob (device, inode) to content hash, to identify hard-linked uploads."""
+        hashes = {}
+        if self.blob_dir.exists():
+            for blob_path in self.blob_dir.glob("*/*"):
+                stat = blob_path.stat()
+                hashes[(stat.st_dev, stat.st_ino)] = blob_path.name
+        return hashes
+    
+    def _record_from_disk(
+        self,
+        file_id: str,
+        path: Path,
+        blob_hashes: Optional[Dict[tuple, str]] = None,
+    ) -> FileRecord:
+        stat = path.stat()
+        checksum = (blob_hashes or {}).get((stat.st_dev, stat.st_ino)) or _hash_file(path)
+        subdirectory = path.parent.relative_to(self.upload_dir).as_posix()
+        return FileRecord(
+            file_id=file_id,
+            path=str(path),
+            subdirectory="" if subdirectory == "." else subdirectory,
+            size=stat.st_size,
+            file_type=path.suffix.lstrip(".").lower(),
+            checksum=checksum,
+            metadata={},
+            uploaded_at=stat.st_mtime,
+        )
+    
+    def _rewrite(self):
+        """Write a compacted manifest holding only the live records (under the exclusive lock)."""
+        self.manifest_path.parent.mkdir(exist_ok=True, parents=True)
+        temp_path = self.manifest_path.with_name(f".{self.manifest_path.name}.part")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for record in self._records.values():
+                entry = {"op": "put", "file_id": record.file_id, "record": record._asdict()}
+                f.write(json.dumps(entry, default=str) + "\n")
+            size = f.tell()
+        os.replace(temp_path, self.manifest_path)
+        self._manifest_id = self._manifest_identity()
+        self._offset = size
+    
+    def get(self, file_id: str, subdirectory: Optional[str] = None) -> Optional[FileRecord]:
+        """
+        Look up a file by ID, optionally requiring it to be in `subdirectory`.
+        
+        Hits cost a dict lookup and one stat. Misses re-read the manifest tail
+        for uploads made by other processes; files never recorded there are
+        only picked up by the next `load()`.
+        """
+        if not self._loaded:
+            self.load()
+        with self._lock:
+            record = self._records.get(file_id)
+            if record is None or not os.path.exists(record.path):
+                # Unknown here, or deleted by another process
+                self._read_new_entries()
+                record = self._records.get(file_id)
+            if record is None:
+                return None
+            if not os.path.exists(record.path):
+                self._drop(file_id)
+                return None
+        if subdirectory is not None and record.subdirectory != subdirectory:
+            return None
+        return record
+    
+    def records(self, subdirectory: Optional[str] = None) -> List[FileRecord]:
+        """All indexed files, optionally only those in `subdirectory`."""
+        if not self._loaded:
+            self.load()
+        with self._lock:
+            self._read_new_entries()
+            return [
+                record for record in self._records.values()
+                if subdirectory is None or record.subdirectory == subdirectory
+            ]
+    
+    def with_checksum(self, checksum: str) -> List[FileRecord]:
+        """Indexed files with the given content hash."""
+        if not self._loaded:
+            self.load()
+        with self._lock:
+            self._read_new_entries()
+            return [self._records[file_id] for file_id in self._by_checksum.get(checksum, ())]
+    
+    def put(self, record: FileRecord):
+        """Add or replace a record and persist it."""
+        with self._lock:
+            self._set(record)
+            self._append({"op": "put", "file_id": record.file_id, "record": record._asdict()})
+    
+    def update_metadata(self, file_id: str, metadata: Dict[str, Any]) -> Optional[FileRecord]:
+        """Merge `metadata` into a file's record."""
+        record = self.get(file_id)
+        if record is None:
+            return None
+        record = record._replace(metadata={**record.metadata, **metadata})
+        self.put(record)
+        return record
+    
+    def remove(self, file_id: str) -> Optional[FileRecord]:
+        """Drop a record and persist the deletion."""
+        with self._lock:
+            record = self._drop(file_id)
+            self._append({"op": "delete", "file_id": file_id})
+            return record
+
+
+def new_record(
+    file_id: str,
+    path: Path,
+    subdirectory: str,
+    checksum: str,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> FileRecord:
+    """Build the record for a file that was just saved."""
+    return FileRecord(
+        file_id=file_id,
+        path=str(path),
+        subdirectory=subdirectory,
+        size=path.stat().st_size,
+        file_type=path.suffix.lstrip(".").lower(),
+        checksum=checksum,
+        metadata=metadata or {},
+        uploaded_at=time.time(),
+    )
@@ -0,0 +1,612 @@
+import os
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+from app.models.schemas import PredictionRequest, PredictionResponse, PredictionStatus
+from app.services.metrics import stage_seconds, prediction_seconds, predictions_completed
+
+JOB_QUEUE_DB = Path(os.getenv("JOB_QUEUE_DB", "jobs.db"))
+# Seconds a claimed job stays invisible to other workers without a heartbeat
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Maximum jobs processed at once across all workers; 0 disables the limit
+JOB_MAX_RUNNING = int(os.getenv("JOB_MAX_RUNNING", "0"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    request TEXT NOT NULL,
+    response TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    request_hash TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    item_ids TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS timing_buckets (
+    metric TEXT NOT NULL,
+    label TEXT NOT NULL,
+    bucket REAL NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    PRIMARY KEY (metric, label, bucket)
+);
+"""
+
+# Applied after _SCHEMA so databases created before a column existed are upgraded
+_MIGRATIONS = {
+    "request_hash": "ALTER TABLE jobs ADD COLUMN request_hash TEXT",
+    "batch_id": "ALTER TABLE jobs ADD COLUMN batch_id TEXT",
+    "profile": "ALTER TABLE jobs ADD COLUMN profile INTEGER NOT NULL DEFAULT 0",
+}
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_request_hash ON jobs (request_hash, status);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at, id);
+CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated_at);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, status);
+"""
+
+
+class Job:
+    """A claimed prediction job."""
+    
+    def __init__(
+        self,
+        job_id: str,
+        request: PredictionRequest,
+        attempts: int,
+        batch_id: Optional[str] = None,
+        profile: bool = False,
+    ):
+        self.id = job_id
+        self.request = request
+        self.attempts = attempts
+        self.batch_id = batch_id
+        # Run under the sampling profiler (see app/services/profiling.py)
+        self.profile = profile
+
+
+class JobQueue:
+    """
+    Durable, SQLite-backed queue of prediction jobs.
+    
+    Jobs are claimed with a lease; a worker must heartbeat before the lease
+    expires, otherwise the job becomes visible again and another worker picks
+    it up (counting as a retry). The stored PredictionResponse is the source
+    of truth for job status, so any API process can serve it.
+    """
+    
+    def __init__(self, db_path: Path = JOB_QUEUE_DB):
+        self.db_path = db_path
+        self._initialized = False
+    
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                for column, statement in _MIGRATIONS.items():
+                    if column not in columns:
+                        conn.execute(statement)
+                conn.executescript(_INDEXES)
+                self._initialized = True
+            yield conn
+        finally:
+            conn.close()
+    
+    def enqueue(
+        self,
+        request: PredictionRequest,
+        response: PredictionResponse,
+        request_hash: Optional[str] = None,
+        reuse_within: float = 0,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        profile: bool = False,
+    ) -> PredictionResponse:
+        """
+        Add a pending job with its initial response and return it.
+        
+        If `request_hash` is given and a job with the same hash is pending or
+        processing, or completed within the last `reuse_within` seconds, that
+        job's response is returned instead and nothing is enqueued. With
+        `profile`, the worker running the job profiles it.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                response = self._insert(
+                    conn, request, response, request_hash, reuse_within, max_attempts, now,
+                    profile=profile,
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return response
+    
+    def enqueue_batch(
+        self,
+        batch_id: str,
+        items: List[Tuple[PredictionRequest, PredictionResponse, Optional[str]]],
+        reuse_within: float = 0,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        profile: bool = False,
+    ) -> List[PredictionResponse]:
+        """
+        Add (request, response, request_hash) items as one batch, atomically.
+        
+        Items are deduplicated like `enqueue`, so an item may be an existing
+        prediction; new items are tagged with the batch so a worker can claim
+        and process them together. Returns the item responses in order.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                responses = [
+                    self._insert(
+                        conn, request, response, request_hash, reuse_within, max_attempts, now,
+                        batch_id=batch_id, profile=profile,
+                    )
+                    for request, response, request_hash in items
+                ]
+                conn.execute(
+                    "INSERT INTO batches (id, item_ids, created_at) VALUES (?, ?, ?)",
+                    (batch_id, json.dumps([response.id for response in responses]), now),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return responses
+    
+    @staticmethod
+    def _insert(
+        conn,
+        request: PredictionRequest,
+        response: PredictionResponse,
+        request_hash: Optional[str],
+        reuse_within: float,
+        max_attempts: int,
+        now: float,
+        batch_id: Optional[str] = None,
+        profile: bool = False,
+    ) -> PredictionResponse:
+        if request_hash:
+            row = conn.execute(
+                "SELECT response FROM jobs WHERE request_hash = ?"
+                " AND (status IN (?, ?) OR (status = ? AND updated_at >= ?))"
+                " ORDER BY created_at DESC LIMIT 1",
+                (
+                    request_hash,
+                    PredictionStatus.pending.value,
+                    PredictionStatus.processing.value,
+                    PredictionStatus.completed.value,
+                    now - reuse_within,
+                ),
+            ).fetchone()
+            if row is not None:
+                return PredictionResponse.model_validate_json(row[0])
+        conn.execute(
+            "INSERT INTO jobs (id, request, response, status, max_attempts, request_hash,"
+            " batch_id, profile, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                response.id,
+                request.model_dump_json(),
+                response.model_dump_json(),
+                PredictionStatus.pending.value,
+                max_attempts,
+                request_hash,
+                batch_id,
+                int(profile),
+                now,
+                now,
+            ),
+        )
+        return response
+    
+    def claim(self, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[Job]:
+        """
+        Atomically claim the oldest pending job, or a processing job whose lease
+        has expired. Returns None if nothing is available or the global running
+        limit is reached.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if JOB_MAX_RUNNING:
+                    (running,) = conn.execute(
+                        "SELECT COUNT(*) FROM jobs WHERE status = ? AND lease_expires >= ?",
+                        (PredictionStatus.processing.value, now),
+                    ).fetchone()
+                    if running >= JOB_MAX_RUNNING:
+                        conn.execute("COMMIT")
+                        return None
+                # Expired leases that used up their attempts are failed rather than retried
+                self._fail_exhausted(conn, now)
+                row = conn.execute(
+                    "SELECT id, request, attempts, batch_id, profile FROM jobs"
+                    " WHERE (status = ? OR (status = ? AND lease_expires < ?))"
+                    " AND cancel_requested = 0 AND attempts < max_attempts"
+                    " ORDER BY created_at LIMIT 1",
+                    (PredictionStatus.pending.value, PredictionStatus.processing.value, now),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                job_id, request_json, attempts, batch_id, profile = row
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?,"
+                    " lease_expires = ?, updated_at = ? WHERE id = ?",
+                    (PredictionStatus.processing.value, worker_id, now + lease_seconds, now, job_id),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return Job(
+            job_id, _stored_request(request_json), attempts + 1, batch_id, bool(profile)
+        )
+    
+    def claim_batch(
+        self,
+        job: Job,
+        worker_id: str,
+        limit: int,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+    ) -> List[Job]:
+        """
+        Claim up to `limit` more pending jobs from the batch of a claimed job,
+        so they can share loaded inputs. Returns [] for jobs outside a batch.
+        """
+        if not job.batch_id or limit <= 0:
+            return []
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT id, request, attempts, profile FROM jobs"
+                    " WHERE batch_id = ? AND status = ? AND cancel_requested = 0"
+                    " AND attempts < max_attempts ORDER BY created_at, id LIMIT ?",
+                    (job.batch_id, PredictionStatus.pending.value, limit),
+                ).fetchall()
+                for job_id, _, _, _ in rows:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?,"
+                        " lease_expires = ?, updated_at = ? WHERE id = ?",
+                        (PredictionStatus.processing.value, worker_id, now + lease_seconds, now, job_id),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return [
+            Job(
+                job_id, _stored_request(request_json), attempts + 1, job.batch_id,
+                bool(profile),
+            )
+            for job_id, request_json, attempts, profile in rows
+        ]
+    
+    def _fail_exhausted(self, conn, now: float):
+        rows = conn.execute(
+            "SELECT id, response FROM jobs WHERE status = ? AND lease_expires < ?"
+            " AND attempts >= max_attempts",
+            (PredictionStatus.processing.value, now),
+        ).fetchall()
+        for job_id, response_json in rows:
+            response = PredictionResponse.model_validate_json(response_json)
+            response.status = PredictionStatus.failed
+            response.error = response.error or "Job lease expired too many times"
+            self._write(conn, job_id, response, now)
+    
+    @staticmethod
+    def _write(
+        conn,
+        job_id: str,
+        response: PredictionResponse,
+        now: float,
+        owner: Optional[str] = None,
+        unless_cancelled: bool = False,
+        **fields,
+    ) -> bool:
+        """
+        Update a job's response and `fields`; with `owner`, only while that
+        worker holds the lease, and with `unless_cancelled`, only if no
+        cancellation was requested. Returns whether the job was updated.
+        """
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        cursor = conn.execute(
+            f"UPDATE jobs SET response = ?, status = ?, updated_at = ?"
+            f"{', ' + assignments if assignments else ''} WHERE id = ?"
+            f"{' AND lease_owner = ?' if owner else ''}"
+            f"{' AND cancel_requested = 0' if unless_cancelled else ''}",
+            (response.model_dump_json(), response.status.value, now, *fields.values(), job_id,
+             *((owner,) if owner else ())),
+        )
+        return cursor.rowcount == 1
+    
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """
+        Extend the lease on a job. Returns False if the worker no longer holds
+        the lease or cancellation was requested, in which case it should stop.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ?"
+                " WHERE id = ? AND lease_owner = ? AND status = ? AND cancel_requested = 0",
+                (now + lease_seconds, now, job_id, worker_id, PredictionStatus.processing.value),
+            )
+            return cursor.rowcount == 1
+    
+    def save(self, response: PredictionResponse, worker_id: Optional[str] = None) -> bool:
+        """
+        Persist an updated response (status, progress, results). With
+        `worker_id`, only while that worker holds the job's lease and no
+        cancellation was requested, so the worker can stop. Returns whether
+        the response was written.
+        """
+        with self._connect() as conn:
+            return self._write(
+                conn, response.id, response, time.time(), worker_id, unless_cancelled=worker_id is not None
+            )
+    
+    def complete(self, job_id: str, worker_id: str, response: PredictionResponse) -> bool:
+        """
+        Store the final response and release the lease. Returns False, writing
+        nothing, if the worker no longer holds the lease.
+        
+        The response's `timings` are added to the shared stage and duration
+        histograms in the same transaction, so every process reports the
+        timings of jobs completed by any worker.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                written = self._write(
+                    conn, job_id, response, time.time(), worker_id, lease_owner=None, lease_expires=None
+                )
+                if written and response.timings is not None:
+                    observations = [
+                        ("stage", stage, seconds) for stage, seconds in response.timings.stages.items()
+                    ]
+                    observations.append(("duration", "", response.timings.total))
+                    conn.executemany(
+                        "INSERT INTO timing_buckets (metric, label, bucket, count, total) VALUES (?, ?, ?, 1, ?)"
+                        " ON CONFLICT (metric, label, bucket)"
+                        " DO UPDATE SET count = count + 1, total = total + excluded.total",
+                        [
+                            (metric, label, _histogram(metric).bucket(seconds), seconds)
+                            for metric, label, seconds in observations
+                        ],
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return written
+    
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """
+        Record a failed attempt of the worker holding the lease. The job goes
+        back to pending if it has attempts left; otherwise it is marked
+        failed. Returns True if it will be retried; nothing is recorded if the
+        worker lost the lease.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, attempts, max_attempts, cancel_requested FROM jobs"
+                " WHERE id = ? AND lease_owner = ?",
+                (job_id, worker_id),
+            ).fetchone()
+            if row is None:
+                return False
+            response_json, attempts, max_attempts, cancel_requested = row
+            response = PredictionResponse.model_validate_json(response_json)
+            retry = attempts < max_attempts and not cancel_requested
+            response.status = PredictionStatus.pending if retry else PredictionStatus.failed
+            response.error = error
+            if not retry:
+                response.completedAt = _utc_now()
+            written = self._write(conn, job_id, response, now, worker_id, lease_owner=None, lease_expires=None)
+            return retry and written
+    
+    def cancel(self, job_id: str) -> Optional[PredictionResponse]:
+        """
+        Cancel a job. Pending jobs are cancelled immediately; running jobs are
+        flagged and stopped by their worker at the next heartbeat.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT response, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            response = PredictionResponse.model_validate_json(row[0])
+            # The status column, since a claimed job's response reads pending until its worker saves it
+            status = PredictionStatus(row[1])
+            if status == PredictionStatus.pending:
+                response.status = PredictionStatus.cancelled
+                response.completedAt = _utc_now()
+                self._write(conn, job_id, response, now, cancel_requested=1)
+            elif status == PredictionStatus.processing:
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+                response.status = status
+            conn.execute("COMMIT")
+            return response
+    
+    def mark_cancelled(self, job_id: str):
+        """Record that a worker stopped a running job because cancellation was requested."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response FROM jobs WHERE id = ? AND cancel_requested = 1", (job_id,)
+            ).fetchone()
+            if row is None:
+                # Stopped because the lease was lost; the new lease holder owns the job
+                return
+            response = PredictionResponse.model_validate_json(row[0])
+            response.status = PredictionStatus.cancelled
+            response.completedAt = _utc_now()
+            self._write(conn, job_id, response, time.time(), lease_owner=None, lease_expires=None)
+    
+    def release(self, job_id: str, worker_id: str):
+        """
+        Return a job this worker holds to the queue, e.g. on shutdown. The
+        attempt is not counted, since the job did not fail.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, attempts FROM jobs WHERE id = ? AND lease_owner = ? AND status = ?",
+                (job_id, worker_id, PredictionStatus.processing.value),
+            ).fetchone()
+            if row is None:
+                return
+            response = PredictionResponse.model_validate_json(row[0])
+            response.status = PredictionStatus.pending
+            self._write(
+                conn, job_id, response, time.time(), worker_id,
+                attempts=max(row[1] - 1, 0), lease_owner=None, lease_expires=None,
+            )
+    
+    def get(self, job_id: str) -> Optional[PredictionResponse]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT response FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return PredictionResponse.model_validate_json(row[0]) if row else None
+    
+    def get_request(self, job_id: str) -> Optional[PredictionRequest]:
+        """The request a prediction was created from."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT request FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _stored_request(row[0]) if row else None
+    
+    def get_batch(self, batch_id: str) -> Optional[List[PredictionResponse]]:
+        """Return the predictions of a batch in request order, or None if it does not exist."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT item_ids FROM batches WHERE id = ?", (batch_id,)).fetchone()
+            if row is None:
+                return None
+            item_ids = json.loads(row[0])
+            rows = conn.execute(
+                f"SELECT id, response FROM jobs WHERE id IN ({', '.join('?' * len(item_ids))})",
+                item_ids,
+            ).fetchall()
+        responses = {job_id: PredictionResponse.model_validate_json(data) for job_id, data in rows}
+        return [responses[item_id] for item_id in item_ids if item_id in responses]
+    
+    def changes(self, job_ids: Iterable[str], since: float) -> List[Tuple[str, float, str]]:
+        """Return (id, updated_at, response JSON) of the given jobs updated after `since`."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return []
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT id, updated_at, response FROM jobs WHERE id IN ({', '.join('?' * len(job_ids))})"
+                " AND updated_at > ? ORDER BY updated_at",
+                (*job_ids, since),
+            ).fetchall()
+    
+    def page(
+        self,
+        limit: int,
+        after: Optional[Tuple[float, str]] = None,
+        statuses: Optional[Iterable[str]] = None,
+        created_after: Optional[float] = None,
+        created_before: Optional[float] = None,
+        region: Optional[str] = None,
+    ) -> Tuple[List[PredictionResponse], Optional[Tuple[float, str]]]:
+        """
+        Return up to `limit` predictions in creation order, plus the sort key
+        to pass as `after` for the next page (None on the last page).
+        
+        Filters: statuses, creation time range (epoch seconds) and the
+        request's region name.
+        """
+        clauses, params = [], []
+        if after is not None:
+            clauses.append("(created_at > ? OR (created_at = ? AND id > ?))")
+            params += [after[0], after[0], after[1]]
+        if statuses:
+            statuses = list(statuses)
+            clauses.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params += statuses
+        if created_after is not None:
+            clauses.append("created_at >= ?")
+            params.append(created_after)
+        if created_before is not None:
+            clauses.append("created_at < ?")
+            params.append(created_before)
+        if region:
+            clauses.append("json_extract(request, '$.region.name') = ?")
+            params.append(region)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT response, created_at, id FROM jobs {where}"
+                " ORDER BY created_at, id LIMIT ?",
+                (*params, limit + 1),
+            ).fetchall()
+        items = [PredictionResponse.model_validate_json(row[0]) for row in rows[:limit]]
+        next_key = (rows[limit - 1][1], rows[limit - 1][2]) if len(rows) > limit else None
+        return items, next_key
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return job counts by status."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+    
+    def load_timing_histograms(self):
+        """Copy the stage and duration histograms of all completed jobs into this process's metrics."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT metric, label, bucket, count, total FROM timing_buckets").fetchall()
+        histograms: Dict[Tuple[str, str], Tuple[Dict[float, int], List[float]]] = {}
+        for metric, label, bucket, count, total in rows:
+            counts, totals = histograms.setdefault((metric, label), ({}, [0.0]))
+            counts[bucket] = counts.get(bucket, 0) + count
+            totals[0] += total
+        for (metric, label), (counts, totals) in histograms.items():
+            if metric == "stage":
+                stage_seconds.set(counts, totals[0], stage=label)
+            else:
+                prediction_seconds.set(counts, totals[0])
+                predictions_completed.set(sum(counts.values()))
+
+
+def _histogram(metric: str):
+    return stage_seconds if metric == "stage" else prediction_seconds
+
+
+def _stored_request(request_json: str) -> PredictionRequest:
+    # Requests were validated when queued; limits added since do not apply to them
+    return PredictionRequest.model_validate_json(request_json, context={"stored": True})
+
+
+def _utc_now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+# Shared instance used by the API and worker processes
+job_queue = JobQueue()
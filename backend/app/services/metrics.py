@@ -0,0 +1,273 @@
+"""
+Metrics in the Prometheus text format.
+
+Counters, gauges and histograms are kept in memory and rendered by
+GET /api/metrics. Most are process-local. The prediction stage and
+duration histograms cover all workers instead: each completed job's
+`timings` are added to bucket counts in the job queue database (see
+`JobQueue.complete`), and the histograms are copied from there before
+rendering.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds (seconds) of the stage and prediction duration histograms
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+    
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+    
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+    
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up, per label combination."""
+    kind = "counter"
+    
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def set(self, value: float, **labels):
+        """Copy in a total kept elsewhere (e.g. a cache's hit counter) before rendering."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+    
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labels, key), value) for key, value in items]
+
+
+class Gauge(Counter):
+    """A value that can go up and down, per label combination."""
+    kind = "gauge"
+
+
+class Histogram(_Metric):
+    """Observation counts in cumulative buckets, with their sum and count."""
+    kind = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DURATION_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            total[0] += value
+    
+    def set(self, counts: Dict[float, int], total: float, **labels):
+        """Copy in observations kept elsewhere: counts per bucket upper bound, and their sum."""
+        key = self._key(labels)
+        bucket_counts = [0] * len(self.buckets)
+        for bound, count in counts.items():
+            bucket_counts[self.buckets.index(self.bucket(bound))] += count
+        with self._lock:
+            self._values[key] = (bucket_counts, [float(total)])
+    
+    def bucket(self, value: float) -> float:
+        """Upper bound of the bucket an observation of `value` falls in."""
+        return next(bound for bound in self.buckets if value <= bound)
+    
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        samples = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+                samples.append((f"{self.name}_bucket", labels, cumulative))
+            labels = _format_labels(self.labels, key)
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """Named metrics of this process, rendered together."""
+    
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+    
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+    
+    def gauge(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+    
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DURATION_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+    
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+# Shared registry of this process
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    "urban_prediction_stage_seconds",
+    "Seconds a completed prediction spent in each pipeline stage.",
+    ("stage",),
+)
+prediction_seconds = registry.histogram(
+    "urban_prediction_duration_seconds",
+    "Seconds from the start of processing to completion of a prediction.",
+)
+predictions_completed = registry.counter(
+    "urban_predictions_completed_total",
+    "Predictions completed by all workers.",
+)
+input_bytes = registry.counter(
+    "urban_input_bytes_total",
+    "Bytes of processed input arrays loaded, by input kind and source (file decode or array cache).",
+    ("kind", "source"),
+)
+cache_hits = registry.counter("urban_cache_hits_total", "Cache hits, by cache.", ("cache",))
+cache_misses = registry.counter("urban_cache_misses_total", "Cache misses, by cache.", ("cache",))
+jobs = registry.gauge("urban_jobs", "Prediction jobs in the job queue, by status.", ("status",))
+decode_tasks = registry.gauge(
+    "urban_decode_tasks", "Decode executor tasks, by state (queued or running).", ("state",)
+)
+model_requests_in_flight = registry.gauge(
+    "urban_model_requests_in_flight", "Requests to the model service awaiting a response."
+)
+
+
+def array_nbytes(value: Any) -> int:
+    """Total bytes of the NumPy arrays in a processed data dict (or list of them)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(array_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(array_nbytes(item) for item in value if isinstance(item, (np.ndarray, dict)))
+    return 0
+
+
+class StageTimings:
+    """
+    Seconds one prediction spends per pipeline stage, and the input bytes it loaded.
+    
+    Time recorded for the same stage adds up, e.g. over the model calls of
+    all tiles (which overlap, so a stage can exceed the wall time). The
+    totals reach the stage histograms once the job completes.
+    """
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.bytes_read = 0
+    
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+    
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+    
+    def merge(self, other: "StageTimings"):
+        """Add the stages and bytes of `other`, e.g. loads shared by the items of a batch."""
+        for stage, seconds in other.stages.items():
+            self.add(stage, seconds)
+        self.bytes_read += other.bytes_read
+    
+    def finish(self) -> Dict[str, Any]:
+        """Return the totals as PredictionTimings fields."""
+        total = time.perf_counter() - self.started
+        return {
+            "total": round(total, 6),
+            "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            "bytesRead": self.bytes_read,
+        }
+
+
+@contextmanager
+def timed(timings: Optional[StageTimings], stage: str):
+    """`timings.stage(stage)`, or nothing when no timings are collected."""
+    if timings is None:
+        yield
+    else:
+        with timings.stage(stage):
+            yield
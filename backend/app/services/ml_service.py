@@ -1,8 +1,25 @@
 import os
+import time
+import asyncio
 import httpx
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable, List
+from urllib.parse import urlsplit
 from fastapi import HTTPException
 from app.models.schemas import PredictionResponse, PredictionStatus, ModelMetrics
+from app.utils.array_codec import (
+    CONTENT_TYPE,
+    decode_model_input,
+    encode_model_input,
+    to_json_compatible,
+)
+from app.services.metrics import StageTimings, timed
+try:
+    import h2  # noqa: F401
+    HAS_H2 = True
+except ImportError:
+    HAS_H2 = False
+
+_STREAM_CHUNK_SIZE = 1024 * 1024
 
 
 class MLService:
@@ -14,24 +31,139 @@ class MLService:
             "http://localhost:8001"
         )
         self.timeout = 300.0  # 5 minutes for model inference
+        # "binary" sends arrays in the binary wire format, "json" sends nested lists
+        self.transport = os.getenv("URBAN_MODEL_TRANSPORT", "binary").lower()
+        self.compression = os.getenv("URBAN_MODEL_COMPRESSION") or None
+        # Seconds a host that rejected the binary format is sent JSON before binary is tried again
+        self.json_fallback_seconds = float(os.getenv("URBAN_MODEL_JSON_FALLBACK_SECONDS", "300"))
+        
+        # Connection pool and concurrency settings for the shared client
+        self.max_connections = int(os.getenv("URBAN_MODEL_MAX_CONNECTIONS", "20"))
+        self.max_keepalive = int(os.getenv("URBAN_MODEL_MAX_KEEPALIVE", "10"))
+        self.http2 = os.getenv("URBAN_MODEL_HTTP2", "true").lower() == "true" and HAS_H2
+        self.max_in_flight_per_host = int(os.getenv("URBAN_MODEL_MAX_IN_FLIGHT", "8"))
+        self.max_retries = int(os.getenv("URBAN_MODEL_RETRIES", "3"))
+        self.retry_backoff = float(os.getenv("URBAN_MODEL_RETRY_BACKOFF", "0.5"))
+        
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        # Host -> time.monotonic() until which it is sent JSON
+        self._json_hosts: Dict[str, float] = {}
+        # Requests sent and awaiting a response, reported by /api/metrics
+        self.in_flight = 0
+    
+    async def start(self):
+        """Create the shared HTTP client. Called from the application lifespan."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(30.0, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                ),
+                http2=self.http2,
+            )
+    
+    async def close(self):
+        """Close the shared HTTP client and its pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        # Background tasks may run outside the lifespan (e.g. in scripts), so start lazily
+        if self._client is None:
+            await self.start()
+        return self._client
+    
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_in_flight_per_host)
+        return self._host_limits[host]
+    
+    def _sends_binary(self, host: str) -> bool:
+        if self.transport != "binary":
+            return False
+        until = self._json_hosts.get(host)
+        if until is None:
+            return True
+        if time.monotonic() >= until:
+            del self._json_hosts[host]
+            return True
+        return False
+    
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        build_kwargs: Callable[[], Dict[str, Any]],
+    ) -> httpx.Response:
+        """
+        Send a request through the shared client.
+        
+        In-flight requests are capped per host, and connection errors are
+        retried with exponential backoff. Request kwargs are rebuilt for every
+        attempt because streamed bodies cannot be replayed.
+        """
+        client = await self._get_client()
+        async with self._host_limit(url):
+            for attempt in range(self.max_retries + 1):
+                self.in_flight += 1
+                try:
+                    return await client.request(method, url, **build_kwargs())
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError):
+                    if attempt == self.max_retries:
+                        raise
+                finally:
+                    self.in_flight -= 1
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
     
     async def predict(
         self,
-        model_input: Dict[str, Any]
+        model_input: Dict[str, Any],
+        timings: Optional[StageTimings] = None,
     ) -> Dict[str, Any]:
         """
         Send prediction request to URBAN ML model service.
         
         This assumes the ML model service has an endpoint that accepts
-        the processed geospatial data and returns predictions.
+        the processed geospatial data and returns predictions. Arrays are sent
+        in the binary wire format; if the service rejects it (415), the request
+        is resent as JSON, and that host is sent JSON for the next
+        `json_fallback_seconds` before binary is tried again. Responses in the
+        binary format are decoded with their arrays as NumPy arrays.
+        
+        With `timings`, encoding and decoding are recorded as the "serialize"
+        stage and the request itself as "model".
         """
+        url = f"{self.model_service_url}/predict"
+        host = urlsplit(url).netloc
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.model_service_url}/predict",
-                    json=model_input,
-                )
-                response.raise_for_status()
+            binary = self._sends_binary(host)
+            if binary:
+                with timed(timings, "serialize"):
+                    chunks, content_length = encode_model_input(model_input, self.compression)
+                with timed(timings, "model"):
+                    response = await self._request(
+                        "POST", url, lambda: self._binary_kwargs(chunks, content_length)
+                    )
+                if response.status_code == 415:
+                    self._json_hosts[host] = time.monotonic() + self.json_fallback_seconds
+                    binary = False
+            if not binary:
+                with timed(timings, "serialize"):
+                    json_input = to_json_compatible(model_input)
+                with timed(timings, "model"):
+                    response = await self._request(
+                        "POST",
+                        url,
+                        lambda: {"json": json_input, "timeout": self.timeout},
+                    )
+            response.raise_for_status()
+            with timed(timings, "serialize"):
+                if response.headers.get("content-type", "").startswith(CONTENT_TYPE):
+                    return decode_model_input(response.content)
                 return response.json()
         except httpx.TimeoutException:
             raise HTTPException(
@@ -49,15 +181,34 @@ class MLService:
                 detail=f"Error calling model service: {str(e)}"
             )
     
+    def _binary_kwargs(self, chunks: List[Any], content_length: int) -> Dict[str, Any]:
+        """Build request kwargs that stream encoded model input in the binary wire format."""
+        async def body():
+            # Copy at most _STREAM_CHUNK_SIZE bytes at a time instead of whole arrays
+            for chunk in chunks:
+                view = memoryview(chunk)
+                for start in range(0, len(view), _STREAM_CHUNK_SIZE):
+                    yield bytes(view[start:start + _STREAM_CHUNK_SIZE])
+        
+        return {
+            "content": body(),
+            "headers": {
+                "Content-Type": CONTENT_TYPE,
+                "Content-Length": str(content_length),
+            },
+            "timeout": self.timeout,
+        }
+    
     async def get_prediction_status(self, prediction_id: str) -> Dict[str, Any]:
         """Get status of an async prediction."""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.model_service_url}/predictions/{prediction_id}/status"
-                )
-                response.raise_for_status()
-                return response.json()
+            response = await self._request(
+                "GET",
+                f"{self.model_service_url}/predictions/{prediction_id}/status",
+                dict,
+            )
+            response.raise_for_status()
+            return response.json()
         except Exception as e:
             raise HTTPException(
                 status_code=500,
@@ -85,3 +236,6 @@ class MLService:
             completedAt=model_output.get("completed_at"),
         )
 
+
+# Shared instance used by all routes; its HTTP client is opened and closed in the app lifespan
+ml_service = MLService()
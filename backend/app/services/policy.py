@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+import numpy as np
+try:
+    from rasterio.features import rasterize
+    from rasterio.transform import Affine
+    from rasterio.warp import transform_geom
+    HAS_RASTERIO = True
+except ImportError:
+    HAS_RASTERIO = False
+from app.models.schemas import UrbanPolicy
+from app.services.data_processor import REGION_CRS
+
+# Rasterized boundaries and zones kept in memory, one per geometry and urban grid
+POLICY_MASK_CACHE_SIZE = int(os.getenv("POLICY_MASK_CACHE_SIZE", "32"))
+
+_AREA_TYPES = ("Polygon", "MultiPolygon")
+
+
+def _geometries(geojson: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Polygon geometries of a GeoJSON geometry, Feature or FeatureCollection."""
+    kind = geojson.get("type") if isinstance(geojson, dict) else None
+    if kind == "FeatureCollection":
+        return [g for feature in geojson.get("features", []) for g in _geometries(feature)]
+    if kind == "Feature":
+        return _geometries(geojson["geometry"]) if geojson.get("geometry") else []
+    if kind == "GeometryCollection":
+        return [g for geometry in geojson.get("geometries", []) for g in _geometries(geometry)]
+    if kind in _AREA_TYPES:
+        return [geojson]
+    raise ValueError(f"Unsupported GeoJSON for a policy area: {kind}")
+
+
+def _zoning(zoning: Dict[str, Any]) -> Tuple[float, List[Tuple[Dict[str, Any], float]]]:
+    """Parse zoning regulations into the non-urban value and (geometry, value) zones."""
+    zoning = zoning or {}
+    non_urban = float(zoning.get("nonUrbanValue", 0.0))
+    zones = []
+    for zone in zoning.get("zones", []):
+        if not isinstance(zone, dict) or "geometry" not in zone or "value" not in zone:
+            raise ValueError("Each zone needs a geometry and a value")
+        _geometries(zone["geometry"])
+        zones.append((zone["geometry"], float(zone["value"])))
+    return non_urban, zones
+
+
+def validate_policy(policy: UrbanPolicy):
+    """Raise ValueError if the policy's GeoJSON or zoning regulations cannot be applied."""
+    if policy.urbanGrowthBoundaries is not None:
+        _geometries(policy.urbanGrowthBoundaries)
+    _zoning(policy.zoningRegulations)
+
+
+class PolicyMasks:
+    """Policy areas rasterized onto urban grids, cached per geometry and grid."""
+    
+    def __init__(self, max_size: int = POLICY_MASK_CACHE_SIZE):
+        self.max_size = max_size
+        self._masks: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def mask(self, geojson: Dict[str, Any], transform: List[float], crs: str, shape: Tuple[int, int]) -> np.ndarray:
+        """Read-only boolean mask of the pixels inside `geojson` (WGS84) on the given grid."""
+        digest = hashlib.sha256(json.dumps(geojson, sort_keys=True).encode("utf-8")).hexdigest()
+        key = (digest, tuple(transform[:6]), crs, tuple(shape))
+        with self._lock:
+            if key in self._masks:
+                self._masks.move_to_end(key)
+                return self._masks[key]
+        geometries = _geometries(geojson)
+        if crs not in (None, "", "None"):
+            geometries = [transform_geom(REGION_CRS, crs, geometry) for geometry in geometries]
+        if geometries:
+            mask = rasterize(
+                [(geometry, 1) for geometry in geometries],
+                out_shape=shape,
+                transform=Affine(*transform[:6]),
+                fill=0,
+                dtype="uint8",
+            ).astype(bool)
+        else:
+            mask = np.zeros(shape, dtype=bool)
+        mask.flags.writeable = False
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > self.max_size:
+                self._masks.popitem(last=False)
+        return mask
+
+
+policy_masks = PolicyMasks()
+
+
+def apply_policy(urban_data: Dict[str, Any], policy: UrbanPolicy, masks: PolicyMasks = policy_masks) -> Dict[str, Any]:
+    """
+    Return processed urban data with a policy applied; the input is not modified.
+    
+    Urban pixels (value above 0) outside the growth boundaries get the
+    non-urban value, then each zone sets its value inside it, in order.
+    NaN pixels stay NaN.
+    """
+    if not HAS_RASTERIO:
+        raise Exception("rasterio is required for policy simulation. Please install it.")
+    transform = urban_data.get('transform')
+    if not transform:
+        raise Exception("Policy simulation requires a georeferenced urban raster")
+    crs = urban_data.get('crs')
+    data = urban_data['data'].copy()
+    shape = data.shape[-2:]
+    valid = np.isfinite(data)
+    non_urban, zones = _zoning(policy.zoningRegulations)
+    
+    if policy.urbanGrowthBoundaries is not None:
+        inside = masks.mask(policy.urbanGrowthBoundaries, transform, crs, shape)
+        data[valid & ~inside & (data > 0)] = non_urban
+    for geometry, value in zones:
+        data[valid & masks.mask(geometry, transform, crs, shape)] = value
+    
+    return {**urban_data, 'data': data}
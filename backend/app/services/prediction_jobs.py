@@ -0,0 +1,34 @@
+import uuid
+import asyncio
+from datetime import datetime
+from app.models.schemas import PredictionRequest, PredictionResponse, PredictionStatus
+from app.services.job_queue import job_queue
+from app.services.prediction_memo import PREDICTION_MEMO_TTL, prediction_memo, request_fingerprint
+
+
+async def submit_prediction(request: PredictionRequest, profile: bool = False) -> PredictionResponse:
+    """
+    Queue a prediction for a worker (see app/worker.py) and return it.
+    
+    Identical requests share one computation: a request matching one that is
+    still queued or running returns that prediction, and one matching a
+    recently completed prediction returns the stored result. With `profile`,
+    the worker profiles the prediction run.
+    """
+    fingerprint = request_fingerprint(request)
+    cached = prediction_memo.get(fingerprint)
+    if cached is not None:
+        return cached
+    
+    prediction = PredictionResponse(
+        id=str(uuid.uuid4()),
+        status=PredictionStatus.pending,
+        createdAt=datetime.utcnow().isoformat(),
+    )
+    prediction = await asyncio.to_thread(
+        job_queue.enqueue,
+        request, prediction, request_hash=fingerprint, reuse_within=PREDICTION_MEMO_TTL,
+        profile=profile,
+    )
+    prediction_memo.put(fingerprint, prediction)
+    return prediction
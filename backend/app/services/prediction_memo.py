@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+from app.models.schemas import PredictionRequest, PredictionResponse, PredictionStatus
+from app.services.file_handler import FileHandler
+
+# Completed predictions are reused for identical requests for this many seconds
+PREDICTION_MEMO_TTL = float(os.getenv("PREDICTION_MEMO_TTL", "3600"))
+PREDICTION_MEMO_SIZE = int(os.getenv("PREDICTION_MEMO_SIZE", "256"))
+
+_DATA_ID_FIELDS = (
+    "urbanDataId",
+    "temperatureDataId",
+    "precipitationDataId",
+    "historicalYieldDataId",
+)
+
+
+def request_fingerprint(request: PredictionRequest) -> str:
+    """
+    Canonical hash of a prediction request. Dataset IDs are replaced by their
+    content hash when known, so re-uploads of the same file match too.
+    """
+    canonical = request.model_dump(mode="json")
+    for field in _DATA_ID_FIELDS:
+        if canonical.get(field):
+            canonical[field] = FileHandler.get_content_hash(canonical[field]) or canonical[field]
+    if canonical.get("region"):
+        # Region display fields do not change the computation
+        canonical["region"] = canonical["region"]["bounds"]
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PredictionMemo:
+    """
+    In-process LRU of completed predictions by request fingerprint.
+    
+    Entries expire `ttl` seconds after the prediction completed, matching
+    the window in which the job queue reuses completed jobs.
+    """
+    
+    def __init__(self, max_entries: int = PREDICTION_MEMO_SIZE, ttl: float = PREDICTION_MEMO_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, PredictionResponse]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, fingerprint: str) -> Optional[PredictionResponse]:
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None or entry[0] < time.time():
+                self._entries.pop(fingerprint, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(fingerprint)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, fingerprint: str, response: PredictionResponse):
+        """Remember a completed prediction; other statuses and expired ones are ignored."""
+        if response.status != PredictionStatus.completed:
+            return
+        expires = _timestamp(response.completedAt) + self.ttl
+        if expires < time.time():
+            return
+        with self._lock:
+            self._entries[fingerprint] = (expires, response)
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _timestamp(completed_at: Optional[str]) -> float:
+    """Epoch seconds of a naive UTC ISO timestamp; now if it is missing or malformed."""
+    try:
+        return datetime.fromisoformat(completed_at).replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+prediction_memo = PredictionMemo()
@@ -0,0 +1,323 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from app.models.schemas import (
+    PredictionRequest,
+    PredictionResponse,
+    PredictionStatus,
+    PredictionStage,
+    PredictionTimings,
+    ModelMetrics,
+)
+from app.services.ml_service import ml_service
+from app.services.data_processor import DataProcessor
+from app.services.file_handler import FileHandler
+from app.services.tiled_inference import TiledPredictor
+from app.services.raster_store import raster_store, HAS_RASTERIO
+from app.services.zonal_stats import zonal_stats, bounds_geometry
+from app.services.policy import apply_policy
+from app.services.tile_cache import tile_result_cache
+from app.services.executor import decode_executor
+from app.services.metrics import StageTimings, array_nbytes
+from app.utils.array_codec import to_png_data_url
+
+logger = logging.getLogger(__name__)
+
+data_processor = DataProcessor()
+file_handler = FileHandler()
+
+# Items of a batch whose model calls run at the same time
+BATCH_PREDICTION_CONCURRENCY = int(os.getenv("BATCH_PREDICTION_CONCURRENCY", "4"))
+
+
+class JobStopped(Exception):
+    """`save` refused an update: the job was cancelled or its worker lost the lease."""
+
+
+def cache_key_for(file_id: str) -> str:
+    """Key processed arrays by content hash when known, otherwise by file ID."""
+    return file_handler.get_content_hash(file_id) or file_id
+
+
+async def _save_or_stop(prediction: PredictionResponse, save: Callable[[PredictionResponse], Awaitable[bool]]):
+    if not await save(prediction):
+        raise JobStopped(f"Prediction {prediction.id} was stopped")
+
+
+async def _start(prediction: PredictionResponse, save: Callable[[PredictionResponse], Awaitable[bool]]):
+    prediction.status = PredictionStatus.processing
+    prediction.stage = PredictionStage.load
+    prediction.error = None
+    await _save_or_stop(prediction, save)
+
+
+def _input_files(request: PredictionRequest) -> Tuple[Path, Path, Path, Optional[Path]]:
+    """Resolve the uploaded files of a request; the historical yield file is optional."""
+    urban_file = file_handler.get_file_path(request.urbanDataId, "urban")
+    temp_file = file_handler.get_file_path(request.temperatureDataId, "climate")
+    prec_file = file_handler.get_file_path(request.precipitationDataId, "climate")
+    
+    if not all([urban_file, temp_file, prec_file]):
+        raise Exception("One or more data files not found")
+    
+    hist_file = None
+    if request.historicalYieldDataId:
+        hist_file = file_handler.get_file_path(request.historicalYieldDataId, "historical-yields")
+    return urban_file, temp_file, prec_file, hist_file
+
+
+async def process_prediction(
+    prediction: PredictionResponse,
+    request: PredictionRequest,
+    save: Callable[[PredictionResponse], Awaitable[bool]],
+) -> PredictionResponse:
+    """
+    Run the prediction pipeline for one job.
+    
+    Status, stage, progress and results are written to `prediction` and
+    persisted by awaiting `save`, along with the time spent per stage once
+    it completes. Errors are raised to the caller, which decides whether the
+    job is retried or failed.
+    """
+    timings = StageTimings()
+    # Update status to processing
+    await _start(prediction, save)
+    
+    # Load and process data files
+    with timings.stage("lookup"):
+        urban_file, temp_file, prec_file, hist_file = _input_files(request)
+    
+    # Process data (cached by content hash so identical uploads share entries),
+    # reading only the requested region when one is given
+    bounds = request.region.bounds if request.region else None
+    with timings.stage("urban_decode"):
+        urban_data = await data_processor.process_urban_data(
+            str(urban_file), cache_key=cache_key_for(request.urbanDataId), bounds=bounds
+        )
+    with timings.stage("climate_decode"):
+        temp_data = await data_processor.process_climate_data(
+            str(temp_file), "temperature",
+            cache_key=cache_key_for(request.temperatureDataId), bounds=bounds, year=request.year,
+        )
+        prec_data = await data_processor.process_climate_data(
+            str(prec_file), "precipitation",
+            cache_key=cache_key_for(request.precipitationDataId), bounds=bounds, year=request.year,
+        )
+        
+        historical_yield_data = None
+        if hist_file:
+            historical_yield_data = await data_processor.process_climate_data(
+                str(hist_file), "yield",
+                cache_key=cache_key_for(request.historicalYieldDataId), bounds=bounds,
+            )
+    timings.bytes_read += array_nbytes([urban_data, temp_data, prec_data, historical_yield_data])
+    
+    return await _predict(
+        prediction, request, urban_data, temp_data, prec_data, historical_yield_data, save, timings
+    )
+
+
+async def process_batch(
+    items: List[Tuple[PredictionResponse, PredictionRequest]],
+    save: Callable[[PredictionResponse], Awaitable[bool]],
+) -> Dict[str, Optional[Exception]]:
+    """
+    Run several predictions over the same uploaded files together.
+    
+    Each input file is read once for all items: the urban raster over the
+    union of each group of nearby item regions, and each climate file once
+    per year, then cut per item in memory (see
+    DataProcessor.process_urban_regions). Model calls for the items then run
+    concurrently, at most BATCH_PREDICTION_CONCURRENCY at a time. Returns
+    the error of each prediction by ID (None on success), so items succeed
+    or fail independently; an item whose `save` is refused, e.g. because
+    it was cancelled, stops before its model call with JobStopped. Time
+    spent on shared reads is counted in the stage timings of every item
+    that uses them.
+    """
+    timings = [StageTimings() for _ in items]
+    load_errors: Dict[int, Exception] = {}
+    for i, (prediction, _) in enumerate(items):
+        try:
+            await _start(prediction, save)
+        except JobStopped as e:
+            load_errors[i] = e
+    requests = [request for _, request in items]
+    first = requests[0]
+    regions = [request.region.bounds if request.region else None for request in requests]
+    
+    shared = StageTimings()
+    try:
+        with shared.stage("lookup"):
+            urban_file, temp_file, prec_file, hist_file = _input_files(first)
+        with shared.stage("urban_decode"):
+            urban_data = await data_processor.process_urban_regions(
+                str(urban_file), regions, cache_key=cache_key_for(first.urbanDataId)
+            )
+        hist_data: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        if hist_file:
+            with shared.stage("climate_decode"):
+                hist_data = await data_processor.process_climate_regions(
+                    str(hist_file), "yield", regions,
+                    cache_key=cache_key_for(first.historicalYieldDataId),
+                )
+    except Exception as e:
+        return {prediction.id: load_errors.get(i, e) for i, (prediction, _) in enumerate(items)}
+    for item_timings in timings:
+        item_timings.merge(shared)
+    
+    # Climate inputs are read per year; a failing year only fails its items
+    temp_data: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    prec_data: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    for year in sorted({request.year for request in requests}):
+        indices = [i for i, request in enumerate(requests) if request.year == year]
+        year_regions = [regions[i] for i in indices]
+        year_timings = StageTimings()
+        try:
+            with year_timings.stage("climate_decode"):
+                for target, path, variable, file_id in (
+                    (temp_data, temp_file, "temperature", first.temperatureDataId),
+                    (prec_data, prec_file, "precipitation", first.precipitationDataId),
+                ):
+                    results = await data_processor.process_climate_regions(
+                        str(path), variable, year_regions, cache_key=cache_key_for(file_id), year=year
+                    )
+                    for i, result in zip(indices, results):
+                        target[i] = result
+        except Exception as e:
+            load_errors.update((i, e) for i in indices if i not in load_errors)
+        for i in indices:
+            timings[i].merge(year_timings)
+    
+    semaphore = asyncio.Semaphore(BATCH_PREDICTION_CONCURRENCY)
+    
+    async def run(i: int) -> Optional[Exception]:
+        prediction, request = items[i]
+        if i in load_errors:
+            return load_errors[i]
+        timings[i].bytes_read += array_nbytes([urban_data[i], temp_data[i], prec_data[i], hist_data[i]])
+        try:
+            async with semaphore:
+                await _predict(
+                    prediction, request, urban_data[i], temp_data[i], prec_data[i], hist_data[i], save,
+                    timings[i],
+                )
+        except Exception as e:
+            return e
+        return None
+    
+    results = await asyncio.gather(*(run(i) for i in range(len(items))))
+    return {prediction.id: error for (prediction, _), error in zip(items, results)}
+
+
+def _index_prediction(prediction: PredictionResponse, request: PredictionRequest):
+    """Register a prediction raster (and its request's region) for analytics and schedule a refresh."""
+    if request.region and request.region.id:
+        zonal_stats.ensure_region(request.region.id, request.region.name, bounds_geometry(request.region.bounds))
+    zonal_stats.add_source(prediction.id, "prediction", str(raster_store.raster_path(prediction.id)), request.year)
+    zonal_stats.schedule_refresh()
+
+
+async def _predict(
+    prediction: PredictionResponse,
+    request: PredictionRequest,
+    urban_data: Dict[str, Any],
+    temp_data: Dict[str, Any],
+    prec_data: Dict[str, Any],
+    historical_yield_data: Optional[Dict[str, Any]],
+    save: Callable[[PredictionResponse], Awaitable[bool]],
+    timings: Optional[StageTimings] = None,
+) -> PredictionResponse:
+    """Prepare model input from processed data, call the model and store the results."""
+    timings = timings or StageTimings()
+    # Prepare model input
+    prediction.stage = PredictionStage.prepare
+    await _save_or_stop(prediction, save)
+    if request.policy:
+        with timings.stage("policy"):
+            urban_data = await asyncio.to_thread(apply_policy, urban_data, request.policy)
+    with timings.stage("prepare"):
+        model_input = await decode_executor.run(
+            data_processor.prepare_model_input, urban_data, temp_data, prec_data, historical_yield_data
+        )
+    
+    # Call ML model service, tile by tile for large inputs
+    # Last check before the model call, e.g. for items of a batch cancelled meanwhile
+    prediction.stage = PredictionStage.inference
+    await _save_or_stop(prediction, save)
+    tiled = request.tiled if request.tiled is not None else TiledPredictor.should_tile(model_input)
+    # Policy what-ifs are predicted tile by tile so tiles the policy leaves
+    # unchanged are reused from the baseline or earlier simulations
+    if request.policy and request.tiled is None:
+        tiled = True
+    if tiled:
+        predictor = TiledPredictor(ml_service, cache=tile_result_cache)
+        if request.tileSize:
+            predictor.tile_size = request.tileSize
+        if request.tileOverlap is not None:
+            predictor.overlap = request.tileOverlap
+        
+        async def on_progress(completed: int, total: int):
+            prediction.tilesTotal = total
+            prediction.tilesCompleted = completed
+            prediction.progress = completed / total if total else 1.0
+            if completed == total:
+                prediction.stage = PredictionStage.stitch
+            await save(prediction)
+        
+        model_output = await predictor.predict(model_input, on_progress, timings)
+        prediction.tilesCached = model_output.get("tiles_cached")
+    else:
+        model_output = await ml_service.predict(model_input, timings)
+    
+    # Store prediction arrays as tiled rasters served by the tile endpoint,
+    # so status responses do not carry the whole map
+    prediction_array = model_output.get("prediction")
+    if prediction_array is not None and HAS_RASTERIO:
+        if prediction.stage != PredictionStage.stitch:
+            prediction.stage = PredictionStage.stitch
+            await save(prediction)
+        with timings.stage("store"):
+            await asyncio.to_thread(
+                raster_store.save,
+                prediction.id,
+                np.asarray(prediction_array),
+                urban_data.get('bounds'),
+                urban_data.get('crs'),
+            )
+        prediction.tileUrl = raster_store.tile_url(prediction.id)
+        prediction.predictionMap = None
+    elif prediction_array is not None:
+        with timings.stage("store"):
+            prediction.predictionMap = to_png_data_url(prediction_array)
+    else:
+        prediction.predictionMap = model_output.get("prediction_map")
+    
+    # Update prediction with results
+    prediction.status = PredictionStatus.completed
+    prediction.stage = None
+    prediction.metrics = ModelMetrics(
+        mae=model_output.get("mae", 0.0),
+        rmse=model_output.get("rmse", 0.0),
+        mse=model_output.get("mse", 0.0),
+        accuracy=model_output.get("accuracy"),
+    ) if model_output.get("metrics") else None
+    prediction.confidence = model_output.get("confidence")
+    
+    # Add the stored raster to the regional analytics index; it is aggregated in the background
+    if prediction.tileUrl:
+        with timings.stage("analytics"):
+            try:
+                await asyncio.to_thread(_index_prediction, prediction, request)
+            except Exception as e:
+                # Analytics are derived data; the prediction itself succeeded
+                logger.warning("Could not index prediction %s for analytics: %s", prediction.id, e)
+    
+    prediction.completedAt = datetime.utcnow().isoformat()
+    prediction.timings = PredictionTimings(**timings.finish())
+    await save(prediction)
+    return prediction
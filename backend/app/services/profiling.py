@@ -0,0 +1,186 @@
+"""
+Opt-in sampling profiles of API requests and prediction runs.
+
+While a profile runs, a background thread samples the Python stacks of the
+process every PROFILE_INTERVAL seconds. Stacks are saved in the folded
+format ("thread;outer;...;inner count" per line), which flamegraph.pl,
+inferno and speedscope read directly. Sampling covers the whole process,
+so work of concurrent requests on the event loop shows up too; idle pool
+threads are left out. Nothing is sampled unless a profile is running.
+"""
+import os
+import re
+import sys
+import time
+import uuid
+import random
+import asyncio
+import threading
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, List, Optional
+from app.models.schemas import ProfileInfo
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+# Seconds between stack samples
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+# Fraction of requests and prediction runs profiled without being asked to (0 = none)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Profiles kept; the oldest are removed beyond this
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+_PROFILE_ID = re.compile(r"^[A-Za-z0-9_.-]{1,192}$")
+# Innermost frames of threads waiting for work
+_IDLE_FRAMES = {("threading.py", "wait"), ("queue.py", "get"), ("thread.py", "_worker")}
+
+
+def should_sample() -> bool:
+    """Whether to profile a run that was not explicitly flagged, at PROFILE_SAMPLE_RATE."""
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def valid_profile_id(profile_id: str) -> bool:
+    return bool(_PROFILE_ID.match(profile_id))
+
+
+def new_profile_id(kind: str, subject: Optional[str] = None) -> str:
+    """
+    A fresh ID for a "request" or "prediction" profile: the kind, what was
+    profiled (if given) and a random suffix, so no profile replaces another.
+    """
+    return "-".join(part for part in (kind, subject, uuid.uuid4().hex[:12]) if part)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """Counts the folded stacks of all busy threads, sampled on a background thread."""
+    
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = 0.0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.time() - self.started
+    
+    def _run(self):
+        # Sample once right away, so even requests shorter than the interval get a stack
+        own = threading.get_ident()
+        while True:
+            self._sample(own)
+            if self._stop.wait(self.interval):
+                break
+    
+    def _sample(self, own: int):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            leaf = (Path(frame.f_code.co_filename).name, frame.f_code.co_name)
+            if leaf in _IDLE_FRAMES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(labels))] += 1
+        self.samples += 1
+    
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """Folded profiles on disk by request or prediction ID, with a JSON sidecar each."""
+    
+    def __init__(self, directory: Path = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+    
+    def path(self, profile_id: str) -> Optional[Path]:
+        """Path of a stored profile, or None for unknown or malformed IDs."""
+        if not valid_profile_id(profile_id):
+            return None
+        path = self.directory / f"{profile_id}.folded"
+        return path if path.exists() else None
+    
+    def save(self, profile_id: str, kind: str, target: str, profiler: SamplingProfiler) -> ProfileInfo:
+        info = ProfileInfo(
+            id=profile_id,
+            kind=kind,
+            target=target,
+            startedAt=datetime.utcfromtimestamp(profiler.started).isoformat(),
+            duration=round(profiler.duration, 6),
+            samples=profiler.samples,
+        )
+        self.directory.mkdir(exist_ok=True, parents=True)
+        (self.directory / f"{profile_id}.folded").write_text(profiler.folded())
+        (self.directory / f"{profile_id}.json").write_text(info.model_dump_json())
+        with self._lock:
+            self._prune()
+        return info
+    
+    def list(self) -> List[ProfileInfo]:
+        """Stored profiles, newest first."""
+        profiles = []
+        for meta_path in self.directory.glob("*.json"):
+            try:
+                profiles.append(ProfileInfo.model_validate_json(meta_path.read_text()))
+            except (OSError, ValueError):
+                continue
+        return sorted(profiles, key=lambda info: info.startedAt, reverse=True)
+    
+    def _prune(self):
+        meta_paths = sorted(self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        for meta_path in meta_paths[:max(0, len(meta_paths) - self.max_files)]:
+            meta_path.with_suffix(".folded").unlink(missing_ok=True)
+            meta_path.unlink(missing_ok=True)
+
+
+profile_store = ProfileStore()
+
+
+def _finish(profile_id: str, kind: str, target: str, profiler: SamplingProfiler):
+    profiler.stop()
+    profile_store.save(profile_id, kind, target, profiler)
+
+
+@asynccontextmanager
+async def profiled(profile_id: str, kind: str, target: str) -> AsyncIterator[SamplingProfiler]:
+    """
+    Sample the process while the block runs and store the profile under
+    `profile_id`. Stopping the sampler and writing the profile happen off
+    the event loop.
+    """
+    profiler = SamplingProfiler()
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        await asyncio.to_thread(_finish, profile_id, kind, target, profiler)
+
+
+async def run_profiled(profile_id: str, kind: str, target: str, awaitable) -> Any:
+    """Await `awaitable` inside `profiled`, e.g. a background prediction run."""
+    async with profiled(profile_id, kind, target):
+        return await awaitable
@@ -0,0 +1,106 @@
+import os
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional, Set
+from app.models.schemas import PredictionResponse, PredictionStatus
+from app.services.job_queue import job_queue
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reads of the job queue's change feed while clients are subscribed
+PROGRESS_POLL_INTERVAL = float(os.getenv("PROGRESS_POLL_INTERVAL", "0.5"))
+# Re-read this many seconds of history on every poll, so updates committed
+# late by another process (or with a slightly skewed clock) are not missed
+_LOOKBACK_SECONDS = 5.0
+
+TERMINAL_STATUSES = {
+    PredictionStatus.completed,
+    PredictionStatus.failed,
+    PredictionStatus.cancelled,
+}
+
+
+class ProgressBroker:
+    """
+    In-process pub/sub of prediction updates.
+    
+    Predictions are updated by workers in any process through the shared job
+    queue, so one watcher task per API process reads the queue's change feed
+    for all subscribed IDs and fans updates out to subscriber queues. The
+    watcher only runs while someone is subscribed, and costs one indexed
+    query per poll interval however many clients are listening.
+    """
+    
+    def __init__(self, poll_interval: float = PROGRESS_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        # Last published response JSON per prediction, to publish changes only
+        self._last_sent: Dict[str, str] = {}
+        self._since = 0.0
+        self._task: Optional[asyncio.Task] = None
+    
+    def subscribe(
+        self,
+        prediction_ids: Iterable[str],
+        current: Optional[Dict[str, PredictionResponse]] = None,
+    ) -> asyncio.Queue:
+        """
+        Return a queue that receives PredictionResponse updates for the given
+        IDs. `current` holds the states the subscriber already has, which are
+        not sent again.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for prediction_id in prediction_ids:
+            self._subscribers.setdefault(prediction_id, set()).add(queue)
+            if current and prediction_id in current and prediction_id not in self._last_sent:
+                self._last_sent[prediction_id] = current[prediction_id].model_dump_json()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._watch())
+        return queue
+    
+    def unsubscribe(self, prediction_ids: Iterable[str], queue: asyncio.Queue):
+        for prediction_id in prediction_ids:
+            queues = self._subscribers.get(prediction_id)
+            if queues is None:
+                continue
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[prediction_id]
+                self._last_sent.pop(prediction_id, None)
+    
+    def publish(self, prediction: PredictionResponse, data: Optional[str] = None):
+        """Deliver an update to the subscribers of its prediction, unless it is unchanged."""
+        data = data or prediction.model_dump_json()
+        if self._last_sent.get(prediction.id) == data:
+            return
+        self._last_sent[prediction.id] = data
+        for queue in self._subscribers.get(prediction.id, ()):
+            queue.put_nowait(prediction)
+    
+    async def _watch(self):
+        self._since = 0.0
+        while self._subscribers:
+            try:
+                since = max(self._since - _LOOKBACK_SECONDS, 0.0)
+                rows = await asyncio.to_thread(job_queue.changes, list(self._subscribers), since)
+                for job_id, updated_at, data in rows:
+                    self._since = max(self._since, updated_at)
+                    if job_id in self._subscribers and self._last_sent.get(job_id) != data:
+                        self.publish(PredictionResponse.model_validate_json(data), data)
+            except Exception as e:
+                # A locked or unavailable database must not end the feed for everyone
+                logger.warning("Progress feed error: %s", e)
+            await asyncio.sleep(self.poll_interval)
+    
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Shared instance for the API process
+progress_broker = ProgressBroker()
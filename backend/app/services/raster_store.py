@@ -0,0 +1,308 @@
+import os
+import io
+import math
+import uuid
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+try:
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.transform import from_bounds
+    from rasterio.vrt import WarpedVRT
+    from rasterio.warp import transform_bounds
+    from rasterio.windows import Window, from_bounds as window_from_bounds
+    HAS_RASTERIO = True
+except ImportError:
+    HAS_RASTERIO = False
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+RESULTS_DIR = Path(os.getenv("PREDICTION_RESULTS_DIR", "results"))
+# Tiles of a finished prediction never change, so clients and proxies may keep them
+TILE_CACHE_CONTROL = os.getenv("TILE_CACHE_CONTROL", "public, max-age=86400")
+# Total size of rendered tiles kept on disk before least recently used ones are removed
+TILE_CACHE_MAX_BYTES = int(os.getenv("TILE_CACHE_MAX_BYTES", str(512 * 1024 ** 2)))
+# Zoom levels past a raster's native resolution (its TileJSON maxzoom) that are still rendered
+TILE_MAX_OVERZOOM = int(os.getenv("TILE_MAX_OVERZOOM", "3"))
+# Deepest zoom level accepted at all, checked before anything is read
+TILE_ZOOM_LIMIT = 30
+
+TILE_SIZE = 256
+WEB_MERCATOR = "EPSG:3857"
+# Half the width of the web mercator world in metres
+MERCATOR_EXTENT = 20037508.342789244
+
+
+class PredictionRasterStore:
+    """
+    Prediction rasters stored as tiled GeoTIFFs with overviews, served as XYZ tiles.
+    
+    Georeferenced rasters are tiled in web mercator, so tiles line up with
+    standard basemaps. Rasters without a CRS are tiled in pixel space: zoom 0
+    shows the whole raster in one tile and each level doubles the resolution.
+    Rendered tiles are cached next to the raster, up to TILE_CACHE_MAX_BYTES
+    over all predictions, removing the least recently used beyond that.
+    Tiles without data are not cached; they all share one blank PNG.
+    """
+    
+    def __init__(self, results_dir: Path = RESULTS_DIR, max_tile_bytes: int = TILE_CACHE_MAX_BYTES):
+        self.results_dir = results_dir
+        self.max_tile_bytes = max_tile_bytes
+        self._tiles: "OrderedDict[Path, int]" = OrderedDict()
+        self._tile_bytes = 0
+        self._tiles_loaded = False
+        self._blank_tile: Optional[bytes] = None
+        self._lock = threading.Lock()
+    
+    def raster_path(self, prediction_id: str) -> Path:
+        return self.results_dir / prediction_id / "prediction.tif"
+    
+    @staticmethod
+    def tile_url(prediction_id: str) -> str:
+        return f"/api/predictions/{prediction_id}/tiles/{{z}}/{{x}}/{{y}}.png"
+    
+    def save(
+        self,
+        prediction_id: str,
+        prediction: np.ndarray,
+        bounds: Optional[List[float]] = None,
+        crs: Optional[str] = None,
+    ):
+        """
+        Write a prediction array covering `bounds` (left, bottom, right, top in
+        `crs`) as a tiled, compressed GeoTIFF with overviews.
+        """
+        if not HAS_RASTERIO:
+            raise Exception("rasterio is required for storing prediction rasters. Please install it.")
+        data = np.asarray(prediction, dtype=np.float32)
+        if data.ndim > 2:
+            data = data.reshape(data.shape[-2:])
+        height, width = data.shape
+        georeferenced = bool(bounds) and crs not in (None, "", "None")
+        
+        profile = {
+            "driver": "GTiff",
+            "width": width,
+            "height": height,
+            "count": 1,
+            "dtype": "float32",
+            "nodata": np.nan,
+            "tiled": True,
+            "blockxsize": TILE_SIZE,
+            "blockysize": TILE_SIZE,
+            "compress": "deflate",
+        }
+        if georeferenced:
+            profile["crs"] = crs
+            profile["transform"] = from_bounds(*bounds, width, height)
+        
+        path = self.raster_path(prediction_id)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        temp_path = path.with_name(f".{path.name}.part")
+        finite = data[np.isfinite(data)]
+        with rasterio.open(temp_path, "w", **profile) as dst:
+            dst.write(data, 1)
+            # Value range for consistent colouring across tiles
+            if finite.size:
+                dst.update_tags(min=float(finite.min()), max=float(finite.max()))
+            factors = []
+            while max(height, width) // (2 ** (len(factors) + 1)) >= TILE_SIZE // 2:
+                factors.append(2 ** (len(factors) + 1))
+            if factors:
+                dst.build_overviews(factors, Resampling.average)
+                dst.update_tags(ns="rio_overview", resampling="average")
+        os.replace(temp_path, path)
+    
+    def etag(self, prediction_id: str) -> Optional[str]:
+        """Version of a stored raster, or None if it does not exist."""
+        try:
+            stat = self.raster_path(prediction_id).stat()
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    
+    @staticmethod
+    def _max_zoom(src) -> int:
+        """First zoom level at which tile pixels are at least as fine as raster pixels."""
+        if src.crs is not None:
+            with WarpedVRT(src, crs=WEB_MERCATOR) as vrt:
+                resolution = abs(vrt.transform.a)
+            zoom = math.log2(2 * MERCATOR_EXTENT / (TILE_SIZE * resolution))
+        else:
+            zoom = math.log2(max(src.width, src.height) / TILE_SIZE)
+        return max(0, math.ceil(zoom))
+    
+    def cached_tile(self, prediction_id: str, z: int, x: int, y: int) -> Optional[bytes]:
+        """Return a previously rendered tile, or None."""
+        return self._cached_tile(self._tile_path(prediction_id, z, x, y))
+    
+    def keep_tile(self, prediction_id: str, z: int, x: int, y: int, content: Optional[bytes]) -> bytes:
+        """
+        Cache a tile returned by `render_tile` and return its PNG. Tiles
+        without data (None) are not stored; they get the shared blank tile.
+        """
+        if content is None:
+            if self._blank_tile is None:
+                self._blank_tile = self._encode_png(np.full((TILE_SIZE, TILE_SIZE), np.nan), None, None)
+            return self._blank_tile
+        tile_path = self._tile_path(prediction_id, z, x, y)
+        tile_path.parent.mkdir(exist_ok=True, parents=True)
+        # Unique temporary name: the same tile may be rendered concurrently
+        temp_path = tile_path.with_name(f".{tile_path.name}.{uuid.uuid4().hex}.part")
+        temp_path.write_bytes(content)
+        os.replace(temp_path, tile_path)
+        self._add_tile(tile_path, len(content))
+        return content
+    
+    def _tile_path(self, prediction_id: str, z: int, x: int, y: int) -> Path:
+        return self.results_dir / prediction_id / "tiles" / str(z) / str(x) / f"{y}.png"
+    
+    def _load_tile_index(self):
+        """Index rendered tiles on disk, least recently used first (by mtime)."""
+        tiles = []
+        if self.results_dir.exists():
+            for tile_path in self.results_dir.glob("*/tiles/*/*/*.png"):
+                try:
+                    stat = tile_path.stat()
+                except FileNotFoundError:
+                    continue
+                tiles.append((stat.st_mtime, tile_path, stat.st_size))
+        for _, tile_path, size in sorted(tiles):
+            self._tiles[tile_path] = size
+            self._tile_bytes += size
+        self._tiles_loaded = True
+    
+    def _cached_tile(self, tile_path: Path) -> Optional[bytes]:
+        try:
+            content = tile_path.read_bytes()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if not self._tiles_loaded:
+                self._load_tile_index()
+            if tile_path in self._tiles:
+                self._tiles.move_to_end(tile_path)
+        # Bump mtime so recency survives restarts
+        try:
+            os.utime(tile_path)
+        except FileNotFoundError:
+            pass
+        return content
+    
+    def _add_tile(self, tile_path: Path, size: int):
+        with self._lock:
+            if not self._tiles_loaded:
+                self._load_tile_index()
+            self._tile_bytes += size - self._tiles.pop(tile_path, 0)
+            self._tiles[tile_path] = size
+            while self._tile_bytes > self.max_tile_bytes and self._tiles:
+                evicted, evicted_size = self._tiles.popitem(last=False)
+                self._tile_bytes -= evicted_size
+                evicted.unlink(missing_ok=True)
+    
+    @staticmethod
+    def _read_tile(dataset, window: "Window") -> np.ndarray:
+        """Read `window` of a dataset resampled to a TILE_SIZE square, NaN outside the raster."""
+        tile = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32)
+        col0 = max(window.col_off, 0)
+        row0 = max(window.row_off, 0)
+        col1 = min(window.col_off + window.width, dataset.width)
+        row1 = min(window.row_off + window.height, dataset.height)
+        if col1 <= col0 or row1 <= row0:
+            return tile
+        
+        # Placement of the overlapping part within the output tile
+        scale_x = TILE_SIZE / window.width
+        scale_y = TILE_SIZE / window.height
+        left = int(round((col0 - window.col_off) * scale_x))
+        top = int(round((row0 - window.row_off) * scale_y))
+        right = max(int(round((col1 - window.col_off) * scale_x)), left + 1)
+        bottom = max(int(round((row1 - window.row_off) * scale_y)), top + 1)
+        
+        # Reading with a smaller out_shape lets GDAL use the overviews
+        data = dataset.read(
+            1,
+            window=Window(col0, row0, col1 - col0, row1 - row0),
+            out_shape=(bottom - top, right - left),
+            resampling=Resampling.nearest,
+            masked=True,
+        )
+        tile[top:bottom, left:right] = np.ma.filled(data.astype(np.float32), np.nan)
+        return tile
+    
+    @staticmethod
+    def _encode_png(values: np.ndarray, low: Optional[float], high: Optional[float]) -> bytes:
+        """Grayscale PNG scaled to the raster's value range, transparent where there is no data."""
+        if not HAS_PIL:
+            raise Exception("pillow is required for rendering prediction tiles. Please install it.")
+        finite = np.isfinite(values)
+        gray = np.zeros(values.shape, dtype=np.uint8)
+        if finite.any() and low is not None and high is not None:
+            scale = 255.0 / (high - low) if high > low else 0.0
+            gray[finite] = np.clip(np.round((values[finite] - low) * scale), 0, 255).astype(np.uint8)
+        alpha = np.where(finite, 255, 0).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(np.dstack([gray, alpha]), mode="LA").save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+# Shared instance; rasters are written by prediction workers and served by the API
+raster_store = PredictionRasterStore()
+
+
+# Reading and rendering take a raster path rather than the store, so they can
+# run on a process decode pool (the store holds a lock and cannot be pickled)
+def raster_info(path: str) -> Optional[Dict[str, Any]]:
+    """Return zoom range, WGS84 bounds (if georeferenced) and value range of a raster."""
+    if not os.path.exists(path):
+        return None
+    with rasterio.open(path) as src:
+        tags = src.tags()
+        info: Dict[str, Any] = {
+            "minzoom": 0,
+            "min": float(tags["min"]) if "min" in tags else None,
+            "max": float(tags["max"]) if "max" in tags else None,
+            "georeferenced": src.crs is not None,
+        }
+        if src.crs is not None:
+            info["bounds"] = list(transform_bounds(src.crs, "EPSG:4326", *src.bounds))
+        info["maxzoom"] = PredictionRasterStore._max_zoom(src)
+    return info
+
+
+def render_tile(path: str, z: int, x: int, y: int) -> Optional[bytes]:
+    """
+    Render tile (z, x, y) of a raster as PNG bytes; None if the tile has no
+    data. Raises FileNotFoundError for a missing raster and ValueError for
+    zoom levels more than TILE_MAX_OVERZOOM past the raster's maxzoom.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    with rasterio.open(path) as src:
+        max_zoom = PredictionRasterStore._max_zoom(src) + TILE_MAX_OVERZOOM
+        if z > max_zoom:
+            raise ValueError(f"Zoom level {z} is beyond the maximum of {max_zoom} for this map")
+        tags = src.tags()
+        if src.crs is not None:
+            with WarpedVRT(src, crs=WEB_MERCATOR, resampling=Resampling.nearest) as vrt:
+                span = 2 * MERCATOR_EXTENT / (2 ** z)
+                left = -MERCATOR_EXTENT + x * span
+                top = MERCATOR_EXTENT - y * span
+                window = window_from_bounds(left, top - span, left + span, top, vrt.transform)
+                values = PredictionRasterStore._read_tile(vrt, window)
+        else:
+            span = max(src.width, src.height) / (2 ** z)
+            values = PredictionRasterStore._read_tile(src, Window(x * span, y * span, span, span))
+    
+    if not np.isfinite(values).any():
+        # Outside the raster or all nodata: not worth a file per tile
+        return None
+    low = float(tags["min"]) if "min" in tags else None
+    high = float(tags["max"]) if "max" in tags else None
+    return PredictionRasterStore._encode_png(values, low, high)
@@ -0,0 +1,435 @@
+import os
+import uuid
+import math
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional
+import numpy as np
+try:
+    from rasterio.crs import CRS
+    from rasterio.warp import transform as transform_points
+    HAS_RASTERIO = True
+except ImportError:
+    HAS_RASTERIO = False
+
+logger = logging.getLogger(__name__)
+
+# Grid that model inputs are resampled onto: "urban" (the urban raster's grid),
+# "model" (a grid over the urban extent with MODEL_GRID_RESOLUTION) or "none"
+INPUT_ALIGNMENT = os.getenv("INPUT_ALIGNMENT", "urban")
+# Cell size of the model grid, in units of the urban raster's CRS
+MODEL_GRID_RESOLUTION = float(os.getenv("MODEL_GRID_RESOLUTION", "0") or 0)
+# "bilinear" or "nearest"
+REGRID_METHOD = os.getenv("REGRID_METHOD", "bilinear")
+REGRID_CACHE_DIR = Path(os.getenv("REGRID_CACHE_DIR", "cache/regrid"))
+REGRID_CACHE_MAX_BYTES = int(os.getenv("REGRID_CACHE_MAX_BYTES", str(1024 ** 3)))
+# Bytes of index maps kept in memory between predictions
+REGRID_MEMORY_CACHE_BYTES = int(os.getenv("REGRID_MEMORY_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+# Target pixels transformed to the source CRS at once when building dense maps
+_TRANSFORM_CHUNK = 1 << 20
+# Target rows and columns sampled to decide whether a reprojection is separable
+_SEPARABLE_SAMPLES = 16
+# Largest spread, in source cells, of a source coordinate along the other target axis
+_SEPARABLE_TOLERANCE = 1e-3
+
+
+class Grid(NamedTuple):
+    """A rectilinear grid: cell-center coordinates of its columns and rows, in `crs`."""
+    crs: str
+    x: np.ndarray
+    y: np.ndarray
+    
+    @classmethod
+    def from_transform(cls, transform, shape, crs: str) -> "Grid":
+        """Grid of a north-up raster from its affine transform (a, b, c, d, e, f)."""
+        a, b, c, d, e, f = transform[:6]
+        if b != 0 or d != 0:
+            raise ValueError("Rotated rasters cannot be aligned")
+        height, width = shape[-2:]
+        return cls(
+            crs,
+            c + a * (np.arange(width) + 0.5),
+            f + e * (np.arange(height) + 0.5),
+        )
+    
+    @classmethod
+    def from_coordinates(cls, lon, lat, crs: str) -> "Grid":
+        return cls(crs, np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+    
+    @property
+    def shape(self):
+        return (len(self.y), len(self.x))
+    
+    def digest(self) -> str:
+        h = hashlib.sha256(str(self.crs).encode("utf-8"))
+        h.update(np.ascontiguousarray(self.x, dtype=np.float64).data)
+        h.update(b"|")
+        h.update(np.ascontiguousarray(self.y, dtype=np.float64).data)
+        return h.hexdigest()
+
+
+class IndexMap(NamedTuple):
+    """
+    Source cell indices and interpolation weights for each target pixel.
+    
+    `rows` and `cols` hold the lower of the two neighbouring source rows and
+    columns and `wy`/`wx` the weight of the upper one. They are (H, 1) and
+    (1, W) arrays when source rows depend only on target rows and source
+    columns only on target columns (the grids share a CRS, or e.g. a
+    geographic grid is reprojected to Web Mercator), and (H, W) otherwise.
+    Weights are NaN for target pixels outside the source.
+    """
+    rows: np.ndarray
+    cols: np.ndarray
+    wy: np.ndarray
+    wx: np.ndarray
+    source_shape: tuple
+    
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.rows, self.cols, self.wy, self.wx))
+    
+    def apply(self, data: np.ndarray) -> np.ndarray:
+        """
+        Resample source data (..., rows, cols) onto the target grid. NaN source
+        cells are left out and the other weights renormalized.
+        """
+        data = np.asarray(data, dtype=np.float32)
+        if data.shape[-2:] != tuple(self.source_shape):
+            raise ValueError(f"Data of shape {data.shape} does not match the source grid {self.source_shape}")
+        last_row, last_col = self.source_shape[0] - 1, self.source_shape[1] - 1
+        rows1 = np.minimum(self.rows + 1, last_row)
+        cols1 = np.minimum(self.cols + 1, last_col)
+        if self.rows.shape[-1] == 1 and self.cols.shape[0] == 1:
+            return self._apply_separable(data, rows1, cols1)
+        total = np.zeros(np.broadcast_shapes(self.wy.shape, self.wx.shape), dtype=np.float32)
+        weights = np.zeros_like(total)
+        for rows, wy in ((self.rows, 1 - self.wy), (rows1, self.wy)):
+            for cols, wx in ((self.cols, 1 - self.wx), (cols1, self.wx)):
+                values = data[..., rows, cols]
+                weight = wy * wx
+                finite = np.isfinite(values)
+                total = total + np.where(finite, values, 0) * weight
+                weights = weights + np.where(finite, weight, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(weights > 0, total / weights, np.nan).astype(np.float32)
+    
+    def _apply_separable(self, data: np.ndarray, rows1: np.ndarray, cols1: np.ndarray) -> np.ndarray:
+        """
+        Interpolate along x for every source row first, then gather rows.
+        
+        The x pass only touches (source rows, W) values, so the full-size
+        target is built by two gathers instead of four.
+        """
+        total_x = np.zeros(data.shape[:-1] + (self.cols.shape[-1],), dtype=np.float32)
+        weights_x = np.zeros_like(total_x)
+        for cols, wx in ((self.cols[0], 1 - self.wx[0]), (cols1[0], self.wx[0])):
+            values = data[..., cols]
+            finite = np.isfinite(values)
+            total_x += np.where(finite, values, 0) * wx.astype(np.float32)
+            weights_x += finite * wx.astype(np.float32)
+        rows, upper = self.rows[:, 0], rows1[:, 0]
+        wy = self.wy.astype(np.float32)
+        total = total_x[..., rows, :] * (1 - wy) + total_x[..., upper, :] * wy
+        weights = weights_x[..., rows, :] * (1 - wy) + weights_x[..., upper, :] * wy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            total /= weights
+        total[~(weights > 0)] = np.nan
+        return total
+
+
+def _positions(source: np.ndarray, target: np.ndarray, periodic: bool = False):
+    """
+    Fractional positions of target coordinates along monotonic source cell
+    centers, as (lower index, weight of the upper one). Targets beyond the
+    outer cell edges get a NaN weight.
+    """
+    if periodic and source.size and float(source.max()) > 180:
+        target = np.mod(target, 360.0)
+    n = source.size
+    descending = n > 1 and source[0] > source[-1]
+    ordered = source[::-1] if descending else source
+    half_first = (ordered[1] - ordered[0]) / 2 if n > 1 else 0.5
+    half_last = (ordered[-1] - ordered[-2]) / 2 if n > 1 else 0.5
+    
+    position = np.interp(target, ordered, np.arange(n, dtype=np.float64))
+    if descending:
+        position = (n - 1) - position
+    lower = np.clip(np.floor(position), 0, max(n - 2, 0)).astype(np.int32)
+    weight = np.clip(position - lower, 0.0, 1.0).astype(np.float32)
+    outside = (target < ordered[0] - half_first) | (target > ordered[-1] + half_last) | ~np.isfinite(target)
+    weight[outside] = np.nan
+    return lower, weight
+
+
+def _same_crs(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    try:
+        return CRS.from_user_input(a) == CRS.from_user_input(b)
+    except Exception:
+        return False
+
+
+def _sample(values: np.ndarray) -> np.ndarray:
+    return values[np.unique(np.linspace(0, len(values) - 1, _SEPARABLE_SAMPLES).astype(int))]
+
+
+def _constant_along(values: np.ndarray, axis: int, cells: np.ndarray) -> bool:
+    """Whether `values` vary by less than the tolerance, in source cells, along `axis`."""
+    if not np.isfinite(values).all():
+        return False
+    step = float(np.abs(np.diff(cells)).min()) if cells.size > 1 else 1.0
+    spread = values.max(axis=axis) - values.min(axis=axis)
+    return bool((spread <= _SEPARABLE_TOLERANCE * step).all())
+
+
+def _separable_coordinates(source: Grid, target: Grid):
+    """
+    Source x of every target column and source y of every target row, if a
+    sample of target pixels shows that each depends on that axis alone;
+    None otherwise.
+    """
+    xs, ys = _sample(target.x), _sample(target.y)
+    xx, yy = np.meshgrid(xs, ys)
+    sx, sy = transform_points(target.crs, source.crs, xx.ravel(), yy.ravel())
+    sx, sy = np.asarray(sx).reshape(xx.shape), np.asarray(sy).reshape(xx.shape)
+    if not (_constant_along(sx, 0, source.x) and _constant_along(sy, 1, source.y)):
+        return None
+    middle_x = np.full(len(target.y), target.x[len(target.x) // 2])
+    middle_y = np.full(len(target.x), target.y[len(target.y) // 2])
+    source_x, _ = transform_points(target.crs, source.crs, target.x, middle_y)
+    _, source_y = transform_points(target.crs, source.crs, middle_x, target.y)
+    return np.asarray(source_x), np.asarray(source_y)
+
+
+def build_index_map(source: Grid, target: Grid, method: str = REGRID_METHOD) -> IndexMap:
+    """Compute the index map from `source` onto `target` (see IndexMap)."""
+    if method not in ("bilinear", "nearest"):
+        raise ValueError(f"Unsupported regridding method: {method}")
+    periodic = _is_geographic(source.crs)
+    height, width = target.shape
+    separable = None
+    if _same_crs(source.crs, target.crs):
+        separable = target.x, target.y
+    elif not HAS_RASTERIO:
+        raise Exception("rasterio is required for reprojecting grids. Please install it.")
+    else:
+        separable = _separable_coordinates(source, target)
+    if separable is not None:
+        cols, wx = _positions(source.x, separable[0], periodic)
+        rows, wy = _positions(source.y, separable[1])
+        rows, wy = rows[:, None], wy[:, None]
+        cols, wx = cols[None, :], wx[None, :]
+    else:
+        rows = np.empty((height, width), dtype=np.int32)
+        cols = np.empty((height, width), dtype=np.int32)
+        wy = np.empty((height, width), dtype=np.float32)
+        wx = np.empty((height, width), dtype=np.float32)
+        step = max(1, _TRANSFORM_CHUNK // max(width, 1))
+        for row in range(0, height, step):
+            ys = target.y[row:row + step]
+            xx, yy = np.meshgrid(target.x, ys)
+            sx, sy = transform_points(target.crs, source.crs, xx.ravel(), yy.ravel())
+            shape = (len(ys), width)
+            c, w = _positions(source.x, np.asarray(sx), periodic)
+            cols[row:row + step], wx[row:row + step] = c.reshape(shape), w.reshape(shape)
+            r, w = _positions(source.y, np.asarray(sy))
+            rows[row:row + step], wy[row:row + step] = r.reshape(shape), w.reshape(shape)
+    if method == "nearest":
+        wy, wx = np.round(wy), np.round(wx)
+    return IndexMap(rows, cols, wy, wx, source.shape)
+
+
+def _is_geographic(crs: str) -> bool:
+    if not HAS_RASTERIO:
+        return str(crs).upper() in ("EPSG:4326", "OGC:CRS84")
+    try:
+        return CRS.from_user_input(crs).is_geographic
+    except Exception:
+        return False
+
+
+class Regridder:
+    """
+    Index maps between grid pairs, built once and reused.
+    
+    Maps are keyed by a hash of both grids and the method, kept in an
+    in-memory LRU of at most `memory_bytes` and stored on disk, so resampling a grid pair seen before
+    (e.g. the same climate file onto the same urban region) is only the
+    gathers in IndexMap.apply. Least recently used files are removed once the
+    directory exceeds `max_bytes`.
+    """
+    
+    def __init__(
+        self,
+        directory: Path = REGRID_CACHE_DIR,
+        max_bytes: int = REGRID_CACHE_MAX_BYTES,
+        memory_bytes: int = REGRID_MEMORY_CACHE_BYTES,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.memory_used = 0
+        self.hits = 0
+        self.misses = 0
+        self._maps: "OrderedDict[str, IndexMap]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(source: Grid, target: Grid, method: str) -> str:
+        return hashlib.sha256(f"{source.digest()}:{target.digest()}:{method}".encode("utf-8")).hexdigest()
+    
+    def index_map(self, source: Grid, target: Grid, method: str = REGRID_METHOD) -> IndexMap:
+        key = self.key(source, target, method)
+        with self._lock:
+            if key in self._maps:
+                self._maps.move_to_end(key)
+                self.hits += 1
+                return self._maps[key]
+        index_map = self._load(key)
+        if index_map is None:
+            with self._lock:
+                self.misses += 1
+            index_map = build_index_map(source, target, method)
+            try:
+                self._store(key, index_map)
+            except OSError as e:
+                logger.warning("Could not store regridding index map: %s", e)
+        else:
+            with self._lock:
+                self.hits += 1
+        with self._lock:
+            if key not in self._maps:
+                self._maps[key] = index_map
+                self.memory_used += index_map.nbytes
+            # Maps larger than the whole budget are not kept
+            while self._maps and self.memory_used > self.memory_bytes:
+                _, evicted = self._maps.popitem(last=False)
+                self.memory_used -= evicted.nbytes
+        return index_map
+    
+    def regrid(self, data: np.ndarray, source: Grid, target: Grid, method: str = REGRID_METHOD) -> np.ndarray:
+        return self.index_map(source, target, method).apply(data)
+    
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.npz"
+    
+    def _load(self, key: str) -> Optional[IndexMap]:
+        path = self._path(key)
+        try:
+            with np.load(path) as stored:
+                index_map = IndexMap(
+                    stored["rows"], stored["cols"], stored["wy"], stored["wx"],
+                    tuple(int(n) for n in stored["source_shape"]),
+                )
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return index_map
+    
+    def _store(self, key: str, index_map: IndexMap):
+        self.directory.mkdir(exist_ok=True, parents=True)
+        path = self._path(key)
+        temp_path = path.with_name(f".{key}.{uuid.uuid4().hex}.npz")
+        np.savez(
+            temp_path,
+            rows=index_map.rows, cols=index_map.cols, wy=index_map.wy, wx=index_map.wx,
+            source_shape=np.array(index_map.source_shape),
+        )
+        os.replace(temp_path, path)
+        self._prune()
+    
+    def _prune(self):
+        entries = []
+        for path in self.directory.glob("*.npz"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+# Shared instance used by DataProcessor.prepare_model_input
+regridder = Regridder()
+
+
+def _source_grid(entry: Dict[str, Any]) -> Optional[Grid]:
+    """Grid of a processed input: coordinates for NetCDF inputs, a transform for rasters."""
+    if entry.get('lon') is not None and entry.get('lat') is not None:
+        return Grid.from_coordinates(entry['lon'], entry['lat'], entry.get('crs'))
+    if entry.get('transform') and entry.get('crs') not in (None, "", "None"):
+        return Grid.from_transform(entry['transform'], np.shape(entry['data']), entry['crs'])
+    return None
+
+
+def model_grid(urban_data: Dict[str, Any], resolution: float = MODEL_GRID_RESOLUTION):
+    """Transform and shape of a grid with `resolution` cells covering the urban raster."""
+    if resolution <= 0:
+        raise ValueError("MODEL_GRID_RESOLUTION must be set for the model grid alignment")
+    left, bottom, right, top = urban_data['bounds'][:4]
+    width = max(1, math.ceil((right - left) / resolution - 1e-9))
+    height = max(1, math.ceil((top - bottom) / resolution - 1e-9))
+    return [resolution, 0.0, left, 0.0, -resolution, top], (height, width)
+
+
+def align_model_input(
+    model_input: Dict[str, Any],
+    mode: str = INPUT_ALIGNMENT,
+    method: str = REGRID_METHOD,
+    regridder: Regridder = regridder,
+) -> Dict[str, Any]:
+    """
+    Resample model inputs onto one grid, so every array covers the same pixels.
+    
+    With "urban", climate and yield grids are resampled onto the urban
+    raster's grid; with "model", all inputs (urban included) onto a grid over
+    the urban extent with MODEL_GRID_RESOLUTION cells. Inputs without a
+    known grid are passed through unchanged.
+    """
+    if mode == "none":
+        return model_input
+    if mode not in ("urban", "model"):
+        raise ValueError(f"Unsupported input alignment: {mode}")
+    urban = model_input['urban_expansion']
+    if not urban.get('transform') or urban.get('crs') in (None, "", "None"):
+        logger.warning("Urban raster is not georeferenced; model inputs are not aligned")
+        return model_input
+    
+    if mode == "model":
+        transform, shape = model_grid(urban)
+    else:
+        transform, shape = list(urban['transform'][:6]), np.shape(urban['data'])[-2:]
+    target = Grid.from_transform(transform, shape, urban['crs'])
+    height, width = target.shape
+    left, top = transform[2], transform[5]
+    bounds = [left, top + transform[4] * height, left + transform[0] * width, top]
+    
+    aligned = dict(model_input)
+    for name, entry in model_input.items():
+        if not entry or (name == 'urban_expansion' and mode == "urban"):
+            continue
+        source = _source_grid(entry)
+        if source is None:
+            continue
+        data = regridder.regrid(entry['data'], source, target, method)
+        resampled = {k: v for k, v in entry.items() if k not in ('lat', 'lon')}
+        resampled.update(
+            data=data, shape=data.shape, transform=list(transform),
+            crs=urban['crs'], bounds=bounds,
+        )
+        aligned[name] = resampled
+    return aligned
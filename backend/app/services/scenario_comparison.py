@@ -0,0 +1,261 @@
+import os
+import math
+from contextlib import ExitStack
+from typing import Any, Dict, Optional, Sequence
+import numpy as np
+try:
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.vrt import WarpedVRT
+    from rasterio.warp import transform as warp_transform
+    from rasterio.windows import Window
+    HAS_RASTERIO = True
+except ImportError:
+    HAS_RASTERIO = False
+from app.utils.array_codec import to_png_data_url
+
+# Bytes for the blocks of all compared rasters held at once; larger rasters are
+# processed block by block so memory use does not grow with their size
+COMPARISON_MEMORY_BUDGET = int(os.getenv("COMPARISON_MEMORY_BUDGET", str(256 * 1024 * 1024)))
+# Histogram bins between the smallest and largest difference, for percentiles
+COMPARISON_HISTOGRAM_BINS = int(os.getenv("COMPARISON_HISTOGRAM_BINS", "4096"))
+DEFAULT_PERCENTILES = (5.0, 25.0, 50.0, 75.0, 95.0)
+
+# Block sides are multiples of the tile size of stored rasters
+_BLOCK_ALIGN = 256
+_EARTH_RADIUS_KM = 6371.0088
+
+
+def block_size(rasters: int, budget: int = COMPARISON_MEMORY_BUDGET) -> int:
+    """Side of square blocks such that one block of each raster, plus scratch arrays, fits in `budget`."""
+    # float64 values and a validity mask per raster, plus a few float64 scratch arrays
+    per_pixel = rasters * 9 + 4 * 8
+    side = int(math.sqrt(budget / per_pixel)) // _BLOCK_ALIGN * _BLOCK_ALIGN
+    return max(side, _BLOCK_ALIGN)
+
+
+def _band_areas_km2(edges: np.ndarray, width: float) -> np.ndarray:
+    """Exact area of latitude bands between `edges` (degrees), `width` degrees wide."""
+    edges = np.radians(edges)
+    return _EARTH_RADIUS_KM ** 2 * np.radians(abs(width)) * np.abs(np.diff(np.sin(edges)))
+
+
+def _row_areas_km2(dataset, row_off: int, height: int) -> Optional[np.ndarray]:
+    """Area of one pixel in each row of a window, or None without a CRS."""
+    crs = dataset.crs
+    transform = dataset.transform
+    if crs is None:
+        return None
+    edges = transform.f + transform.e * np.arange(row_off, row_off + height + 1)
+    if crs.is_geographic:
+        return _band_areas_km2(edges, transform.a)
+    if crs.to_dict().get("proj") == "merc":
+        # Mercator rows are latitude bands whose planar area grows with
+        # 1/cos²(lat); measure them in geographic coordinates instead
+        lons, lats = warp_transform(
+            crs, "EPSG:4326",
+            [transform.c, transform.c + transform.a] + [transform.c] * edges.size,
+            [edges[0], edges[0]] + list(edges),
+        )
+        return _band_areas_km2(np.array(lats[2:]), lons[1] - lons[0])
+    metres = crs.linear_units_factor[1]
+    return np.full(height, abs(transform.a * transform.e) * metres ** 2 / 1e6)
+
+
+class _DeltaSummary:
+    """Streaming summary of one difference raster, updated block by block."""
+    
+    def __init__(self, threshold: float, out_shape: Optional[tuple], factor: int):
+        self.threshold = threshold
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.base_sum = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.above = 0
+        self.above_area: Optional[float] = 0.0
+        self.histogram: Optional[np.ndarray] = None
+        self.factor = factor
+        self.sums = np.zeros(out_shape) if out_shape else None
+        self.counts = np.zeros(out_shape, dtype=np.int64) if out_shape else None
+    
+    def add(self, base: np.ndarray, delta: np.ndarray, valid: np.ndarray, row_areas: Optional[np.ndarray], row: int, col: int):
+        values = delta[valid]
+        if values.size:
+            self.base_sum += float(base[valid].sum())
+            # Chan et al. pairwise update of mean and squared deviations
+            block_mean = float(values.mean())
+            block_m2 = float(((values - block_mean) ** 2).sum())
+            total = self.count + values.size
+            shift = block_mean - self.mean
+            self.mean += shift * values.size / total
+            self.m2 += block_m2 + shift ** 2 * self.count * values.size / total
+            self.count = total
+            self.minimum = min(self.minimum, float(values.min()))
+            self.maximum = max(self.maximum, float(values.max()))
+            above = valid & (np.abs(delta) > self.threshold)
+            self.above += int(above.sum())
+            if row_areas is None:
+                self.above_area = None
+            elif self.above_area is not None:
+                self.above_area += float(above.sum(axis=1) @ row_areas)
+        if self.sums is not None:
+            self._downsample(delta, valid, row, col)
+    
+    def _downsample(self, delta: np.ndarray, valid: np.ndarray, row: int, col: int):
+        # Blocks start on multiples of the factor, so each output pixel is
+        # covered by one block; pad the last row and column of blocks
+        f = self.factor
+        height = -(-delta.shape[0] // f) * f
+        width = -(-delta.shape[1] // f) * f
+        padded = np.zeros((height, width))
+        mask = np.zeros((height, width), dtype=bool)
+        padded[:delta.shape[0], :delta.shape[1]] = np.where(valid, delta, 0.0)
+        mask[:delta.shape[0], :delta.shape[1]] = valid
+        sums = padded.reshape(height // f, f, width // f, f).sum(axis=(1, 3))
+        counts = mask.reshape(height // f, f, width // f, f).sum(axis=(1, 3))
+        r, c = row // f, col // f
+        rows = min(sums.shape[0], self.sums.shape[0] - r)
+        cols = min(sums.shape[1], self.sums.shape[1] - c)
+        self.sums[r:r + rows, c:c + cols] += sums[:rows, :cols]
+        self.counts[r:r + rows, c:c + cols] += counts[:rows, :cols]
+    
+    def add_histogram(self, delta: np.ndarray, valid: np.ndarray, bins: int):
+        if self.count == 0:
+            return
+        counts, _ = np.histogram(delta[valid], bins=bins, range=(self.minimum, self.maximum))
+        self.histogram = counts if self.histogram is None else self.histogram + counts
+    
+    def percentile(self, q: float) -> Optional[float]:
+        """Percentile interpolated within its histogram bin."""
+        if self.count == 0:
+            return None
+        if self.histogram is None or self.maximum == self.minimum:
+            return self.minimum
+        cumulative = np.cumsum(self.histogram)
+        target = q / 100.0 * self.count
+        index = min(int(np.searchsorted(cumulative, target)), len(cumulative) - 1)
+        before = cumulative[index - 1] if index else 0
+        width = (self.maximum - self.minimum) / len(self.histogram)
+        within = (target - before) / self.histogram[index] if self.histogram[index] else 0.0
+        return float(self.minimum + (index + min(max(within, 0.0), 1.0)) * width)
+    
+    def result(self, percentiles: Sequence[float]) -> Dict[str, Any]:
+        summary: Dict[str, Any] = {
+            "validPixels": self.count,
+            "baselineMean": self.base_sum / self.count if self.count else None,
+            "meanDelta": self.mean if self.count else None,
+            "stdDelta": math.sqrt(self.m2 / self.count) if self.count else None,
+            "minDelta": self.minimum if self.count else None,
+            "maxDelta": self.maximum if self.count else None,
+            "percentiles": {f"p{q:g}": self.percentile(q) for q in percentiles},
+            "threshold": self.threshold,
+            "pixelsAboveThreshold": self.above,
+            "areaAboveThresholdKm2": self.above_area,
+        }
+        if self.sums is not None:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                raster = np.where(self.counts > 0, self.sums / self.counts, np.nan)
+            finite = raster[np.isfinite(raster)]
+            summary["differenceRaster"] = {
+                "image": to_png_data_url(raster),
+                "width": int(raster.shape[1]),
+                "height": int(raster.shape[0]),
+                "factor": self.factor,
+                "min": float(finite.min()) if finite.size else None,
+                "max": float(finite.max()) if finite.size else None,
+            }
+        return summary
+
+
+def _aligned(stack: ExitStack, path: str, reference) -> Any:
+    """Open a raster resampled onto the reference grid (nearest neighbour, NaN outside it)."""
+    src = stack.enter_context(rasterio.open(path))
+    if (src.crs, src.transform, src.shape) == (reference.crs, reference.transform, reference.shape):
+        return src
+    if src.crs is None or reference.crs is None:
+        raise ValueError("Raster is not georeferenced and does not match the baseline grid")
+    return stack.enter_context(WarpedVRT(
+        src,
+        crs=reference.crs,
+        transform=reference.transform,
+        width=reference.width,
+        height=reference.height,
+        resampling=Resampling.nearest,
+        nodata=np.nan,
+        dtype="float32",
+    ))
+
+
+def _read(dataset, window: "Window", binarize: bool):
+    data = dataset.read(1, window=window, masked=True)
+    values = np.ma.getdata(data).astype(np.float64)
+    valid = ~np.ma.getmaskarray(data) & np.isfinite(values)
+    if binarize:
+        values = (values > 0).astype(np.float64)
+    return values, valid
+
+
+def compare_rasters(
+    baseline_path: str,
+    other_paths: Dict[str, str],
+    threshold: float = 0.0,
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+    raster_size: Optional[int] = None,
+    binarize: bool = False,
+    budget: int = COMPARISON_MEMORY_BUDGET,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Summarize the per-pixel differences (other - baseline) of several rasters
+    from a baseline, keyed like `other_paths`.
+    
+    Rasters are read on the baseline's grid in aligned square blocks sized
+    to fit `budget`, so memory use is independent of raster size. A first
+    pass accumulates count, mean, spread, extremes, the pixels (and area)
+    whose difference exceeds `threshold` in absolute value, and optionally a
+    difference raster block-averaged to at most `raster_size` pixels per
+    side. If percentiles are requested, a second pass bins the differences
+    into a histogram over the observed range. With `binarize`, values are
+    reduced to above zero or not first (e.g. urban or not).
+    """
+    if not HAS_RASTERIO:
+        raise Exception("rasterio is required for comparing scenarios. Please install it.")
+    if any(q < 0 or q > 100 for q in percentiles):
+        raise ValueError("Percentiles must be between 0 and 100")
+    
+    with ExitStack() as stack:
+        baseline = stack.enter_context(rasterio.open(baseline_path))
+        others = {key: _aligned(stack, path, baseline) for key, path in other_paths.items()}
+        height, width = baseline.shape
+        
+        factor = 1
+        out_shape = None
+        if raster_size:
+            factor = max(1, -(-max(height, width) // raster_size))
+            out_shape = (-(-height // factor), -(-width // factor))
+        side = block_size(len(others) + 1, budget)
+        side = max(side // factor, 1) * factor
+        windows = [
+            Window(col, row, min(side, width - col), min(side, height - row))
+            for row in range(0, height, side)
+            for col in range(0, width, side)
+        ]
+        
+        summaries = {key: _DeltaSummary(threshold, out_shape, factor) for key in others}
+        for window in windows:
+            base, base_valid = _read(baseline, window, binarize)
+            row_areas = _row_areas_km2(baseline, int(window.row_off), int(window.height))
+            for key, dataset in others.items():
+                values, valid = _read(dataset, window, binarize)
+                valid &= base_valid
+                summaries[key].add(base, values - base, valid, row_areas, int(window.row_off), int(window.col_off))
+        
+        if percentiles:
+            for window in windows:
+                base, base_valid = _read(baseline, window, binarize)
+                for key, dataset in others.items():
+                    values, valid = _read(dataset, window, binarize)
+                    summaries[key].add_histogram(values - base, valid & base_valid, COMPARISON_HISTOGRAM_BINS)
+    
+    return {key: summary.result(percentiles) for key, summary in summaries.items()}
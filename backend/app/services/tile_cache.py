@@ -0,0 +1,123 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+import numpy as np
+from app.services.raster_store import RESULTS_DIR
+
+TILE_RESULT_CACHE_DIR = Path(os.getenv("TILE_RESULT_CACHE_DIR", str(RESULTS_DIR / "tile-cache")))
+TILE_RESULT_CACHE_MAX_BYTES = int(os.getenv("TILE_RESULT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Part of every cache key; change it when the model changes so old tile results are not reused
+URBAN_MODEL_VERSION = os.getenv("URBAN_MODEL_VERSION", "1")
+
+# Scalar fields of a tile's model output kept alongside its prediction array
+_OUTPUT_FIELDS = ('mae', 'rmse', 'mse', 'accuracy', 'confidence', 'metrics')
+
+
+class TileResultCache:
+    """
+    Model outputs of prediction tiles, stored on disk by a hash of the tile input.
+    
+    A tile whose input arrays and georeferencing are unchanged from an earlier
+    prediction (e.g. everywhere a policy edit does not reach) hashes to the
+    same key, so its output is read back instead of calling the model. Least
+    recently used entries are removed once the cache exceeds `max_bytes`.
+    """
+    
+    def __init__(
+        self,
+        directory: Path = TILE_RESULT_CACHE_DIR,
+        max_bytes: int = TILE_RESULT_CACHE_MAX_BYTES,
+        namespace: str = URBAN_MODEL_VERSION,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self._bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def key(self, tile_input: Dict[str, Any]) -> str:
+        """Hash of a tile's model input: every array's bytes plus the other entry fields."""
+        digest = hashlib.sha256(self.namespace.encode("utf-8"))
+        for name in sorted(tile_input):
+            entry = tile_input[name]
+            digest.update(name.encode("utf-8"))
+            fields = entry if isinstance(entry, dict) else {"": entry}
+            for field in sorted(fields):
+                value = fields[field]
+                digest.update(field.encode("utf-8"))
+                if isinstance(value, np.ndarray):
+                    digest.update(f"{value.dtype.str}{value.shape}".encode("utf-8"))
+                    digest.update(np.ascontiguousarray(value).data)
+                else:
+                    digest.update(json.dumps(value, sort_keys=True, default=str).encode("utf-8"))
+        return digest.hexdigest()
+    
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.npz"
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with np.load(path) as stored:
+                output = json.loads(str(stored["meta"]))
+                output["prediction"] = stored["prediction"]
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return output
+    
+    def put(self, key: str, output: Dict[str, Any]):
+        """Store a tile output; outputs without a prediction array are not cached."""
+        if output.get("prediction") is None:
+            return
+        meta = {field: output[field] for field in _OUTPUT_FIELDS if output.get(field) is not None}
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        temp_path = path.with_name(f".{path.stem}.{uuid.uuid4().hex}.npz")
+        np.savez(temp_path, prediction=np.asarray(output["prediction"]), meta=np.array(json.dumps(meta)))
+        size = temp_path.stat().st_size
+        os.replace(temp_path, path)
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_size()
+            else:
+                self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._prune()
+    
+    def _scan_size(self) -> int:
+        return sum(path.stat().st_size for path in self.directory.glob("*/*.npz"))
+    
+    def _prune(self):
+        """Remove least recently used entries until the cache is below 90% of its limit."""
+        entries = []
+        for path in self.directory.glob("*/*.npz"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        self._bytes = total
+
+
+# Shared instance; used by prediction workers for tiled predictions
+tile_result_cache = TileResultCache()
@@ -0,0 +1,203 @@
+import os
+import math
+import asyncio
+import numpy as np
+from typing import Dict, Any, Optional, Awaitable, Callable, List
+from fastapi import HTTPException
+from app.services.data_processor import DataProcessor
+from app.services.ml_service import MLService
+from app.services.tile_cache import TileResultCache
+from app.services.metrics import StageTimings, timed
+
+# Inputs with more urban pixels than this are predicted tile by tile
+TILED_INFERENCE_MIN_PIXELS = int(os.getenv("TILED_INFERENCE_MIN_PIXELS", str(4096 * 4096)))
+TILED_INFERENCE_TILE_SIZE = int(os.getenv("TILED_INFERENCE_TILE_SIZE", "1024"))
+TILED_INFERENCE_OVERLAP = int(os.getenv("TILED_INFERENCE_OVERLAP", "32"))
+TILED_INFERENCE_CONCURRENCY = int(os.getenv("TILED_INFERENCE_CONCURRENCY", "4"))
+TILED_INFERENCE_RETRIES = int(os.getenv("TILED_INFERENCE_RETRIES", "2"))
+
+
+class TiledPredictor:
+    """
+    Run a prediction as many smaller model calls and stitch the results.
+    
+    The urban grid is split into tiles (with `overlap` pixels of context on
+    each side); every other input array is sliced over the same fractional
+    extent, so inputs at coarser resolutions are cut consistently. Each tile
+    response must contain a `prediction` array covering its overlapping
+    window; the overlap is cropped away before the tiles are stitched.
+    
+    With a `cache`, tiles whose input was predicted before are read from it
+    and only the others are sent to the model.
+    """
+    
+    def __init__(
+        self,
+        ml_service: MLService,
+        tile_size: int = TILED_INFERENCE_TILE_SIZE,
+        overlap: int = TILED_INFERENCE_OVERLAP,
+        concurrency: int = TILED_INFERENCE_CONCURRENCY,
+        retries: int = TILED_INFERENCE_RETRIES,
+        cache: Optional[TileResultCache] = None,
+    ):
+        self.ml_service = ml_service
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.concurrency = concurrency
+        self.retries = retries
+        self.cache = cache
+    
+    @staticmethod
+    def should_tile(model_input: Dict[str, Any]) -> bool:
+        """Whether the urban input is large enough to predict tile by tile."""
+        urban = model_input['urban_expansion']['data']
+        return int(np.prod(np.shape(urban))) > TILED_INFERENCE_MIN_PIXELS
+    
+    @staticmethod
+    def _slice_entry(entry: Optional[Dict[str, Any]], fractions: tuple) -> Optional[Dict[str, Any]]:
+        """Slice one processed input over a fractional (y0, x0, y1, x1) extent of its grid."""
+        if not entry or not isinstance(entry.get('data'), np.ndarray) or entry['data'].ndim < 2:
+            return entry
+        fy0, fx0, fy1, fx1 = fractions
+        height, width = entry['data'].shape[-2:]
+        r0, c0 = math.floor(fy0 * height), math.floor(fx0 * width)
+        r1 = max(math.ceil(fy1 * height), r0 + 1)
+        c1 = max(math.ceil(fx1 * width), c0 + 1)
+        
+        sliced = dict(entry)
+        sliced['data'] = entry['data'][..., r0:r1, c0:c1]
+        sliced['shape'] = sliced['data'].shape
+        if entry.get('transform'):
+            a, b, c, d, e, f = entry['transform'][:6]
+            c, f = c + a * c0 + b * r0, f + d * c0 + e * r0
+            sliced['transform'] = [a, b, c, d, e, f] + list(entry['transform'][6:])
+            if entry.get('bounds') and b == 0 and d == 0:
+                rows, cols = r1 - r0, c1 - c0
+                sliced['bounds'] = [c, f + e * rows, c + a * cols, f]
+        if entry.get('lat') is not None and entry.get('lon') is not None:
+            sliced['lat'] = entry['lat'][r0:r1]
+            sliced['lon'] = entry['lon'][c0:c1]
+        return sliced
+    
+    async def _predict_tile(
+        self, tile_input: Dict[str, Any], timings: Optional[StageTimings] = None
+    ) -> Dict[str, Any]:
+        """Predict one tile, retrying server-side failures and timeouts with backoff."""
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.ml_service.predict(tile_input, timings)
+            except HTTPException as e:
+                if e.status_code < 500 or attempt == self.retries:
+                    raise
+                await asyncio.sleep(0.5 * (2 ** attempt))
+    
+    async def predict(
+        self,
+        model_input: Dict[str, Any],
+        on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+        timings: Optional[StageTimings] = None,
+    ) -> Dict[str, Any]:
+        """
+        Predict `model_input` tile by tile with bounded concurrency.
+        
+        `on_progress(completed, total)` is awaited as tiles finish. Returns a
+        model output dict with the stitched `prediction` array and metrics
+        averaged over tiles by pixel count, and the number of tiles read from
+        the cache as `tiles_cached`. With `timings`, cache lookups and writes
+        are recorded as the "tile_cache" stage and stitching as "stitch", next
+        to the stages of the model calls.
+        """
+        height, width = np.shape(model_input['urban_expansion']['data'])
+        windows = DataProcessor.tile_windows((height, width), self.tile_size, self.overlap)
+        total = len(windows)
+        completed = 0
+        cached = 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+        if on_progress:
+            await on_progress(0, total)
+        
+        async def run(window) -> Dict[str, Any]:
+            nonlocal completed, cached
+            hx0, hy0, hx1, hy1 = window[4:]
+            fractions = (hy0 / height, hx0 / width, hy1 / height, hx1 / width)
+            tile_input = {
+                key: self._slice_entry(entry, fractions) for key, entry in model_input.items()
+            }
+            output = None
+            if self.cache is not None:
+                with timed(timings, "tile_cache"):
+                    cache_key = await asyncio.to_thread(self.cache.key, tile_input)
+                    output = await asyncio.to_thread(self.cache.get, cache_key)
+            if output is None:
+                async with semaphore:
+                    output = await self._predict_tile(tile_input, timings)
+                if self.cache is not None:
+                    with timed(timings, "tile_cache"):
+                        await asyncio.to_thread(self.cache.put, cache_key, output)
+            else:
+                cached += 1
+            completed += 1
+            if on_progress:
+                await on_progress(completed, total)
+            return output
+        
+        tasks = [asyncio.ensure_future(run(window)) for window in windows]
+        try:
+            outputs = await asyncio.gather(*tasks)
+        except BaseException:
+            # One failed tile fails the prediction; don't keep calling the model for the rest
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        with timed(timings, "stitch"):
+            prediction = self._stitch(outputs, windows, (height, width))
+        
+        result = self._aggregate_metrics(outputs, windows)
+        result['prediction'] = prediction
+        result['tiles_cached'] = cached
+        return result
+    
+    @staticmethod
+    def _stitch(outputs: List[Dict[str, Any]], windows: np.ndarray, shape: tuple) -> np.ndarray:
+        """Crop the overlap from each tile prediction and place it in one mosaic."""
+        mosaic = None
+        for output, window in zip(outputs, windows):
+            if output.get('prediction') is None:
+                raise Exception("Model service did not return a prediction array for a tile")
+            tile = np.asarray(output['prediction'], dtype=np.float32)
+            x0, y0, x1, y1, hx0, hy0, hx1, hy1 = window
+            # Predictions may come at a different resolution than the urban grid
+            scale_y = tile.shape[-2] / (hy1 - hy0)
+            scale_x = tile.shape[-1] / (hx1 - hx0)
+            if mosaic is None:
+                mosaic = np.full(
+                    (round(shape[0] * scale_y), round(shape[1] * scale_x)), np.nan, dtype=np.float32
+                )
+            crop = tile[
+                ...,
+                round((y0 - hy0) * scale_y):round((y1 - hy0) * scale_y),
+                round((x0 - hx0) * scale_x):round((x1 - hx0) * scale_x),
+            ]
+            top, left = round(y0 * scale_y), round(x0 * scale_x)
+            mosaic[top:top + crop.shape[-2], left:left + crop.shape[-1]] = crop
+        return mosaic
+    
+    @staticmethod
+    def _aggregate_metrics(outputs: List[Dict[str, Any]], windows: np.ndarray) -> Dict[str, Any]:
+        """Average per-tile metrics and confidence, weighted by core tile area."""
+        weights = (windows[:, 2] - windows[:, 0]) * (windows[:, 3] - windows[:, 1])
+        result: Dict[str, Any] = {}
+        for name in ('mae', 'rmse', 'mse', 'accuracy', 'confidence'):
+            pairs = [
+                (output[name], weight) for output, weight in zip(outputs, weights)
+                if output.get(name) is not None
+            ]
+            if pairs:
+                values, value_weights = zip(*pairs)
+                result[name] = float(np.average(values, weights=value_weights))
+        if 'mse' in result:
+            # RMSE does not average linearly; derive it from the pooled MSE
+            result['rmse'] = math.sqrt(result['mse'])
+        result['metrics'] = any(output.get('metrics') for output in outputs)
+        return result
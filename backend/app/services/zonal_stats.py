@@ -0,0 +1,578 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import numpy as np
+try:
+    import rasterio
+    from rasterio.features import rasterize, bounds as geometry_bounds
+    from rasterio.transform import from_origin
+    from rasterio.warp import transform_geom
+    from rasterio.windows import Window, from_bounds as window_from_bounds, transform as window_transform
+    HAS_RASTERIO = True
+except ImportError:
+    HAS_RASTERIO = False
+from app.models.schemas import RegionBounds
+from app.services.data_processor import DataProcessor, REGION_CRS, LAT_NAMES, LON_NAMES
+
+logger = logging.getLogger(__name__)
+
+ZONAL_STATS_DB = Path(os.getenv("ZONAL_STATS_DB", "analytics.db"))
+# Rasterized region sets kept in memory, one per raster grid
+LABEL_GRID_CACHE_SIZE = int(os.getenv("LABEL_GRID_CACHE_SIZE", "16"))
+# GeoTIFF rows read at a time while aggregating
+_STRIP_ROWS = 1024
+
+# Metrics indexed per region and year
+YIELD = "yield"
+URBAN_EXTENT = "urbanExtent"
+
+# Kinds of source rasters. When several sources cover the same region, year
+# and metric, observed data wins over predictions, then the newest source.
+_SOURCE_METRICS = {"urban": URBAN_EXTENT, "yield": YIELD, "prediction": YIELD}
+_SOURCE_PRECEDENCE = {"urban": 0, "yield": 0, "prediction": 1}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS regions (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    geometry TEXT NOT NULL,
+    computed INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    year INTEGER,
+    version TEXT NOT NULL,
+    computed INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats (
+    region_id TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    source_id TEXT NOT NULL,
+    total REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (region_id, year, metric, source_id)
+);
+CREATE INDEX IF NOT EXISTS stats_source ON stats (source_id);
+"""
+
+
+class IndexedRegion(NamedTuple):
+    id: str
+    name: str
+    geometry: Dict[str, Any]  # GeoJSON geometry in WGS84
+    computed: bool
+    updated_at: float
+
+
+class Source(NamedTuple):
+    id: str
+    kind: str  # "urban", "yield" (historical yields) or "prediction"
+    path: str
+    year: Optional[int]  # Year of a single-year raster; NetCDF sources carry their own
+    version: str
+    computed: bool
+    updated_at: float
+
+
+class LabelGrid(NamedTuple):
+    """Regions rasterized onto part of a raster grid."""
+    window: "Window"  # Part of the raster covered by any region
+    # Labels within the window: 0 is no region, i + 1 is regions[i]. Overlapping
+    # regions are put on separate layers, so every pixel counts for each region.
+    layers: List[np.ndarray]
+
+
+def bounds_geometry(bounds: RegionBounds) -> Dict[str, Any]:
+    """GeoJSON polygon of region bounds."""
+    west, south, east, north = bounds.west, bounds.south, bounds.east, bounds.north
+    return {
+        "type": "Polygon",
+        "coordinates": [[[west, south], [east, south], [east, north], [west, north], [west, south]]],
+    }
+
+
+def validate_geometry(geometry: Any):
+    """Raise ValueError unless `geometry` is a GeoJSON Polygon or MultiPolygon in WGS84."""
+    kind = geometry.get("type") if isinstance(geometry, dict) else None
+    if kind not in ("Polygon", "MultiPolygon"):
+        raise ValueError(f"Region geometry must be a GeoJSON Polygon or MultiPolygon, not {kind}")
+    polygons = geometry.get("coordinates")
+    if kind == "Polygon":
+        polygons = [polygons]
+    if not isinstance(polygons, list) or not polygons:
+        raise ValueError("Region geometry has no coordinates")
+    for polygon in polygons:
+        if not isinstance(polygon, list) or not polygon:
+            raise ValueError("Each polygon needs at least one ring")
+        for ring in polygon:
+            if not isinstance(ring, list) or len(ring) < 4:
+                raise ValueError("Each polygon ring needs at least four positions")
+            for position in ring:
+                if not (
+                    isinstance(position, list) and len(position) >= 2
+                    and all(
+                        isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+                        for value in position[:2]
+                    )
+                ):
+                    raise ValueError("Positions must be [longitude, latitude] numbers")
+                longitude, latitude = position[:2]
+                if not (-180 <= longitude <= 360 and -90 <= latitude <= 90):
+                    raise ValueError("Positions must be WGS84 longitude/latitude")
+            if ring[0][:2] != ring[-1][:2]:
+                raise ValueError("Polygon rings must be closed")
+
+
+def _file_version(path: str) -> Optional[str]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+class ZonalStatsIndex:
+    """
+    Per-region, per-year aggregates of yield and urban extent rasters.
+    
+    Region geometries are rasterized once per raster grid into a cached label
+    grid, and all regions' sums and pixel counts are then computed in one
+    pass over each raster with `np.bincount`. Results are stored in SQLite
+    keyed by region, year, metric and source raster, so a region query is a
+    single indexed read. Work is incremental: a new or changed source is
+    aggregated for all regions, and a new or changed region is aggregated
+    over the existing sources, without touching the rest of the index.
+    """
+    
+    def __init__(self, db_path: Path = ZONAL_STATS_DB, cache_size: int = LABEL_GRID_CACHE_SIZE):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self._initialized = False
+        self._label_grids: "OrderedDict[tuple, Optional[LabelGrid]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # Background refreshes: at most one runs, and calls meanwhile queue one more
+        self._schedule_lock = threading.Lock()
+        self._refreshing = False
+        self._refresh_again = False
+    
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                self._initialized = True
+            yield conn
+        finally:
+            conn.close()
+    
+    # Regions
+    
+    def put_region(self, region_id: str, name: str, geometry: Dict[str, Any]) -> IndexedRegion:
+        """Add or replace a region; its statistics are recomputed on the next refresh."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO regions (id, name, geometry, computed, updated_at) "
+                "VALUES (?, ?, ?, 0, ?)",
+                (region_id, name, json.dumps(geometry), now),
+            )
+        return IndexedRegion(region_id, name, geometry, False, now)
+    
+    def ensure_region(self, region_id: str, name: str, geometry: Dict[str, Any]):
+        """Add a region unless one with this ID is already defined."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO regions (id, name, geometry, computed, updated_at) "
+                "VALUES (?, ?, ?, 0, ?)",
+                (region_id, name, json.dumps(geometry), time.time()),
+            )
+    
+    def get_region(self, region_id: str) -> Optional[IndexedRegion]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, name, geometry, computed, updated_at FROM regions WHERE id = ?",
+                (region_id,),
+            ).fetchone()
+        return self._region(row) if row else None
+    
+    def list_regions(self) -> List[IndexedRegion]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, name, geometry, computed, updated_at FROM regions ORDER BY id"
+            ).fetchall()
+        return [self._region(row) for row in rows]
+    
+    def delete_region(self, region_id: str) -> bool:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM stats WHERE region_id = ?", (region_id,))
+            return conn.execute("DELETE FROM regions WHERE id = ?", (region_id,)).rowcount > 0
+    
+    @staticmethod
+    def _region(row) -> IndexedRegion:
+        return IndexedRegion(row[0], row[1], json.loads(row[2]), bool(row[3]), row[4])
+    
+    # Sources
+    
+    def add_source(self, source_id: str, kind: str, path: str, year: Optional[int] = None):
+        """
+        Register a raster to aggregate. Re-registering an unchanged file is a
+        no-op; a changed file or year is aggregated again on the next refresh.
+        """
+        if kind not in _SOURCE_METRICS:
+            raise ValueError(f"Unknown source kind: {kind}")
+        version = _file_version(path)
+        if version is None:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO sources (id, kind, path, year, version, computed, updated_at)
+                VALUES (?, ?, ?, ?, ?, 0, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    computed = CASE WHEN sources.version = excluded.version
+                        AND sources.year IS excluded.year THEN sources.computed ELSE 0 END,
+                    updated_at = CASE WHEN sources.version = excluded.version
+                        AND sources.year IS excluded.year THEN sources.updated_at ELSE excluded.updated_at END,
+                    kind = excluded.kind,
+                    path = excluded.path,
+                    year = excluded.year,
+                    version = excluded.version
+                """,
+                (source_id, kind, str(path), year, version, time.time()),
+            )
+    
+    def remove_source(self, source_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM stats WHERE source_id = ?", (source_id,))
+            conn.execute("DELETE FROM sources WHERE id = ?", (source_id,))
+    
+    def register_uploads(self, urban: Iterable[Any], historical_yields: Iterable[Any]):
+        """Register uploaded files (file index records) not yet known to the index."""
+        for record in urban:
+            year = record.metadata.get("year")
+            if year is not None:
+                self.add_source(record.file_id, "urban", record.path, int(year))
+        for record in historical_yields:
+            self.add_source(record.file_id, "yield", record.path)
+    
+    def _sources(self, conn) -> List[Source]:
+        rows = conn.execute(
+            "SELECT id, kind, path, year, version, computed, updated_at FROM sources"
+        ).fetchall()
+        return [Source(*row[:5], bool(row[5]), row[6]) for row in rows]
+    
+    # Aggregation
+    
+    def has_pending(self) -> bool:
+        """Whether sources or regions are waiting to be aggregated."""
+        with self._connect() as conn:
+            return bool(conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM sources WHERE computed = 0) "
+                "OR EXISTS (SELECT 1 FROM regions WHERE computed = 0)"
+            ).fetchone()[0])
+    
+    def refresh(self) -> int:
+        """
+        Bring the index up to date and return the number of sources aggregated.
+        
+        Sources whose file is gone are dropped and changed files are
+        re-aggregated. New sources are aggregated for all regions, then
+        existing sources for new or changed regions only.
+        """
+        if not HAS_RASTERIO:
+            raise Exception("rasterio is required for zonal statistics. Please install it.")
+        with self._refresh_lock:
+            with self._connect() as conn:
+                sources = self._prune(conn, self._sources(conn))
+                regions = [
+                    self._region(row) for row in conn.execute(
+                        "SELECT id, name, geometry, computed, updated_at FROM regions ORDER BY id"
+                    )
+                ]
+            pending_regions = [region for region in regions if not region.computed]
+            aggregated = 0
+            
+            if pending_regions:
+                # Existing sources for new or changed regions; pending sources
+                # are aggregated for all regions below
+                rows = []
+                for source in sources:
+                    if source.computed:
+                        rows.extend(self._source_rows(source, pending_regions))
+                with self._connect() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.executemany(
+                        "DELETE FROM stats WHERE region_id = ?",
+                        [(region.id,) for region in pending_regions],
+                    )
+                    conn.executemany("INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?)", rows)
+                    # Unless the region was changed again meanwhile
+                    conn.executemany(
+                        "UPDATE regions SET computed = 1 WHERE id = ? AND updated_at = ?",
+                        [(region.id, region.updated_at) for region in pending_regions],
+                    )
+                    conn.execute("COMMIT")
+            
+            for source in sources:
+                if source.computed:
+                    continue
+                rows = self._source_rows(source, regions)
+                with self._connect() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("DELETE FROM stats WHERE source_id = ?", (source.id,))
+                    conn.executemany("INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?)", rows)
+                    # Unless the file changed again meanwhile
+                    conn.execute(
+                        "UPDATE sources SET computed = 1 WHERE id = ? AND version = ?",
+                        (source.id, source.version),
+                    )
+                    conn.execute("COMMIT")
+                aggregated += 1
+            return aggregated
+    
+    def schedule_refresh(self):
+        """Run `refresh` on a background thread without waiting for it."""
+        with self._schedule_lock:
+            if self._refreshing:
+                self._refresh_again = True
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name="zonal-stats-refresh", daemon=True).start()
+    
+    def _refresh_in_background(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                # Analytics are derived data; the next refresh retries
+                logger.warning("Zonal statistics refresh failed: %s", e)
+            with self._schedule_lock:
+                if not self._refresh_again:
+                    self._refreshing = False
+                    return
+                self._refresh_again = False
+    
+    @staticmethod
+    def _prune(conn, sources: List[Source]) -> List[Source]:
+        """Drop sources whose file was deleted and flag changed files for re-aggregation."""
+        live = []
+        for source in sources:
+            version = _file_version(source.path)
+            if version is None:
+                conn.execute("DELETE FROM stats WHERE source_id = ?", (source.id,))
+                conn.execute("DELETE FROM sources WHERE id = ?", (source.id,))
+                continue
+            if version != source.version:
+                conn.execute(
+                    "UPDATE sources SET version = ?, computed = 0, updated_at = ? WHERE id = ?",
+                    (version, time.time(), source.id),
+                )
+                source = source._replace(version=version, computed=False)
+            live.append(source)
+        return live
+    
+    def _source_rows(self, source: Source, regions: List[IndexedRegion]) -> List[tuple]:
+        """Aggregate one source for `regions`; an unreadable source yields no rows."""
+        if not regions:
+            return []
+        try:
+            if source.kind == "yield":
+                return self._netcdf_rows(source, regions)
+            return self._geotiff_rows(source, regions)
+        except Exception as e:
+            logger.warning("Zonal statistics failed for %s source %s: %s", source.kind, source.id, e)
+            return []
+    
+    def _geotiff_rows(self, source: Source, regions: List[IndexedRegion]) -> List[tuple]:
+        if source.year is None:
+            return []
+        metric = _SOURCE_METRICS[source.kind]
+        with rasterio.open(source.path) as src:
+            if src.crs is None and src.transform.is_identity:
+                # Not georeferenced, so regions cannot be placed on it
+                return []
+            grid = self._label_grid(regions, src.crs or REGION_CRS, src.transform, src.shape)
+            if grid is None:
+                return []
+            totals = np.zeros(len(regions) + 1)
+            counts = np.zeros(len(regions) + 1, dtype=np.int64)
+            window = grid.window
+            for offset in range(0, int(window.height), _STRIP_ROWS):
+                height = min(_STRIP_ROWS, int(window.height) - offset)
+                data = src.read(
+                    1,
+                    window=Window(window.col_off, window.row_off + offset, window.width, height),
+                    masked=True,
+                )
+                values = np.ma.getdata(data).astype(np.float64)
+                valid = ~np.ma.getmaskarray(data) & np.isfinite(values)
+                if metric == URBAN_EXTENT:
+                    # Share of pixels classified as urban
+                    values = (values > 0).astype(np.float64)
+                for labels in grid.layers:
+                    self._accumulate(values, valid, labels[offset:offset + height], totals, counts)
+        return self._rows(regions, source.id, source.year, metric, totals, counts)
+    
+    def _netcdf_rows(self, source: Source, regions: List[IndexedRegion]) -> List[tuple]:
+        with DataProcessor.open_climate_variable(source.path, "yield") as data_array:
+            return self._grid_rows(source, regions, data_array)
+    
+    def _grid_rows(self, source: Source, regions: List[IndexedRegion], data_array) -> List[tuple]:
+        lat = next((d for d in data_array.dims if d.lower() in LAT_NAMES), None)
+        lon = next((d for d in data_array.dims if d.lower() in LON_NAMES), None)
+        if lat is None or lon is None:
+            raise Exception("NetCDF file has no latitude/longitude dimensions")
+        if float(data_array[lon].max()) > 180:
+            data_array = data_array.assign_coords({lon: (data_array[lon] + 180) % 360 - 180}).sortby(lon)
+        if data_array.sizes[lat] > 1 and float(data_array[lat][0]) < float(data_array[lat][-1]):
+            # North-up, like a GeoTIFF
+            data_array = data_array.isel({lat: slice(None, None, -1)})
+        
+        lats = data_array[lat].values.astype(np.float64)
+        lons = data_array[lon].values.astype(np.float64)
+        dx = (lons[-1] - lons[0]) / (lons.size - 1) if lons.size > 1 else 1.0
+        dy = (lats[0] - lats[-1]) / (lats.size - 1) if lats.size > 1 else 1.0
+        transform = from_origin(lons[0] - dx / 2, lats[0] + dy / 2, dx, dy)
+        grid = self._label_grid(regions, REGION_CRS, transform, (lats.size, lons.size))
+        if grid is None:
+            return []
+        rows = slice(int(grid.window.row_off), int(grid.window.row_off + grid.window.height))
+        cols = slice(int(grid.window.col_off), int(grid.window.col_off + grid.window.width))
+        
+        result = []
+        for year in DataProcessor.years(data_array):
+            year_array = DataProcessor._drop_extra_dims(DataProcessor._select_year(data_array, year))
+            values = np.asarray(year_array.transpose(lat, lon).values, dtype=np.float64)[rows, cols]
+            totals = np.zeros(len(regions) + 1)
+            counts = np.zeros(len(regions) + 1, dtype=np.int64)
+            for labels in grid.layers:
+                self._accumulate(values, np.isfinite(values), labels, totals, counts)
+            result.extend(self._rows(regions, source.id, year, YIELD, totals, counts))
+        return result
+    
+    @staticmethod
+    def _accumulate(
+        values: np.ndarray,
+        valid: np.ndarray,
+        labels: np.ndarray,
+        totals: np.ndarray,
+        counts: np.ndarray,
+    ):
+        """Add the sums and pixel counts of every label in one vectorized pass."""
+        selected = labels[valid]
+        totals += np.bincount(selected, weights=values[valid], minlength=totals.size)
+        counts += np.bincount(selected, minlength=counts.size)
+    
+    @staticmethod
+    def _rows(regions, source_id: str, year: int, metric: str, totals, counts) -> List[tuple]:
+        return [
+            (region.id, int(year), metric, source_id, float(totals[i + 1]), int(counts[i + 1]))
+            for i, region in enumerate(regions)
+            if counts[i + 1] > 0
+        ]
+    
+    # Label grids
+    
+    def _label_grid(self, regions: List[IndexedRegion], crs, transform, shape: Tuple[int, int]) -> Optional[LabelGrid]:
+        """Rasterized `regions` for a grid, built on first use and cached per grid and region set."""
+        key = (
+            str(crs),
+            tuple(transform)[:6],
+            tuple(shape),
+            tuple((region.id, region.updated_at) for region in regions),
+        )
+        with self._cache_lock:
+            if key in self._label_grids:
+                self._label_grids.move_to_end(key)
+                return self._label_grids[key]
+        grid = self._build_label_grid(regions, crs, transform, shape)
+        with self._cache_lock:
+            self._label_grids[key] = grid
+            while len(self._label_grids) > self.cache_size:
+                self._label_grids.popitem(last=False)
+        return grid
+    
+    @staticmethod
+    def _build_label_grid(regions: List[IndexedRegion], crs, transform, shape: Tuple[int, int]) -> Optional[LabelGrid]:
+        height, width = shape
+        placed = []
+        for i, region in enumerate(regions):
+            geometry = transform_geom(REGION_CRS, crs, region.geometry)
+            window = window_from_bounds(*geometry_bounds(geometry), transform)
+            row0 = max(int(np.floor(min(window.row_off, window.row_off + window.height))), 0)
+            row1 = min(int(np.ceil(max(window.row_off, window.row_off + window.height))), height)
+            col0 = max(int(np.floor(min(window.col_off, window.col_off + window.width))), 0)
+            col1 = min(int(np.ceil(max(window.col_off, window.col_off + window.width))), width)
+            if row1 > row0 and col1 > col0:
+                placed.append((i, geometry, row0, row1, col0, col1))
+        if not placed:
+            return None
+        
+        top = min(p[2] for p in placed)
+        bottom = max(p[3] for p in placed)
+        left = min(p[4] for p in placed)
+        right = max(p[5] for p in placed)
+        dtype = np.uint16 if len(regions) < np.iinfo(np.uint16).max else np.uint32
+        layers: List[np.ndarray] = []
+        for i, geometry, row0, row1, col0, col1 in placed:
+            # Rasterize within the region's own bounding box only
+            box = Window(col0, row0, col1 - col0, row1 - row0)
+            options = dict(out_shape=(row1 - row0, col1 - col0), transform=window_transform(box, transform), dtype="uint8")
+            mask = rasterize([(geometry, 1)], **options).astype(bool)
+            if not mask.any():
+                # Regions smaller than a pixel still get the pixels they touch
+                mask = rasterize([(geometry, 1)], all_touched=True, **options).astype(bool)
+            if not mask.any():
+                continue
+            rows = slice(row0 - top, row1 - top)
+            cols = slice(col0 - left, col1 - left)
+            for labels in layers:
+                if not labels[rows, cols][mask].any():
+                    break
+            else:
+                labels = np.zeros((bottom - top, right - left), dtype=dtype)
+                layers.append(labels)
+            labels[rows, cols][mask] = i + 1
+        if not layers:
+            return None
+        return LabelGrid(Window(left, top, right - left, bottom - top), layers)
+    
+    # Queries
+    
+    def region_series(self, region_id: str) -> Dict[int, Dict[str, float]]:
+        """Mean value of each metric per year for a region, from the preferred source."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT stats.year, stats.metric, stats.total, stats.count, sources.kind, sources.updated_at "
+                "FROM stats JOIN sources ON sources.id = stats.source_id WHERE stats.region_id = ?",
+                (region_id,),
+            ).fetchall()
+        best: Dict[Tuple[int, str], tuple] = {}
+        for year, metric, total, count, kind, updated_at in rows:
+            rank = (-_SOURCE_PRECEDENCE[kind], updated_at)
+            if (year, metric) not in best or rank > best[(year, metric)][0]:
+                best[(year, metric)] = (rank, total / count)
+        series: Dict[int, Dict[str, float]] = {}
+        for (year, metric), (_, value) in sorted(best.items()):
+            series.setdefault(year, {})[metric] = value
+        return series
+
+
+# Shared instance; sources are added by uploads and prediction workers
+zonal_stats = ZonalStatsIndex()
@@ -0,0 +1,162 @@
+"""
+Binary wire format for model input.
+
+A payload is laid out as::
+
+    MAGIC (8 bytes) | header length (uint32, little endian) | JSON header | array data
+
+The JSON header carries the model input document with every NumPy array
+replaced by an ``{"$array": index}`` reference, plus the dtype, shape, offset
+and size of each array inside the data section. The data section holds the raw
+C-ordered array buffers back to back, optionally zstd-compressed as a whole.
+"""
+import base64
+import io
+import json
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+
+MAGIC = b"URBANARR"
+FORMAT_VERSION = 1
+CONTENT_TYPE = "application/x-urban-arrays"
+_HEADER_LENGTH = struct.Struct("<I")
+
+
+def _extract_arrays(value: Any, arrays: List[np.ndarray]) -> Any:
+    """Replace arrays in a nested structure with references, collecting them in order."""
+    if isinstance(value, np.ndarray):
+        arrays.append(np.ascontiguousarray(value))
+        return {"$array": len(arrays) - 1}
+    if isinstance(value, dict):
+        return {k: _extract_arrays(v, arrays) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_extract_arrays(v, arrays) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _restore_arrays(value: Any, arrays: List[np.ndarray]) -> Any:
+    if isinstance(value, dict):
+        if set(value) == {"$array"}:
+            return arrays[value["$array"]]
+        return {k: _restore_arrays(v, arrays) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_restore_arrays(v, arrays) for v in value]
+    return value
+
+
+def encode_model_input(
+    model_input: Dict[str, Any],
+    compression: Optional[str] = None,
+) -> Tuple[List[bytes], int]:
+    """
+    Encode model input into the binary wire format.
+
+    Returns the payload as a list of chunks (header first, then one buffer per
+    array) together with the total length, so callers can stream it without
+    concatenating large arrays into a single bytes object.
+    """
+    if compression not in (None, "zstd"):
+        raise ValueError(f"Unsupported compression: {compression}")
+    if compression == "zstd" and not HAS_ZSTD:
+        raise Exception("zstandard is required for zstd compression. Please install it.")
+
+    arrays: List[np.ndarray] = []
+    document = _extract_arrays(model_input, arrays)
+
+    specs = []
+    offset = 0
+    for array in arrays:
+        specs.append({
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+            "nbytes": array.nbytes,
+        })
+        offset += array.nbytes
+
+    buffers: List[Any] = [memoryview(array.reshape(-1).view(np.uint8)) for array in arrays]
+    if compression == "zstd":
+        compressor = zstandard.ZstdCompressor()
+        chunker = compressor.chunker()
+        compressed = []
+        for buffer in buffers:
+            compressed.extend(chunker.compress(buffer))
+        compressed.extend(chunker.finish())
+        buffers = compressed
+
+    header = json.dumps({
+        "version": FORMAT_VERSION,
+        "compression": compression,
+        "arrays": specs,
+        "document": document,
+    }).encode("utf-8")
+
+    chunks = [MAGIC + _HEADER_LENGTH.pack(len(header)) + header, *buffers]
+    return chunks, sum(len(chunk) for chunk in chunks)
+
+
+def decode_model_input(payload: bytes) -> Dict[str, Any]:
+    """Decode a binary payload back into a model input document with NumPy arrays."""
+    if payload[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a binary model input payload")
+    start = len(MAGIC) + _HEADER_LENGTH.size
+    (header_length,) = _HEADER_LENGTH.unpack(payload[len(MAGIC):start])
+    header = json.loads(payload[start:start + header_length])
+
+    data = memoryview(payload)[start + header_length:]
+    if header.get("compression") == "zstd":
+        if not HAS_ZSTD:
+            raise Exception("zstandard is required for zstd compression. Please install it.")
+        data = memoryview(zstandard.ZstdDecompressor().decompressobj().decompress(data))
+
+    arrays = [
+        np.frombuffer(
+            data[spec["offset"]:spec["offset"] + spec["nbytes"]],
+            dtype=np.dtype(spec["dtype"]),
+        ).reshape(spec["shape"])
+        for spec in header["arrays"]
+    ]
+    return _restore_arrays(header["document"], arrays)
+
+
+def to_json_compatible(value: Any) -> Any:
+    """Convert arrays in a nested structure to lists for the JSON fallback."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, dict):
+        return {k: to_json_compatible(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json_compatible(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def to_png_data_url(array: np.ndarray) -> str:
+    """Render a 2D array as a grayscale PNG data URL, scaled to its finite value range."""
+    if not HAS_PIL:
+        raise Exception("pillow is required for rendering prediction maps. Please install it.")
+    values = np.asarray(array, dtype=np.float32)
+    finite = np.isfinite(values)
+    image = np.zeros(values.shape, dtype=np.uint8)
+    if finite.any():
+        low, high = values[finite].min(), values[finite].max()
+        scale = 255.0 / (high - low) if high > low else 0.0
+        image[finite] = np.round((values[finite] - low) * scale).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(image, mode="L").save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
@@ -0,0 +1,78 @@
+import json
+import math
+import base64
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, Optional, Set, Tuple
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def encode_cursor(key: Tuple[Any, ...]) -> str:
+    """Encode the sort key of the last item on a page as an opaque cursor."""
+    payload = json.dumps(list(key), separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], types: Tuple[type, ...]) -> Optional[Tuple[Any, ...]]:
+    """
+    Decode a cursor into a sort key whose elements have the given `types`
+    (a float element also accepts JSON integers and is returned as a finite
+    float). Malformed cursors get a 400.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        # Deeply nested JSON raises RecursionError
+        key = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(key, list) or len(key) != len(types):
+            raise ValueError("Wrong cursor length")
+        return tuple(_cursor_value(value, kind) for value, kind in zip(key, types))
+    except (ValueError, TypeError, OverflowError, RecursionError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _cursor_value(value: Any, kind: type) -> Any:
+    if isinstance(value, bool) or not isinstance(value, (int, float) if kind is float else kind):
+        raise TypeError(f"Expected {kind.__name__} in cursor")
+    if kind is float:
+        # Huge integers do not fit SQLite columns; NaN and infinities never match a row
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError("Cursor value is not finite")
+    return value
+
+
+def parse_csv(value: Optional[str]) -> Optional[Set[str]]:
+    """Parse a comma-separated parameter such as `fields` or `status`; None means no restriction."""
+    if not value:
+        return None
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+def to_timestamp(value: Optional[datetime]) -> Optional[float]:
+    """Convert a query datetime to a UTC epoch timestamp; naive values are taken as UTC."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def project(item: BaseModel, fields: Optional[Set[str]]) -> Dict[str, Any]:
+    """Dump a model to JSON-compatible data, keeping only `fields` if given."""
+    return item.model_dump(mode="json", include=fields)
+
+
+def ndjson_response(items: Iterable[Dict[str, Any]]) -> StreamingResponse:
+    """Stream items as newline-delimited JSON, one object per line."""
+    def lines() -> Iterator[bytes]:
+        for item in items:
+            yield (json.dumps(item, separators=(",", ":")) + "\n").encode("utf-8")
+    
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
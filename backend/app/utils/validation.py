@@ -1,5 +1,6 @@
 import os
-from typing import Tuple
+from typing import Callable, Tuple
+import numpy as np
 try:
     import rasterio
     HAS_RASTERIO = True
@@ -11,6 +12,8 @@ try:
 except ImportError:
     HAS_XARRAY = False
 from fastapi import UploadFile, HTTPException
+from app.services.data_processor import DataProcessor, LAT_NAMES, LON_NAMES
+from app.services.executor import decode_executor
 
 
 ALLOWED_TIFF_EXTENSIONS = {'.tif', '.tiff'}
@@ -39,6 +42,14 @@ def validate_netcdf_file(file: UploadFile) -> Tuple[bool, str]:
     return True, ""
 
 
+async def _read_metadata(read: Callable[[str], dict], file_path: str) -> dict:
+    """Run a metadata reader on the decode pool; unreadable files are a 400."""
+    try:
+        return await decode_executor.run(read, file_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 async def read_tiff_metadata(file_path: str) -> dict:
     """Read metadata from a TIFF file."""
     if not HAS_RASTERIO:
@@ -52,38 +63,72 @@ async def read_tiff_metadata(file_path: str) -> dict:
             'dtype': 'Unknown',
             'note': 'rasterio not installed - limited metadata available'
         }
+    # Opening the file is blocking I/O; keep it off the event loop
+    return await _read_metadata(_read_tiff_metadata, file_path)
+
+
+def _read_tiff_metadata(file_path: str) -> dict:
     try:
         with rasterio.open(file_path) as src:
             return {
                 'width': src.width,
                 'height': src.height,
                 'crs': str(src.crs),
+                'transform': list(src.transform)[:6],
                 'bounds': list(src.bounds),
                 'count': src.count,
                 'dtype': str(src.dtypes[0]),
+                'nodata': src.nodata,
+                'block_shape': list(src.block_shapes[0]),
             }
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading TIFF file: {str(e)}")
+        raise ValueError(f"Error reading TIFF file: {str(e)}")
 
 
 async def read_netcdf_metadata(file_path: str) -> dict:
-    """Read metadata from a NetCDF file."""
+    """Read metadata from a NetCDF file, including its grid coordinates and years."""
     if not HAS_XARRAY:
         return {
             'dimensions': {},
-            'variables': [],
+            'variables': {},
             'attrs': {},
             'note': 'xarray not installed - limited metadata available'
         }
+    return await _read_metadata(_read_netcdf_metadata, file_path)
+
+
+def _read_netcdf_metadata(file_path: str) -> dict:
     try:
-        ds = xr.open_dataset(file_path)
-        metadata = {
-            'dimensions': dict(ds.dims),
-            'variables': list(ds.variables.keys()),
-            'attrs': dict(ds.attrs),
-        }
-        ds.close()
-        return metadata
+        with xr.open_dataset(file_path) as ds:
+            coordinates = {}
+            time_steps = {}
+            for dim in ds.dims:
+                if dim not in ds.coords:
+                    continue
+                coord = ds[dim]
+                if DataProcessor.time_dim(coord) == dim:
+                    # Year of every time step, so years are selected without decoding times
+                    time_steps[dim] = [int(year) for year in DataProcessor.time_years(coord).values]
+                elif dim.lower() in LAT_NAMES + LON_NAMES and coord.size:
+                    values = coord.values.astype(np.float64)
+                    coordinates[dim] = {
+                        'size': int(values.size),
+                        'first': float(values[0]),
+                        'last': float(values[-1]),
+                        'min': float(values.min()),
+                        'max': float(values.max()),
+                    }
+            return {
+                'dimensions': {name: int(size) for name, size in ds.sizes.items()},
+                'variables': {
+                    name: {'dims': list(var.dims), 'shape': list(var.shape), 'dtype': str(var.dtype)}
+                    for name, var in ds.variables.items()
+                },
+                'data_variables': list(ds.data_vars),
+                'coordinates': coordinates,
+                'time_steps': time_steps,
+                'years': sorted({year for steps in time_steps.values() for year in steps}),
+                'attrs': {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in ds.attrs.items()},
+            }
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading NetCDF file: {str(e)}")
-
+        raise ValueError(f"Error reading NetCDF file: {str(e)}")
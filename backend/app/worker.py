@@ -0,0 +1,180 @@
+"""
+Prediction worker.
+
+Pulls prediction jobs from the durable job queue and runs them. Start any
+number of these alongside the API, on this or other machines sharing the
+queue database:
+    
+    python -m app.worker
+"""
+import os
+import socket
+import signal
+import asyncio
+import uuid
+from typing import Awaitable, Callable, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.models.schemas import PredictionResponse
+from app.services.job_queue import job_queue, Job, JOB_LEASE_SECONDS
+from app.services.ml_service import ml_service
+from app.services.executor import decode_executor
+from app.services.file_handler import file_index
+from app.services.prediction_pipeline import process_prediction, process_batch, JobStopped
+from app.services.profiling import run_profiled, should_sample, new_profile_id
+from app.services.prediction_memo import prediction_memo, request_fingerprint
+
+# Jobs processed concurrently by one worker process
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+# Seconds between queue polls when no job is available
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1.0"))
+# Jobs of the same batch claimed together so they share loaded inputs
+WORKER_BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "32"))
+
+
+class PredictionWorker:
+    """Runs up to `concurrency` queued prediction jobs at a time."""
+    
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY):
+        self.concurrency = concurrency
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stopping = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+    
+    def start(self):
+        """Start the job loops on the running event loop."""
+        self._tasks = [asyncio.create_task(self._loop()) for _ in range(self.concurrency)]
+    
+    async def stop(self):
+        """Stop claiming jobs and wait for the loops to exit."""
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+    
+    async def _loop(self):
+        while not self._stopping.is_set():
+            job: Optional[Job] = await asyncio.to_thread(job_queue.claim, self.worker_id)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), WORKER_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run_job(job)
+    
+    async def _run_job(self, job: Job):
+        # Pending jobs from the same batch are run together with this one
+        jobs = [job] + await asyncio.to_thread(
+            job_queue.claim_batch, job, self.worker_id, WORKER_BATCH_SIZE - 1
+        )
+        predictions = {j.id: await asyncio.to_thread(job_queue.get, j.id) for j in jobs}
+        save = self._saver()
+        if len(jobs) == 1:
+            run = process_prediction(predictions[job.id], job.request, save)
+        else:
+            run = process_batch([(predictions[j.id], j.request) for j in jobs], save)
+        # Flagged jobs and a sample of the others are profiled; each run (an attempt,
+        # or one chunk of a batch) gets its own profile under the job's or batch's ID
+        if any(j.profile for j in jobs) or should_sample():
+            if len(jobs) == 1:
+                run = run_profiled(
+                    new_profile_id("prediction", job.id), "prediction", f"job {job.id} on {self.worker_id}", run
+                )
+            else:
+                run = run_profiled(
+                    new_profile_id("prediction", job.batch_id),
+                    "prediction",
+                    f"{len(jobs)} items of batch {job.batch_id} on {self.worker_id}",
+                    run,
+                )
+        task = asyncio.create_task(run)
+        
+        # Heartbeat the leases while the jobs run; stop once all were cancelled or their leases lost
+        cancelled = set()
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=JOB_LEASE_SECONDS / 3)
+                if task.done():
+                    break
+                for j in jobs:
+                    if j.id not in cancelled and not await asyncio.to_thread(
+                        job_queue.heartbeat, j.id, self.worker_id
+                    ):
+                        cancelled.add(j.id)
+                if len(cancelled) == len(jobs):
+                    task.cancel()
+        except asyncio.CancelledError:
+            # Worker shutting down: stop the jobs and hand them back to the queue
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            for j in jobs:
+                await asyncio.to_thread(job_queue.release, j.id, self.worker_id)
+            raise
+        
+        try:
+            result = task.result()
+        except asyncio.CancelledError:
+            for j in jobs:
+                await asyncio.to_thread(job_queue.mark_cancelled, j.id)
+            return
+        except Exception as e:
+            errors = {j.id: e for j in jobs}
+        else:
+            errors = result if len(jobs) > 1 else {job.id: None}
+        
+        for j in jobs:
+            if j.id in cancelled or isinstance(errors.get(j.id), JobStopped):
+                # Only recorded if cancellation was requested; a lost lease is left to its new owner
+                await asyncio.to_thread(job_queue.mark_cancelled, j.id)
+            elif errors.get(j.id) is not None:
+                await asyncio.to_thread(job_queue.fail, j.id, self.worker_id, str(errors[j.id]))
+            elif await asyncio.to_thread(job_queue.complete, j.id, self.worker_id, predictions[j.id]):
+                # Identical requests to this process are answered from memory from now on
+                prediction_memo.put(request_fingerprint(j.request), predictions[j.id])
+    
+    def _saver(self) -> Callable[[PredictionResponse], Awaitable[bool]]:
+        """
+        `save` callback for the pipeline: writes off the event loop, one at a
+        time and in order, and only while this worker holds the job's lease.
+        """
+        lock = asyncio.Lock()
+        
+        async def save(prediction: PredictionResponse) -> bool:
+            # Snapshot now; the pipeline keeps updating the prediction while the write waits
+            snapshot = prediction.model_copy()
+            async with lock:
+                return await asyncio.to_thread(job_queue.save, snapshot, self.worker_id)
+        
+        return save
+
+
+async def main():
+    await ml_service.start()
+    await asyncio.to_thread(file_index.load)
+    worker = PredictionWorker()
+    worker.start()
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Signal handlers are not available on Windows event loops
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await worker.stop()
+        await ml_service.close()
+        decode_executor.shutdown()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1 @@
+"""Benchmarks for the data pipeline and API; see benchmarks/run.py."""
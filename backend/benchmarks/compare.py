@@ -0,0 +1,67 @@
+"""
+Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json
+
+Exits with status 1 if any benchmark present in both files got slower (by
+median time) or used more peak memory by more than the threshold.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+# Relative increase counted as a regression
+DEFAULT_THRESHOLD = 0.10
+# Changes below these are noise regardless of their relative size
+_MIN_SECONDS = 0.005
+_MIN_MEMORY_MB = 1.0
+
+_METRICS = (("median_seconds", _MIN_SECONDS), ("peak_memory_mb", _MIN_MEMORY_MB))
+
+
+def _by_key(results: Dict[str, Any]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    return {(entry["name"], entry["size"]): entry for entry in results["results"]}
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = DEFAULT_THRESHOLD) -> Tuple[List[str], List[str]]:
+    """Return report lines and the subset describing regressions."""
+    before = _by_key(baseline)
+    after = _by_key(current)
+    lines = [f"{'benchmark':<40} {'size':<24} {'metric':<16} {'before':>10} {'after':>10} {'change':>8}"]
+    regressions = []
+    for key in sorted(before.keys() & after.keys()):
+        for metric, minimum in _METRICS:
+            old, new = before[key].get(metric), after[key].get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            line = f"{key[0]:<40} {key[1]:<24} {metric:<16} {old:>10.4f} {new:>10.4f} {change:>+8.1%}"
+            if change > threshold and new - old > minimum:
+                line += "  REGRESSION"
+                regressions.append(line)
+            lines.append(line)
+    for key in sorted(before.keys() - after.keys()):
+        lines.append(f"{key[0]:<40} {key[1]:<24} only in baseline")
+    for key in sorted(after.keys() - before.keys()):
+        lines.append(f"{key[0]:<40} {key[1]:<24} new")
+    return lines, regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("current", type=Path)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+    lines, regressions = compare(
+        json.loads(args.baseline.read_text()), json.loads(args.current.read_text()), args.threshold
+    )
+    print("\n".join(lines))
+    print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
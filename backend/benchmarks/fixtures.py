@@ -0,0 +1,113 @@
+"""
+Synthetic input files for the benchmarks.
+
+Each size is an area in WGS84 longitude/latitude with an urban raster of
+the given shape and a monthly climate grid at the given resolution, from
+one region up to the whole globe. Fixtures are generated once per size and
+reused from the fixture directory on later runs.
+"""
+from pathlib import Path
+from typing import Dict, NamedTuple, Tuple
+import numpy as np
+import rasterio
+import xarray as xr
+from rasterio.transform import from_bounds
+
+
+class FixtureSize(NamedTuple):
+    bounds: Tuple[float, float, float, float]  # west, south, east, north
+    urban_shape: Tuple[int, int]  # rows, cols
+    climate_resolution: float  # degrees
+    years: Tuple[int, int]  # first, last (inclusive), monthly steps
+
+
+SIZES: Dict[str, FixtureSize] = {
+    "regional": FixtureSize((0.0, 40.0, 10.0, 50.0), (1024, 1024), 0.5, (2011, 2020)),
+    "continental": FixtureSize((-10.0, 30.0, 50.0, 70.0), (4096, 6144), 0.5, (2011, 2020)),
+    "global": FixtureSize((-180.0, -90.0, 180.0, 90.0), (8192, 16384), 0.5, (2011, 2020)),
+}
+
+# Year predicted by the benchmarks; within every fixture's time axis
+YEAR = 2020
+
+
+def _smooth_field(shape: Tuple[int, int], rng: np.random.Generator, cells: int = 16) -> np.ndarray:
+    """Values in 0-1 varying smoothly over `shape`, like settlement density or climate."""
+    coarse = rng.random((cells, cells))
+    rows = np.linspace(0, cells - 1, shape[0])
+    cols = np.linspace(0, cells - 1, shape[1])
+    r0 = np.minimum(rows.astype(int), cells - 2)
+    c0 = np.minimum(cols.astype(int), cells - 2)
+    fr = (rows - r0)[:, None]
+    fc = (cols - c0)[None, :]
+    return (
+        coarse[np.ix_(r0, c0)] * (1 - fr) * (1 - fc)
+        + coarse[np.ix_(r0 + 1, c0)] * fr * (1 - fc)
+        + coarse[np.ix_(r0, c0 + 1)] * (1 - fr) * fc
+        + coarse[np.ix_(r0 + 1, c0 + 1)] * fr * fc
+    )
+
+
+def write_urban(path: Path, size: FixtureSize, seed: int = 0):
+    """Urban share in percent (uint8), as a tiled, compressed GeoTIFF written in strips."""
+    rng = np.random.default_rng(seed)
+    height, width = size.urban_shape
+    density = _smooth_field((height, width), rng)
+    profile = {
+        "driver": "GTiff",
+        "height": height,
+        "width": width,
+        "count": 1,
+        "dtype": "uint8",
+        "crs": "EPSG:4326",
+        "transform": from_bounds(*size.bounds, width, height),
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "compress": "deflate",
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        for row in range(0, height, 1024):
+            rows = min(1024, height - row)
+            noise = rng.random((rows, width))
+            block = np.where(noise < density[row:row + rows] ** 3, noise * 100, 0)
+            dst.write(block.astype(np.uint8), 1, window=((row, row + rows), (0, width)))
+
+
+def write_climate(path: Path, size: FixtureSize, variable: str, seed: int = 0):
+    """Monthly values on a regular lat/lon grid (latitudes descending, like CRU)."""
+    rng = np.random.default_rng(seed)
+    west, south, east, north = size.bounds
+    step = size.climate_resolution
+    lat = np.arange(north - step / 2, south, -step)
+    lon = np.arange(west + step / 2, east, step)
+    time = np.arange(
+        np.datetime64(f"{size.years[0]}-01"), np.datetime64(f"{size.years[1] + 1}-01"), dtype="datetime64[M]"
+    ).astype("datetime64[ns]")
+    base = _smooth_field((lat.size, lon.size), rng) * 30.0
+    season = 10.0 * np.sin(2 * np.pi * np.arange(time.size) / 12.0)
+    values = (base[None] + season[:, None, None]).astype(np.float32)
+    values[:, rng.random((lat.size, lon.size)) < 0.3] = np.nan  # ocean
+    data = xr.Dataset(
+        {variable: (("time", "lat", "lon"), values)},
+        coords={"time": time, "lat": lat, "lon": lon},
+    )
+    data.to_netcdf(path)
+
+
+def ensure_fixtures(directory: Path, name: str) -> Dict[str, Path]:
+    """Paths of the urban, temperature and precipitation fixtures of a size, generating missing ones."""
+    size = SIZES[name]
+    directory.mkdir(exist_ok=True, parents=True)
+    paths = {
+        "urban": directory / f"{name}-urban.tif",
+        "temperature": directory / f"{name}-temperature.nc",
+        "precipitation": directory / f"{name}-precipitation.nc",
+    }
+    if not paths["urban"].exists():
+        write_urban(paths["urban"], size)
+    if not paths["temperature"].exists():
+        write_climate(paths["temperature"], size, "temperature", seed=1)
+    if not paths["precipitation"].exists():
+        write_climate(paths["precipitation"], size, "precipitation", seed=2)
+    return paths
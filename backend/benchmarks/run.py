@@ -0,0 +1,361 @@
+"""
+Benchmark the data pipeline and API hot paths on synthetic inputs.
+
+    python -m benchmarks.run                                 # regional and continental sizes
+    python -m benchmarks.run --sizes regional --repeat 5 --cases process_urban,to_json
+    python -m benchmarks.run --compare benchmarks/results/baseline.json
+
+Run from the backend directory. Fixtures are generated on first use (see
+benchmarks/fixtures.py). Each benchmark is repeated and reports wall time
+and peak memory allocated while it ran (Python and NumPy allocations, as
+seen by tracemalloc; GDAL/netCDF caches are not included). Results are
+written as JSON to benchmarks/results/ unless --output is given; with
+--compare, they are compared against an earlier run and the exit status is
+1 if anything regressed (see benchmarks/compare.py).
+
+The app runs in a temporary working directory, so uploads, caches and the
+job queue of the benchmark do not touch the ones of a development setup.
+The end-to-end benchmark starts benchmarks/stub_model.py with uvicorn in
+place of the model service.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import socket
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+from benchmarks.fixtures import SIZES, YEAR, ensure_fixtures
+from benchmarks.compare import DEFAULT_THRESHOLD, compare
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+FIXTURE_DIR = BACKEND_DIR / "benchmarks" / "fixture-data"
+RESULTS_DIR = BACKEND_DIR / "benchmarks" / "results"
+DEFAULT_SIZES = ("regional", "continental")
+
+
+class Benchmark:
+    """Runs cases, each repeated, and collects their timings and peak memory."""
+    
+    def __init__(self, repeat: int, cases: Optional[List[str]] = None):
+        self.repeat = repeat
+        self.cases = cases
+        self.results: List[Dict[str, Any]] = []
+    
+    def wanted(self, name: str) -> bool:
+        return not self.cases or any(case in name for case in self.cases)
+    
+    def measure(
+        self,
+        name: str,
+        size: str,
+        fn: Callable[[], Any],
+        setup: Optional[Callable[[], None]] = None,
+        teardown: Optional[Callable[[Any], None]] = None,
+        **params,
+    ):
+        if not self.wanted(name):
+            return
+        seconds, peaks = [], []
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            gc.collect()
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            if teardown:
+                teardown(result)
+            del result
+            seconds.append(elapsed)
+            peaks.append(peak)
+        entry = {
+            "name": name,
+            "size": size,
+            "params": params,
+            "seconds": seconds,
+            "min_seconds": min(seconds),
+            "median_seconds": statistics.median(seconds),
+            "peak_memory_mb": max(peaks) / 2 ** 20,
+        }
+        self.results.append(entry)
+        print(f"{name:<40} {size:<24} {entry['median_seconds']:>9.4f} s {entry['peak_memory_mb']:>9.1f} MB", flush=True)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_stub_model(port: int) -> subprocess.Popen:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(BACKEND_DIR), os.environ.get("PYTHONPATH")]))}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.stub_model:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Stub model service did not start")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _center_bounds(name: str):
+    """Bounds of the middle quarter of a fixture's area."""
+    from app.models.schemas import RegionBounds
+    west, south, east, north = SIZES[name].bounds
+    dx, dy = (east - west) / 4, (north - south) / 4
+    return RegionBounds(north=north - dy, south=south + dy, east=east - dx, west=west + dx)
+
+
+def run_size(bench: Benchmark, loop: asyncio.AbstractEventLoop, name: str, fixtures: Dict[str, Path]):
+    """All in-process benchmarks for one fixture size."""
+    from fastapi import UploadFile
+    from app.services.data_processor import DataProcessor
+    from app.services.file_handler import FileHandler
+    from app.utils.array_codec import HAS_ZSTD, encode_model_input, to_json_compatible
+    from app.utils.validation import read_netcdf_metadata, read_tiff_metadata
+    
+    run = loop.run_until_complete
+    
+    def upload(path: Path, subdirectory: str):
+        with open(path, "rb") as f:
+            return run(FileHandler.save_upload_file(UploadFile(file=f, filename=path.name), subdirectory))
+    
+    def delete(saved):
+        FileHandler.delete_file(saved.file_id, "benchmark")
+    
+    for kind, path in fixtures.items():
+        bench.measure(
+            "save_upload_file", f"{name}/{kind}", lambda: upload(path, "benchmark"), teardown=delete,
+            bytes=path.stat().st_size,
+        )
+    
+    # Uploads as the pipeline sees them, with their metadata sidecars
+    urban = upload(fixtures["urban"], "urban")
+    FileHandler.save_file_metadata(urban.path, run(read_tiff_metadata(urban.path)))
+    climate = {}
+    for variable in ("temperature", "precipitation"):
+        climate[variable] = upload(fixtures[variable], "climate")
+        FileHandler.save_file_metadata(climate[variable].path, run(read_netcdf_metadata(climate[variable].path)))
+    region = _center_bounds(name)
+    
+    bench.measure(
+        "process_urban_data", name, lambda: run(DataProcessor.process_urban_data(urban.path)), extent="full",
+    )
+    bench.measure(
+        "process_urban_data", name + "/region",
+        lambda: run(DataProcessor.process_urban_data(urban.path, bounds=region)), extent="center quarter",
+    )
+    if bench.wanted("process_urban_data_cached"):
+        run(DataProcessor.process_urban_data(urban.path, cache_key=urban.checksum))
+    bench.measure(
+        "process_urban_data_cached", name,
+        lambda: run(DataProcessor.process_urban_data(urban.path, cache_key=urban.checksum)), extent="full",
+    )
+    bench.measure(
+        "process_climate_data", name,
+        lambda: run(DataProcessor.process_climate_data(climate["temperature"].path, "temperature", year=YEAR)),
+        extent="full", year=YEAR,
+    )
+    bench.measure(
+        "process_climate_data", name + "/region",
+        lambda: run(DataProcessor.process_climate_data(
+            climate["temperature"].path, "temperature", bounds=region, year=YEAR
+        )),
+        extent="center quarter", year=YEAR,
+    )
+    
+    needs_inputs = any(bench.wanted(case) for case in (
+        "segment_global_data", "prepare_model_input", "encode_model_input", "to_json_compatible"
+    ))
+    if not needs_inputs:
+        return
+    urban_data = run(DataProcessor.process_urban_data(urban.path))
+    temp_data = run(DataProcessor.process_climate_data(climate["temperature"].path, "temperature", year=YEAR))
+    prec_data = run(DataProcessor.process_climate_data(climate["precipitation"].path, "precipitation", year=YEAR))
+    
+    for segment_size, overlap in ((32, 0), (256, 16)):
+        bench.measure(
+            "segment_global_data", f"{name}/{segment_size}",
+            lambda: DataProcessor.segment_global_data(
+                urban_data["data"], segment_size, skip_nodata=True, nodata=0, overlap=overlap
+            ),
+            segment_size=segment_size, overlap=overlap,
+        )
+    
+    bench.measure(
+        "prepare_model_input", name,
+        lambda: DataProcessor.prepare_model_input(urban_data, temp_data, prec_data),
+    )
+    model_input = DataProcessor.prepare_model_input(urban_data, temp_data, prec_data)
+    bench.measure(
+        "encode_model_input", name,
+        lambda: sum(len(chunk) for chunk in encode_model_input(model_input)[0]), compression=None,
+    )
+    if HAS_ZSTD:
+        bench.measure(
+            "encode_model_input_zstd", name,
+            lambda: sum(len(chunk) for chunk in encode_model_input(model_input, "zstd")[0]), compression="zstd",
+        )
+    if name == "regional" and bench.cases:
+        # The JSON fallback takes seconds even for the smallest size; run it only on request
+        bench.measure(
+            "to_json_compatible", name, lambda: len(json.dumps(to_json_compatible(model_input))),
+        )
+
+
+def run_end_to_end(bench: Benchmark, name: str, fixtures: Dict[str, Path], timeout: float):
+    """POST /api/predictions through completion, against the stub model service."""
+    if not bench.wanted("post_prediction"):
+        return
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services.array_cache import CACHE_DIR
+    from app.services.regridding import REGRID_CACHE_DIR
+    from app.services.tile_cache import TILE_RESULT_CACHE_DIR
+    
+    def clear_caches():
+        for directory in (CACHE_DIR, REGRID_CACHE_DIR, TILE_RESULT_CACHE_DIR):
+            shutil.rmtree(directory, ignore_errors=True)
+    
+    with TestClient(app) as client:
+        ids = {}
+        for kind, subdirectory, form in (
+            ("urban", "urban", {}),
+            ("temperature", "climate", {"type": "temperature"}),
+            ("precipitation", "climate", {"type": "precipitation"}),
+        ):
+            with open(fixtures[kind], "rb") as f:
+                response = client.post(f"/api/upload/{subdirectory}", files={"file": (fixtures[kind].name, f)}, data=form)
+            response.raise_for_status()
+            ids[kind] = response.json()["id"]
+        request = {
+            "urbanDataId": ids["urban"],
+            "temperatureDataId": ids["temperature"],
+            "precipitationDataId": ids["precipitation"],
+            "year": YEAR,
+        }
+        
+        def predict():
+            prediction = client.post("/api/predictions", json=request).json()
+            deadline = time.time() + timeout
+            while prediction["status"] in ("pending", "processing"):
+                if time.time() > deadline:
+                    raise RuntimeError(f"Prediction did not complete within {timeout} s")
+                time.sleep(0.02)
+                prediction = client.get(f"/api/predictions/{prediction['id']}").json()
+            if prediction["status"] != "completed":
+                raise RuntimeError(f"Prediction {prediction['status']}: {prediction.get('error')}")
+            return prediction
+        
+        bench.measure("post_prediction", name, predict, setup=clear_caches, caches="cold")
+        bench.measure("post_prediction_warm", name, predict, caches="warm")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(DEFAULT_SIZES), help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cases", default="", help="comma-separated substrings of benchmark names to run")
+    parser.add_argument("--output", type=Path, help="result file (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--fixtures", type=Path, default=FIXTURE_DIR)
+    parser.add_argument("--compare", type=Path, help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds per end-to-end prediction")
+    args = parser.parse_args(argv)
+    
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"Unknown sizes: {', '.join(unknown)}")
+    output = (args.output or RESULTS_DIR / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json").resolve()
+    fixture_dir = args.fixtures.resolve()
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    
+    fixtures = {}
+    for size in sizes:
+        print(f"Preparing {size} fixtures...", flush=True)
+        fixtures[size] = ensure_fixtures(fixture_dir, size)
+    
+    workdir = Path(tempfile.mkdtemp(prefix="urban-benchmark-"))
+    port = _free_port()
+    os.chdir(workdir)
+    os.environ.update({
+        "URBAN_MODEL_SERVICE_URL": f"http://127.0.0.1:{port}",
+        # Thread pool, so decoding shows up in the measured memory
+        "DECODE_EXECUTOR": "thread",
+        # Every request is computed; identical ones are not served from the memo
+        "PREDICTION_MEMO_TTL": "0",
+        "WORKER_POLL_INTERVAL": os.environ.get("WORKER_POLL_INTERVAL", "0.02"),
+    })
+    bench = Benchmark(args.repeat, [case.strip() for case in args.cases.split(",") if case.strip()])
+    stub = _start_stub_model(port) if bench.wanted("post_prediction") else None
+    loop = asyncio.new_event_loop()
+    try:
+        for size in sizes:
+            run_size(bench, loop, size, fixtures[size])
+            run_end_to_end(bench, size, fixtures[size], args.timeout)
+    finally:
+        loop.close()
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "sizes": sizes,
+            "repeat": args.repeat,
+        },
+        "results": bench.results,
+    }
+    output.parent.mkdir(exist_ok=True, parents=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+    
+    if baseline is not None:
+        lines, regressions = compare(baseline, results, args.threshold)
+        print("\n" + "\n".join(lines))
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
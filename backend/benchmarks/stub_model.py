@@ -0,0 +1,36 @@
+"""
+Stand-in for the URBAN model service, for end-to-end benchmarks.
+
+Accepts the binary wire format and the JSON fallback on POST /predict and
+returns a prediction map with the shape of the urban input, so the
+benchmark measures the backend rather than the model. Run it with
+``uvicorn benchmarks.stub_model:app --port 8001``.
+"""
+import numpy as np
+from fastapi import FastAPI, Request, Response
+from app.utils.array_codec import CONTENT_TYPE, decode_model_input, encode_model_input
+
+app = FastAPI(title="URBAN model stub")
+
+
+@app.post("/predict")
+async def predict(request: Request):
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith(CONTENT_TYPE):
+        model_input = decode_model_input(body)
+    else:
+        model_input = await request.json()
+    urban = np.asarray(model_input["urban_expansion"]["data"], dtype=np.float32)
+    chunks, _ = encode_model_input({
+        "prediction": (1.0 - urban) * 5.0,
+        "mae": 0.37,
+        "rmse": 0.69,
+        "mse": 0.47,
+        "confidence": 0.9,
+    })
+    return Response(b"".join(bytes(chunk) for chunk in chunks), media_type=CONTENT_TYPE)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "healthy"}
@@ -0,0 +1,68 @@
+import json
+import numpy as np
+import pytest
+from app.utils.array_codec import MAGIC, decode_model_input, encode_model_input, to_json_compatible
+
+
+def _model_input():
+    return {
+        'urban_expansion': {
+            'data': np.arange(12, dtype=np.float32).reshape(3, 4),
+            'transform': [0.5, 0.0, 10.0, 0.0, -0.5, 50.0],
+            'crs': "EPSG:4326",
+        },
+        'temperature': {
+            # Not C-contiguous, and big-endian
+            'data': np.arange(24, dtype=">f8").reshape(2, 3, 4)[:, ::-1, ::2],
+            'years': [np.int64(2030), np.int64(2031)],
+        },
+        'masks': [np.array([[True, False]]), np.zeros((0, 5), dtype=np.int16)],
+        'scale': np.float32(0.5),
+        'historical_yields': None,
+    }
+
+
+def _assert_round_trip(decoded, original):
+    if isinstance(original, np.ndarray):
+        assert isinstance(decoded, np.ndarray)
+        assert decoded.dtype == original.dtype
+        np.testing.assert_array_equal(decoded, original)
+    elif isinstance(original, dict):
+        assert set(decoded) == set(original)
+        for key in original:
+            _assert_round_trip(decoded[key], original[key])
+    elif isinstance(original, (list, tuple)):
+        assert len(decoded) == len(original)
+        for value, expected in zip(decoded, original):
+            _assert_round_trip(value, expected)
+    elif isinstance(original, np.generic):
+        assert decoded == original.item()
+    else:
+        assert decoded == original
+
+
+@pytest.mark.parametrize("compression", [None, "zstd"])
+def test_round_trip(compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    model_input = _model_input()
+    chunks, length = encode_model_input(model_input, compression)
+    payload = b"".join(bytes(chunk) for chunk in chunks)
+    assert len(payload) == length
+    assert payload.startswith(MAGIC)
+    _assert_round_trip(decode_model_input(payload), model_input)
+
+
+def test_unknown_payloads_are_rejected():
+    with pytest.raises(ValueError):
+        decode_model_input(b'{"data": []}')
+    with pytest.raises(ValueError):
+        encode_model_input({}, "gzip")
+
+
+def test_json_fallback_matches_the_binary_document():
+    model_input = _model_input()
+    chunks, _ = encode_model_input(model_input)
+    decoded = decode_model_input(b"".join(bytes(chunk) for chunk in chunks))
+    # Both transports describe the same document
+    assert json.loads(json.dumps(to_json_compatible(model_input))) == to_json_compatible(decoded)
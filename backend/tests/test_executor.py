@@ -0,0 +1,26 @@
+import asyncio
+import numpy as np
+from app.services.executor import BlockingExecutor, SHARED_MEMORY_MIN_BYTES
+
+
+def _nested_result(size: int):
+    array = np.arange(size, dtype=np.float64)
+    return [
+        {'data': array, 'shape': array.shape, 'nested': {'grid': array * 2, 'small': np.ones(3)}},
+        None,
+    ]
+
+
+def test_process_pool_returns_nested_arrays():
+    size = SHARED_MEMORY_MIN_BYTES // 8 + 1
+    executor = BlockingExecutor(mode="process", workers=1)
+    try:
+        result = asyncio.run(executor.run(_nested_result, size))
+    finally:
+        executor.shutdown()
+    expected = _nested_result(size)
+    assert result[1] is None
+    assert result[0]['shape'] == expected[0]['shape']
+    np.testing.assert_array_equal(result[0]['data'], expected[0]['data'])
+    np.testing.assert_array_equal(result[0]['nested']['grid'], expected[0]['nested']['grid'])
+    np.testing.assert_array_equal(result[0]['nested']['small'], expected[0]['nested']['small'])
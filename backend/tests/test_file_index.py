@@ -0,0 +1,16 @@
+from app.services.file_index import FileIndex
+
+
+def test_misses_do_not_match_other_uploads(tmp_path):
+    upload_dir = tmp_path / "uploads"
+    (upload_dir / "urban").mkdir(parents=True)
+    (upload_dir / "urban" / "abc.tif").write_bytes(b"data")
+    index = FileIndex(upload_dir, upload_dir / "blobs")
+    index.load()
+
+    assert index.get("abc", "urban").path.endswith("abc.tif")
+    assert index.get("abc", "climate") is None
+    for file_id in ("*", "a?c", "ab*"):
+        assert index.get(file_id) is None
+    # Nothing was recorded for the misses
+    assert [record.file_id for record in FileIndex(upload_dir, upload_dir / "blobs").records()] == ["abc"]
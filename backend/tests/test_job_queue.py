@@ -0,0 +1,192 @@
+import uuid
+from datetime import datetime
+import pytest
+from app.models.schemas import PredictionRequest, PredictionResponse, PredictionStatus, PredictionTimings
+from app.services.job_queue import JobQueue
+from app.services.metrics import stage_seconds
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(tmp_path / "jobs.db")
+
+
+def _enqueue(queue: JobQueue, max_attempts: int = 3) -> str:
+    request = PredictionRequest(
+        urbanDataId="urban", temperatureDataId="temp", precipitationDataId="prec", year=2030
+    )
+    response = PredictionResponse(
+        id=str(uuid.uuid4()), status=PredictionStatus.pending, createdAt=datetime.utcnow().isoformat()
+    )
+    return queue.enqueue(request, response, max_attempts=max_attempts).id
+
+
+def _status(queue: JobQueue, job_id: str) -> PredictionStatus:
+    # The queue's status column; the stored response says `processing` only once a worker saves it
+    (status,) = queue.stats()
+    assert queue.get(job_id) is not None
+    return PredictionStatus(status)
+
+
+def test_claim_and_complete(queue):
+    job_id = _enqueue(queue)
+    job = queue.claim("worker-a")
+    assert job.id == job_id
+    assert job.attempts == 1
+    assert _status(queue, job_id) == PredictionStatus.processing
+    assert queue.claim("worker-b") is None
+
+    response = queue.get(job_id)
+    response.status = PredictionStatus.completed
+    assert queue.complete(job_id, "worker-a", response)
+    assert _status(queue, job_id) == PredictionStatus.completed
+    assert queue.claim("worker-b") is None
+
+
+def test_writes_require_the_lease(queue):
+    job_id = _enqueue(queue)
+    queue.claim("worker-a")
+    response = queue.get(job_id)
+    response.status = PredictionStatus.processing
+    response.progress = 0.5
+    assert not queue.save(response, "worker-b")
+    assert queue.save(response, "worker-a")
+
+    response.status = PredictionStatus.completed
+    assert not queue.complete(job_id, "worker-b", response)
+    assert not queue.fail(job_id, "worker-b", "error")
+    assert _status(queue, job_id) == PredictionStatus.processing
+    assert queue.get(job_id).progress == 0.5
+
+
+def test_expired_lease_is_reclaimed(queue):
+    job_id = _enqueue(queue)
+    queue.claim("worker-a", lease_seconds=-1)
+
+    job = queue.claim("worker-b")
+    assert job.id == job_id
+    assert job.attempts == 2
+    # The first worker lost the job and can no longer write to it
+    assert not queue.heartbeat(job_id, "worker-a")
+    response = queue.get(job_id)
+    response.status = PredictionStatus.completed
+    assert not queue.complete(job_id, "worker-a", response)
+    assert queue.heartbeat(job_id, "worker-b")
+    assert queue.complete(job_id, "worker-b", response)
+    assert _status(queue, job_id) == PredictionStatus.completed
+
+
+def test_expired_lease_without_attempts_left_fails(queue):
+    job_id = _enqueue(queue, max_attempts=1)
+    queue.claim("worker-a", lease_seconds=-1)
+
+    assert queue.claim("worker-b") is None
+    response = queue.get(job_id)
+    assert response.status == PredictionStatus.failed
+    assert response.error
+
+
+def test_failed_attempts_are_retried(queue):
+    job_id = _enqueue(queue, max_attempts=2)
+    queue.claim("worker-a")
+    assert queue.fail(job_id, "worker-a", "first error")
+    assert _status(queue, job_id) == PredictionStatus.pending
+
+    job = queue.claim("worker-b")
+    assert job.attempts == 2
+    assert not queue.fail(job_id, "worker-b", "second error")
+    response = queue.get(job_id)
+    assert response.status == PredictionStatus.failed
+    assert response.error == "second error"
+    assert response.completedAt is not None
+    assert queue.claim("worker-c") is None
+
+
+def test_cancel_pending(queue):
+    job_id = _enqueue(queue)
+    assert queue.cancel(job_id).status == PredictionStatus.cancelled
+    assert _status(queue, job_id) == PredictionStatus.cancelled
+    assert queue.claim("worker-a") is None
+    assert queue.cancel("missing") is None
+
+
+def test_cancel_running(queue):
+    job_id = _enqueue(queue)
+    queue.claim("worker-a")
+    assert queue.cancel(job_id).status == PredictionStatus.processing
+
+    # The worker sees the request at its next save or heartbeat and records the cancellation
+    response = queue.get(job_id)
+    response.status = PredictionStatus.processing
+    assert not queue.save(response, "worker-a")
+    assert not queue.heartbeat(job_id, "worker-a")
+    queue.mark_cancelled(job_id)
+    assert _status(queue, job_id) == PredictionStatus.cancelled
+    assert not queue.fail(job_id, "worker-a", "stopped")
+    assert _status(queue, job_id) == PredictionStatus.cancelled
+
+
+def test_mark_cancelled_after_lost_lease_is_ignored(queue):
+    job_id = _enqueue(queue)
+    queue.claim("worker-a", lease_seconds=-1)
+    queue.claim("worker-b")
+
+    queue.mark_cancelled(job_id)
+    assert _status(queue, job_id) == PredictionStatus.processing
+
+
+def test_release_returns_job_to_queue(queue):
+    job_id = _enqueue(queue)
+    queue.claim("worker-a")
+    queue.release(job_id, "worker-b")
+    assert _status(queue, job_id) == PredictionStatus.processing
+
+    queue.release(job_id, "worker-a")
+    assert _status(queue, job_id) == PredictionStatus.pending
+    job = queue.claim("worker-b")
+    assert job.id == job_id
+    # Released, not failed: the attempt does not count
+    assert job.attempts == 1
+
+
+def test_release_during_last_attempt_keeps_job_claimable(queue):
+    job_id = _enqueue(queue, max_attempts=1)
+    queue.claim("worker-a")
+    queue.release(job_id, "worker-a")
+
+    job = queue.claim("worker-b")
+    assert job is not None and job.id == job_id
+    assert job.attempts == 1
+
+
+def test_completed_timings_are_shared(queue):
+    job_id = _enqueue(queue)
+    queue.claim("worker-a")
+    response = queue.get(job_id)
+    response.status = PredictionStatus.completed
+    response.timings = PredictionTimings(total=2.0, stages={"model": 1.5}, bytesRead=0)
+    assert not queue.complete(job_id, "worker-b", response)
+    assert queue.complete(job_id, "worker-a", response)
+
+    # Another process reading the same database reports the job's timings
+    JobQueue(queue.db_path).load_timing_histograms()
+    samples = {(name, labels): value for name, labels, value in stage_seconds.samples()}
+    assert samples[("urban_prediction_stage_seconds_count", '{stage="model"}')] == 1
+    assert samples[("urban_prediction_stage_seconds_sum", '{stage="model"}')] == 1.5
+    assert samples[("urban_prediction_stage_seconds_bucket", '{stage="model",le="1"}')] == 0
+    assert samples[("urban_prediction_stage_seconds_bucket", '{stage="model",le="2.5"}')] == 1
+
+
+def test_requests_queued_before_the_overlap_limit_are_still_claimed(queue):
+    # Built without validation, like a request stored before tileOverlap was bounded
+    request = PredictionRequest.model_construct(
+        urbanDataId="urban", temperatureDataId="temp", precipitationDataId="prec", year=2030,
+        tileSize=128, tileOverlap=100,
+    )
+    response = PredictionResponse(
+        id=str(uuid.uuid4()), status=PredictionStatus.pending, createdAt=datetime.utcnow().isoformat()
+    )
+    queue.enqueue(request, response)
+    job = queue.claim("worker")
+    assert job.request.tileOverlap == 100
+    assert queue.get_request(response.id).tileOverlap == 100
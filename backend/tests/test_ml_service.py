@@ -0,0 +1,52 @@
+import asyncio
+import httpx
+import numpy as np
+from app.services.ml_service import MLService
+from app.utils.array_codec import CONTENT_TYPE
+
+
+def _service(binary_hosts):
+    """An MLService whose model hosts accept the binary format only if listed in `binary_hosts`."""
+    received = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        binary = request.headers.get("content-type", "").startswith(CONTENT_TYPE)
+        received.append((request.url.host, "binary" if binary else "json"))
+        if binary and request.url.host not in binary_hosts:
+            return httpx.Response(415)
+        return httpx.Response(200, json={"prediction": 1.0})
+
+    service = MLService()
+    service.transport = "binary"
+    service.max_retries = 0
+    service._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return service, received
+
+
+def _predict(service, host):
+    service.model_service_url = f"http://{host}"
+    return asyncio.run(service.predict({'data': np.ones((2, 2), dtype=np.float32)}))
+
+
+def test_rejected_binary_falls_back_to_json_for_that_host_only():
+    service, received = _service(binary_hosts={"modern"})
+    assert _predict(service, "legacy") == {"prediction": 1.0}
+    assert received == [("legacy", "binary"), ("legacy", "json")]
+    # The shared service keeps its configured transport
+    assert service.transport == "binary"
+
+    received.clear()
+    _predict(service, "legacy")
+    _predict(service, "modern")
+    assert received == [("legacy", "json"), ("modern", "binary")]
+
+
+def test_json_fallback_expires():
+    service, received = _service(binary_hosts=set())
+    service.json_fallback_seconds = 0
+    _predict(service, "legacy")
+    received.clear()
+    # Binary is tried again once the fallback has expired
+    _predict(service, "legacy")
+    assert received == [("legacy", "binary"), ("legacy", "json")]
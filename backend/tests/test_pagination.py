@@ -0,0 +1,125 @@
+import json
+import base64
+from datetime import datetime
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from app.api.routes import predictions
+from app.main import app
+from app.models.schemas import PredictionRequest, PredictionResponse, PredictionStatus
+from app.services.job_queue import JobQueue
+from app.utils.pagination import NDJSON_MEDIA_TYPE, decode_cursor, encode_cursor, parse_csv, project
+
+
+def _raw_cursor(payload: str) -> str:
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _response(index: int) -> PredictionResponse:
+    return PredictionResponse(
+        id=f"p{index}", status=PredictionStatus.pending,
+        createdAt=datetime(2030, 1, 1, 0, 0, index).isoformat(),
+    )
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    queue = JobQueue(tmp_path / "jobs.db")
+    request = PredictionRequest(
+        urbanDataId="urban", temperatureDataId="temp", precipitationDataId="prec", year=2030
+    )
+    for index in range(5):
+        queue.enqueue(request, _response(index))
+    monkeypatch.setattr(predictions, "job_queue", queue)
+    # Not entered as a context manager, so no prediction workers are started
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("key,types", [
+    ((1893456000.25, "p1"), (float, str)),
+    (("2030-01-01T00:00:00", "ü/+="), (str, str)),
+])
+def test_cursor_round_trip(key, types):
+    cursor = encode_cursor(key)
+    assert "=" not in cursor
+    assert decode_cursor(cursor, types) == key
+
+
+def test_float_cursor_values_accept_integers():
+    assert decode_cursor(encode_cursor((12, "p1")), (float, str)) == (12.0, "p1")
+    assert decode_cursor(None, (float, str)) is None
+
+
+@pytest.mark.parametrize("cursor", [
+    "!!!",
+    "a",
+    "é",
+    _raw_cursor("[1,"),
+    _raw_cursor('{"a":1}'),
+    _raw_cursor('["a","x"]'),
+    _raw_cursor('[1]'),
+    _raw_cursor('[true,"x"]'),
+    _raw_cursor('[NaN,"x"]'),
+    _raw_cursor('[1e999,"x"]'),
+    _raw_cursor(json.dumps([10 ** 400, "x"])),
+    _raw_cursor("[" * 100000),
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, (float, str))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("format", ["json", "ndjson"])
+@pytest.mark.parametrize("cursor", ["a", _raw_cursor('[1e999,"x"]'), _raw_cursor('[1,2]')])
+def test_malformed_cursor_is_a_400(client, cursor, format):
+    for url in ("/api/predictions", "/api/scenarios"):
+        response = client.get(url, params={"cursor": cursor, "format": format})
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_large_integer_cursor_is_compared_as_a_float(client):
+    # Passed to SQLite as an integer, this overflowed into a 500
+    cursor = _raw_cursor(json.dumps([10 ** 30, "x"]))
+    for format in ("json", "ndjson"):
+        response = client.get("/api/predictions", params={"cursor": cursor, "format": format})
+        assert response.status_code == 200
+    assert response.text == ""
+
+
+def test_parse_csv():
+    assert parse_csv(None) is None
+    assert parse_csv("") is None
+    assert parse_csv(" id, status ,,id ") == {"id", "status"}
+
+
+def test_project_keeps_only_selected_fields():
+    response = _response(1)
+    assert project(response, {"id", "status"}) == {"id": "p1", "status": "pending"}
+    assert project(response, None) == response.model_dump(mode="json")
+
+
+def test_pages_follow_the_cursor(client):
+    seen = []
+    cursor = None
+    while True:
+        page = client.get("/api/predictions", params={"limit": 2, "cursor": cursor, "fields": "id"}).json()
+        assert all(set(item) == {"id"} for item in page["items"])
+        seen += [item["id"] for item in page["items"]]
+        cursor = page["nextCursor"]
+        if cursor is None:
+            break
+    assert seen == [f"p{index}" for index in range(5)]
+
+
+def test_ndjson_streams_one_object_per_line(client):
+    response = client.get("/api/predictions", params={"format": "ndjson", "fields": "id,status"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(NDJSON_MEDIA_TYPE)
+    lines = response.text.splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"id": f"p{index}", "status": "pending"} for index in range(5)
+    ]
+    limited = client.get("/api/predictions", params={"format": "ndjson", "limit": 3, "fields": "id"})
+    assert [json.loads(line)["id"] for line in limited.text.splitlines()] == ["p0", "p1", "p2"]
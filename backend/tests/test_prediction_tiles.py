@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from app.api.routes import predictions
+from app.main import app
+from app.services.executor import BlockingExecutor
+from app.services.raster_store import PredictionRasterStore
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    store = PredictionRasterStore(tmp_path / "results")
+    data = np.linspace(0, 1, 512 * 512, dtype=np.float32).reshape(512, 512)
+    store.save("p1", data, [0.0, 0.0, 10.0, 10.0], "EPSG:4326")
+    executor = BlockingExecutor(mode="process", workers=1)
+    monkeypatch.setattr(predictions, "raster_store", store)
+    monkeypatch.setattr(predictions, "decode_executor", executor)
+    # Not entered as a context manager, so no prediction workers are started
+    yield TestClient(app)
+    executor.shutdown()
+
+
+def test_tiles_render_on_a_process_pool(client):
+    info = client.get("/api/predictions/p1/tiles.json")
+    assert info.status_code == 200
+    z = info.json()["maxzoom"]
+    # The tile over (5°E, 5°N) at the raster's native zoom
+    x = int((5 + 180) / 360 * 2 ** z)
+    y = int((1 - np.log(np.tan(np.radians(5)) + 1 / np.cos(np.radians(5))) / np.pi) / 2 * 2 ** z)
+    tile = client.get(f"/api/predictions/p1/tiles/{z}/{x}/{y}.png")
+    assert tile.status_code == 200
+    assert tile.content.startswith(b"\x89PNG")
+    # Served from the tile cache the second time, with the same ETag
+    again = client.get(f"/api/predictions/p1/tiles/{z}/{x}/{y}.png")
+    assert again.content == tile.content
+    assert again.headers["etag"] == tile.headers["etag"]
+
+
+def test_tile_coordinates_are_bounded(client):
+    assert client.get("/api/predictions/p1/tiles/1000000000/0/0.png").status_code == 400
+    assert client.get("/api/predictions/p1/tiles/-1/0/0.png").status_code == 400
+    assert client.get("/api/predictions/p1/tiles/2/4/0.png").status_code == 400
+    assert client.get("/api/predictions/p1/tiles/29/0/0.png").status_code == 400
+    assert client.get("/api/predictions/missing/tiles/0/0/0.png").status_code == 404
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from app.services import regridding
+from app.services.regridding import Grid, IndexMap, Regridder, align_model_input, build_index_map
+
+# 0.5° cells over 0-20°E, 40-60°N, north-up
+SOURCE = Grid.from_transform([0.5, 0, 0, 0, -0.5, 60], (40, 40), "EPSG:4326")
+# A finer Web Mercator grid inside it (about 2-18°E, 42-58°N)
+MERCATOR = Grid.from_transform([20000, 0, 222639, 0, -20000, 7967000], (90, 80), "EPSG:3857")
+UTM = Grid.from_transform([20000, 0, 300000, 0, -20000, 6400000], (60, 50), "EPSG:32633")
+
+
+def _dense(index_map: IndexMap) -> IndexMap:
+    """The same map with full (H, W) arrays, which takes the non-separable path."""
+    shape = np.broadcast_shapes(index_map.rows.shape, index_map.cols.shape)
+    rows, cols, wy, wx = (
+        np.ascontiguousarray(np.broadcast_to(array, shape))
+        for array in (index_map.rows, index_map.cols, index_map.wy, index_map.wx)
+    )
+    return IndexMap(rows, cols, wy, wx, index_map.source_shape)
+
+
+@pytest.fixture
+def data():
+    values = np.random.default_rng(0).uniform(0, 1, (3,) + SOURCE.shape).astype(np.float32)
+    values[:, 5:8, 10:12] = np.nan
+    return values
+
+
+def test_separable_map_matches_dense(data):
+    target = Grid.from_transform([0.3, 0, 1, 0, -0.3, 59], (60, 55), "EPSG:4326")
+    index_map = build_index_map(SOURCE, target)
+    assert index_map.rows.shape == (60, 1) and index_map.cols.shape == (1, 55)
+    np.testing.assert_allclose(index_map.apply(data), _dense(index_map).apply(data), rtol=1e-5, equal_nan=True)
+
+
+def test_reprojection_to_mercator_is_separable(data, monkeypatch):
+    index_map = build_index_map(SOURCE, MERCATOR)
+    assert index_map.rows.shape == (90, 1) and index_map.cols.shape == (1, 80)
+    # Force the dense path and compare
+    monkeypatch.setattr(regridding, "_SEPARABLE_TOLERANCE", -1.0)
+    dense = build_index_map(SOURCE, MERCATOR)
+    assert dense.rows.shape == (90, 80)
+    np.testing.assert_allclose(index_map.apply(data), dense.apply(data), rtol=1e-4, equal_nan=True)
+
+
+def test_reprojection_to_utm_is_dense():
+    index_map = build_index_map(SOURCE, UTM)
+    assert index_map.rows.shape == UTM.shape and index_map.cols.shape == UTM.shape
+
+
+def test_index_maps_round_trip_through_the_disk_cache(tmp_path, data):
+    # No memory cache, so the second lookup reads the .npz file
+    regridder = Regridder(tmp_path, memory_bytes=0)
+    built = regridder.index_map(SOURCE, UTM)
+    assert (regridder.hits, regridder.misses) == (0, 1)
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+    loaded = regridder.index_map(SOURCE, UTM)
+    assert (regridder.hits, regridder.misses) == (1, 1)
+    for name in ("rows", "cols", "wy", "wx"):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(built, name))
+    assert loaded.source_shape == built.source_shape
+    np.testing.assert_array_equal(loaded.apply(data), built.apply(data))
+
+
+def test_memory_cache_is_bounded_by_bytes(tmp_path):
+    dense = build_index_map(SOURCE, UTM)
+    regridder = Regridder(tmp_path, memory_bytes=dense.nbytes + 1)
+    regridder.index_map(SOURCE, UTM)
+    regridder.index_map(SOURCE, MERCATOR)
+    # Adding the second map evicts the first
+    assert regridder.memory_used <= regridder.memory_bytes
+    assert len(regridder._maps) == 1
+    regridder.index_map(SOURCE, MERCATOR)
+    assert regridder.hits == 1
+
+
+def test_align_model_input_resamples_onto_the_urban_grid(tmp_path):
+    urban_transform = [0.25, 0, 2, 0, -0.25, 58]
+    urban = {
+        'data': np.zeros((64, 48), dtype=np.float32),
+        'transform': urban_transform,
+        'crs': "EPSG:4326",
+        'bounds': [2, 42, 14, 58],
+    }
+    # A linear field, which bilinear interpolation reproduces exactly
+    lon, lat = SOURCE.x, SOURCE.y
+    temperature = {
+        'data': (lon[None, :] + 2 * lat[:, None]).astype(np.float32),
+        'lon': lon.tolist(),
+        'lat': lat.tolist(),
+        'crs': "EPSG:4326",
+    }
+    aligned = align_model_input(
+        {'urban_expansion': urban, 'temperature': temperature, 'precipitation': None},
+        mode="urban",
+        regridder=Regridder(tmp_path),
+    )
+    assert aligned['urban_expansion'] is urban
+    assert aligned['precipitation'] is None
+    result = aligned['temperature']
+    assert result['data'].shape == (64, 48)
+    assert result['transform'] == urban_transform
+    assert result['bounds'] == [2, 42, 14, 58]
+    assert 'lat' not in result and 'lon' not in result
+    target = Grid.from_transform(urban_transform, (64, 48), "EPSG:4326")
+    expected = target.x[None, :] + 2 * target.y[:, None]
+    np.testing.assert_allclose(result['data'], expected, rtol=1e-5)
@@ -0,0 +1,113 @@
+import math
+import numpy as np
+import pytest
+import rasterio
+from rasterio.warp import transform_bounds
+from rasterio.transform import from_origin
+from app.services.scenario_comparison import COMPARISON_HISTOGRAM_BINS, compare_rasters, block_size
+
+# Not a multiple of the 256-pixel blocks, nor of the downsampling factor
+SHAPE = (600, 520)
+# 0.01° pixels from 10°E, 50°N southwards
+TRANSFORM = from_origin(10, 50, 0.01, 0.01)
+
+
+def _write_geotiff(path, data, crs="EPSG:4326", transform=TRANSFORM):
+    with rasterio.open(
+        path, "w", driver="GTiff", width=data.shape[1], height=data.shape[0], count=1,
+        dtype="float32", crs=crs, transform=transform, nodata=np.nan,
+    ) as dst:
+        dst.write(data.astype(np.float32), 1)
+    return str(path)
+
+
+@pytest.fixture
+def rasters(tmp_path):
+    rng = np.random.default_rng(0)
+    baseline = rng.uniform(0, 10, SHAPE).astype(np.float32)
+    other = (baseline + rng.normal(0.5, 2.0, SHAPE)).astype(np.float32)
+    baseline[:20, :30] = np.nan
+    other[-5:, -7:] = np.nan
+    return (
+        _write_geotiff(tmp_path / "baseline.tif", baseline),
+        _write_geotiff(tmp_path / "other.tif", other),
+        baseline.astype(np.float64),
+        other.astype(np.float64),
+    )
+
+
+def _compare(rasters, **kwargs):
+    baseline_path, other_path, _, _ = rasters
+    # A budget of one 256-pixel block, so several blocks are streamed
+    budget = 256 * 256 * (2 * 9 + 4 * 8)
+    assert block_size(2, budget) == 256
+    return compare_rasters(baseline_path, {"other": other_path}, budget=budget, **kwargs)["other"]
+
+
+def test_streaming_moments_match_numpy(rasters):
+    _, _, baseline, other = rasters
+    delta = other - baseline
+    valid = np.isfinite(delta)
+    summary = _compare(rasters)
+    assert summary["validPixels"] == valid.sum()
+    assert summary["baselineMean"] == pytest.approx(baseline[valid].mean())
+    assert summary["meanDelta"] == pytest.approx(delta[valid].mean())
+    assert summary["stdDelta"] == pytest.approx(delta[valid].std())
+    assert summary["minDelta"] == pytest.approx(delta[valid].min())
+    assert summary["maxDelta"] == pytest.approx(delta[valid].max())
+
+
+def test_percentiles_are_within_one_histogram_bin(rasters):
+    _, _, baseline, other = rasters
+    delta = (other - baseline)[np.isfinite(other - baseline)]
+    bin_width = (delta.max() - delta.min()) / COMPARISON_HISTOGRAM_BINS
+    summary = _compare(rasters, percentiles=(1, 5, 50, 95, 99))
+    for q in (1, 5, 50, 95, 99):
+        assert abs(summary["percentiles"][f"p{q:g}"] - np.percentile(delta, q)) <= bin_width
+
+
+def test_threshold_counts_pixels_and_area(rasters):
+    _, _, baseline, other = rasters
+    delta = other - baseline
+    above = np.isfinite(delta) & (np.abs(delta) > 3.0)
+    summary = _compare(rasters, threshold=3.0, percentiles=())
+    assert summary["pixelsAboveThreshold"] == above.sum()
+    # Area of each row's pixels on the sphere
+    radius = 6371.0088
+    edges = np.radians(50 - 0.01 * np.arange(SHAPE[0] + 1))
+    row_areas = radius ** 2 * np.radians(0.01) * np.abs(np.diff(np.sin(edges)))
+    assert summary["areaAboveThresholdKm2"] == pytest.approx(above.sum(axis=1) @ row_areas)
+
+
+def test_difference_raster_covers_partial_blocks(rasters):
+    _, _, baseline, other = rasters
+    delta = other - baseline
+    summary = _compare(rasters, raster_size=100, percentiles=())
+    factor = math.ceil(max(SHAPE) / 100)
+    raster = summary["differenceRaster"]
+    assert raster["factor"] == factor
+    assert (raster["height"], raster["width"]) == (math.ceil(SHAPE[0] / factor), math.ceil(SHAPE[1] / factor))
+    # Block means computed directly, including the partial last column of blocks
+    padded = np.full((raster["height"] * factor, raster["width"] * factor), np.nan)
+    padded[:SHAPE[0], :SHAPE[1]] = delta
+    blocks = padded.reshape(raster["height"], factor, raster["width"], factor)
+    counts = np.isfinite(blocks).sum(axis=(1, 3))
+    means = np.nansum(blocks, axis=(1, 3))[counts > 0] / counts[counts > 0]
+    assert raster["min"] == pytest.approx(means.min())
+    assert raster["max"] == pytest.approx(means.max())
+
+
+def test_mercator_area_is_measured_on_the_sphere(tmp_path):
+    # 1 km Web Mercator pixels near 60°N cover about a quarter of that on the ground
+    top = 8399737.89  # 60°N
+    transform = from_origin(0, top, 1000, 1000)
+    data = np.zeros((50, 40))
+    baseline = _write_geotiff(tmp_path / "baseline.tif", data, "EPSG:3857", transform)
+    other = _write_geotiff(tmp_path / "other.tif", data + 1, "EPSG:3857", transform)
+    summary = compare_rasters(baseline, {"other": other}, threshold=0.5, percentiles=())["other"]
+    with rasterio.open(baseline) as src:
+        west, south, east, north = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+    expected = 6371.0088 ** 2 * np.radians(east - west) * (np.sin(np.radians(north)) - np.sin(np.radians(south)))
+    assert summary["pixelsAboveThreshold"] == data.size
+    assert summary["areaAboveThresholdKm2"] == pytest.approx(expected, rel=1e-6)
+    assert summary["areaAboveThresholdKm2"] < 0.26 * data.size
@@ -0,0 +1,25 @@
+import pytest
+from pydantic import ValidationError
+from app.models.schemas import BatchPredictionRequest, PredictionRequest
+from app.services.tiled_inference import TILED_INFERENCE_TILE_SIZE
+
+FILES = {"urbanDataId": "urban", "temperatureDataId": "temp", "precipitationDataId": "prec"}
+
+
+def test_tile_overlap_is_below_half_the_tile_size():
+    assert PredictionRequest(**FILES, year=2030, tileSize=128, tileOverlap=63).tileOverlap == 63
+    with pytest.raises(ValidationError, match="less than half of tileSize"):
+        PredictionRequest(**FILES, year=2030, tileSize=128, tileOverlap=64)
+
+
+def test_tile_overlap_defaults_to_the_configured_tile_size():
+    half = TILED_INFERENCE_TILE_SIZE // 2
+    assert PredictionRequest(**FILES, year=2030, tileOverlap=half - 1).tileSize is None
+    with pytest.raises(ValidationError):
+        PredictionRequest(**FILES, year=2030, tileOverlap=half)
+
+
+def test_batch_tile_overlap_is_bounded():
+    with pytest.raises(ValidationError):
+        BatchPredictionRequest(**FILES, items=[{"year": 2030}], tileSize=64, tileOverlap=32)
+    assert BatchPredictionRequest(**FILES, items=[{"year": 2030}], tileSize=64, tileOverlap=31).tileOverlap == 31
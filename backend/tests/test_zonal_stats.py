@@ -0,0 +1,153 @@
+import os
+import numpy as np
+import pytest
+import rasterio
+import xarray as xr
+from rasterio.features import geometry_mask
+from rasterio.transform import from_origin
+from app.services.zonal_stats import ZonalStatsIndex, YIELD, URBAN_EXTENT
+
+# 1-degree pixels over 0-20°E, 0-20°N
+TRANSFORM = from_origin(0, 20, 1, 1)
+SHAPE = (20, 20)
+
+
+def _box(west, south, east, north):
+    return {
+        "type": "Polygon",
+        "coordinates": [[[west, south], [east, south], [east, north], [west, north], [west, south]]],
+    }
+
+
+REGIONS = {
+    "a": _box(2, 2, 8, 8),
+    "b": _box(5, 5, 12, 12),  # Overlaps a
+    "c": {"type": "Polygon", "coordinates": [[[10, 1], [19, 1], [14.5, 9.5], [10, 1]]]},
+}
+
+
+def _write_geotiff(path, data):
+    with rasterio.open(
+        path, "w", driver="GTiff", width=SHAPE[1], height=SHAPE[0], count=1,
+        dtype="float32", crs="EPSG:4326", transform=TRANSFORM, nodata=np.nan,
+    ) as dst:
+        dst.write(data.astype(np.float32), 1)
+    return str(path)
+
+
+def _masked(data, geometry):
+    """Pixels of `data` inside `geometry`, computed directly for one region."""
+    inside = geometry_mask([geometry], out_shape=SHAPE, transform=TRANSFORM, invert=True)
+    values = data[inside]
+    return values[np.isfinite(values)]
+
+
+def _stats(index, source_id):
+    with index._connect() as conn:
+        rows = conn.execute(
+            "SELECT region_id, year, metric, total, count FROM stats WHERE source_id = ?", (source_id,)
+        ).fetchall()
+    return {region_id: (year, metric, total, count) for region_id, year, metric, total, count in rows}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ZonalStatsIndex(tmp_path / "analytics.db")
+    for region_id, geometry in REGIONS.items():
+        index.put_region(region_id, region_id, geometry)
+    return index
+
+
+@pytest.fixture
+def data():
+    values = np.random.default_rng(0).uniform(0, 10, SHAPE)
+    values[3, 3] = np.nan
+    return values
+
+
+def test_region_sums_and_means_match_masked_computation(index, data, tmp_path):
+    index.add_source("p1", "prediction", _write_geotiff(tmp_path / "p1.tif", data), 2030)
+    assert index.refresh() == 1
+
+    stats = _stats(index, "p1")
+    assert set(stats) == set(REGIONS)
+    for region_id, geometry in REGIONS.items():
+        expected = _masked(data, geometry)
+        year, metric, total, count = stats[region_id]
+        assert (year, metric) == (2030, YIELD)
+        assert count == expected.size
+        assert total == pytest.approx(expected.sum())
+        assert index.region_series(region_id)[2030][YIELD] == pytest.approx(expected.mean())
+
+
+def test_overlapping_regions_each_count_shared_pixels(index, data, tmp_path):
+    index.add_source("p1", "prediction", _write_geotiff(tmp_path / "p1.tif", data), 2030)
+    index.refresh()
+
+    grid = next(grid for grid in index._label_grids.values() if grid is not None)
+    assert len(grid.layers) == 2
+    stats = _stats(index, "p1")
+    # Pixels in both a and b count for each of them
+    shared = _masked(data, _box(5, 5, 8, 8)).size
+    assert shared > 0
+    for region_id in ("a", "b"):
+        expected = _masked(data, REGIONS[region_id])
+        assert stats[region_id][3] == expected.size
+        assert stats[region_id][2] == pytest.approx(expected.sum())
+
+
+def test_urban_extent_is_the_share_of_urban_pixels(index, tmp_path):
+    urban = np.zeros(SHAPE)
+    urban[10:15, 2:5] = 1
+    index.add_source("u1", "urban", _write_geotiff(tmp_path / "u1.tif", urban), 2001)
+    index.refresh()
+
+    for region_id, geometry in REGIONS.items():
+        expected = (_masked(urban, geometry) > 0).mean()
+        assert index.region_series(region_id)[2001][URBAN_EXTENT] == pytest.approx(expected)
+
+
+def test_refresh_is_incremental(index, data, tmp_path):
+    path = _write_geotiff(tmp_path / "p1.tif", data)
+    index.add_source("p1", "prediction", path, 2030)
+    assert index.refresh() == 1
+    assert index.refresh() == 0
+    assert not index.has_pending()
+
+    # A new region is aggregated over existing sources without re-reading them for the others
+    geometry = _box(0, 0, 20, 20)
+    index.put_region("d", "d", geometry)
+    assert index.has_pending()
+    assert index.refresh() == 0
+    assert index.region_series("d")[2030][YIELD] == pytest.approx(_masked(data, geometry).mean())
+
+    # A changed file is aggregated again
+    changed = data * 2
+    _write_geotiff(path, changed)
+    os.utime(path, ns=(1, 1))
+    assert index.refresh() == 1
+    assert index.region_series("a")[2030][YIELD] == pytest.approx(_masked(changed, REGIONS["a"]).mean())
+
+    # A deleted file drops its statistics
+    os.remove(path)
+    index.refresh()
+    assert index.region_series("a") == {}
+
+
+def test_observed_yields_take_precedence_over_predictions(index, tmp_path):
+    index.add_source("p2020", "prediction", _write_geotiff(tmp_path / "p2020.tif", np.full(SHAPE, 5.0)), 2020)
+    index.add_source("p2021", "prediction", _write_geotiff(tmp_path / "p2021.tif", np.full(SHAPE, 6.0)), 2021)
+    # Observed yields for 2020 only, on a coarser south-up grid
+    lats = np.arange(0.5, 20, 2.0)
+    lons = np.arange(0.5, 20, 2.0)
+    observed = xr.Dataset(
+        {"yield": (("time", "lat", "lon"), np.full((1, lats.size, lons.size), 2.0))},
+        coords={"time": [2020], "lat": lats, "lon": lons},
+    )
+    observed.to_netcdf(tmp_path / "observed.nc")
+    index.add_source("observed", "yield", str(tmp_path / "observed.nc"))
+    assert index.refresh() == 3
+
+    series = index.region_series("a")
+    assert series[2020][YIELD] == pytest.approx(2.0)
+    assert series[2021][YIELD] == pytest.approx(6.0)
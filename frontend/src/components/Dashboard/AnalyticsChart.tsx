@@ -8,8 +8,8 @@ interface AnalyticsChartProps {
 export default function AnalyticsChart({ data }: AnalyticsChartProps) {
   const chartData = data.timeSeries.map((point) => ({
     year: point.year,
-    'Crop Yield (tonnes/hectare)': point.crop_yield,
-    'Urban Extent': point.urbanExtent * 100,
+    'Crop Yield (tonnes/hectare)': point.yield,
+    'Urban Extent': point.urbanExtent != null ? point.urbanExtent * 100 : null,
   }));
 
   return (
@@ -79,7 +79,7 @@ export default function AnalyticsChart({ data }: AnalyticsChartProps) {
              }}>
           <p className="text-[11px] uppercase tracking-[.12em]" style={{ color: 'rgba(255,255,255,.66)' }}>Average Yield</p>
           <p className="text-[18px] font-bold tracking-[-.02em] mt-[10px]">
-            {data.regionalStats.averageYield.toFixed(2)} t/ha
+            {data.regionalStats.averageYield?.toFixed(2) ?? '–'} t/ha
           </p>
         </div>
         <div className="stat p-4 rounded-2xl"
@@ -89,7 +89,7 @@ export default function AnalyticsChart({ data }: AnalyticsChartProps) {
              }}>
           <p className="text-[11px] uppercase tracking-[.12em]" style={{ color: 'rgba(255,255,255,.66)' }}>Total Urban Extent</p>
           <p className="text-[18px] font-bold tracking-[-.02em] mt-[10px]">
-            {data.regionalStats.totalUrbanExtent.toFixed(2)}
+            {data.regionalStats.totalUrbanExtent?.toFixed(2) ?? '–'}
           </p>
         </div>
         <div className="stat p-4 rounded-2xl"
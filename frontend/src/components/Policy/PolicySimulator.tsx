@@ -7,6 +7,7 @@ import type { PolicySimulation, MapLayer } from '../../types';
 
 export default function PolicySimulator() {
   const [simulationName, setSimulationName] = useState('');
+  const [baselinePredictionId, setBaselinePredictionId] = useState('');
   const [urbanGrowthBoundaries, setUrbanGrowthBoundaries] = useState<any>(null);
   const [layers, setLayers] = useState<MapLayer[]>([]);
   const [simulationResult, setSimulationResult] = useState<PolicySimulation | null>(null);
@@ -33,6 +34,7 @@ export default function PolicySimulator() {
   const handleSimulate = () => {
     simulateMutation.mutate({
       name: simulationName || 'Policy Simulation',
+      baselinePredictionId,
       urbanGrowthBoundaries,
       impactMetrics: undefined,
     });
@@ -67,6 +69,24 @@ export default function PolicySimulator() {
             />
           </div>
 
+          <div>
+            <label className="block text-sm font-medium mb-2" style={{ color: 'rgba(255,255,255,.92)' }}>
+              Baseline Prediction ID
+            </label>
+            <input
+              type="text"
+              value={baselinePredictionId}
+              onChange={(e) => setBaselinePredictionId(e.target.value)}
+              placeholder="Prediction to apply the policy to"
+              className="w-full px-3 py-2 rounded-[14px]"
+              style={{
+                background: 'rgba(0,0,0,.20)',
+                border: '1px solid rgba(255,255,255,.12)',
+                color: 'var(--text)'
+              }}
+            />
+          </div>
+
           <div>
             <label className="block text-sm font-medium mb-2" style={{ color: 'rgba(255,255,255,.92)' }}>
               Urban Growth Boundaries
@@ -82,7 +102,7 @@ export default function PolicySimulator() {
 
           <button
             onClick={handleSimulate}
-            disabled={simulateMutation.isPending}
+            disabled={simulateMutation.isPending || !baselinePredictionId}
             className="w-full px-4 py-2 rounded-[14px] font-semibold cursor-pointer disabled:opacity-50 disabled:cursor-not-allowed"
             style={{
               border: '1px solid rgba(255,255,255,.14)',
@@ -2,13 +2,20 @@ import axios from 'axios';
 import type {
   PredictionRequest,
   PredictionResponse,
+  BatchPredictionRequest,
+  BatchPredictionResponse,
   Scenario,
+  ScenarioComparison,
+  ScenarioComparisonRequest,
   UrbanExpansionData,
   ClimateData,
   HistoricalYieldData,
   AnalyticsData,
+  AnalyticsRegion,
   ModelMetrics,
   PolicySimulation,
+  Page,
+  ListParams,
 } from '../types';
 import { handleApiError } from '../utils/errorHandler';
 
@@ -80,10 +87,39 @@ export const predictionApi = {
     return response.data;
   },
 
-  list: async (): Promise<PredictionResponse[]> => {
-    const response = await apiClient.get<PredictionResponse[]>('/predictions');
+  createBatch: async (request: BatchPredictionRequest): Promise<BatchPredictionResponse> => {
+    const response = await apiClient.post<BatchPredictionResponse>('/predictions/batch', request);
     return response.data;
   },
+
+  getBatch: async (id: string): Promise<BatchPredictionResponse> => {
+    const response = await apiClient.get<BatchPredictionResponse>(`/predictions/batch/${id}`);
+    return response.data;
+  },
+
+  list: async (params?: ListParams): Promise<PredictionResponse[]> => {
+    const response = await predictionApi.listPage(params);
+    return response.items;
+  },
+
+  listPage: async (params?: ListParams): Promise<Page<PredictionResponse>> => {
+    const response = await apiClient.get<Page<PredictionResponse>>('/predictions', { params });
+    return response.data;
+  },
+
+  // Receive status and progress updates pushed by the server instead of polling.
+  // Returns a function that closes the stream.
+  watch: (ids: string[], onUpdate: (prediction: PredictionResponse) => void): (() => void) => {
+    const source = new EventSource(
+      `${API_BASE_URL}/predictions/events?ids=${encodeURIComponent(ids.join(','))}`
+    );
+    source.addEventListener('prediction', (event) => {
+      onUpdate(JSON.parse((event as MessageEvent).data));
+    });
+    // The server ends the stream once every prediction has finished
+    source.onerror = () => source.close();
+    return () => source.close();
+  },
 };
 
 // Scenario APIs
@@ -98,8 +134,13 @@ export const scenarioApi = {
     return response.data;
   },
 
-  list: async (): Promise<Scenario[]> => {
-    const response = await apiClient.get<Scenario[]>('/scenarios');
+  list: async (params?: ListParams): Promise<Scenario[]> => {
+    const response = await scenarioApi.listPage(params);
+    return response.items;
+  },
+
+  listPage: async (params?: ListParams): Promise<Page<Scenario>> => {
+    const response = await apiClient.get<Page<Scenario>>('/scenarios', { params });
     return response.data;
   },
 
@@ -112,14 +153,14 @@ export const scenarioApi = {
     await apiClient.delete(`/scenarios/${id}`);
   },
 
-  compare: async (scenarioIds: string[]): Promise<{
-    scenarios: Scenario[];
-    differences: Record<string, any>;
-  }> => {
-    const response = await apiClient.post<{
-      scenarios: Scenario[];
-      differences: Record<string, any>;
-    }>('/scenarios/compare', { scenarioIds });
+  compare: async (
+    scenarioIds: string[],
+    options?: Omit<ScenarioComparisonRequest, 'scenarioIds'>
+  ): Promise<ScenarioComparison> => {
+    const response = await apiClient.post<ScenarioComparison>('/scenarios/compare', {
+      scenarioIds,
+      ...options,
+    });
     return response.data;
   },
 };
@@ -144,6 +185,16 @@ export const analyticsApi = {
     return response.data;
   },
 
+  listRegions: async (): Promise<AnalyticsRegion[]> => {
+    const response = await apiClient.get<AnalyticsRegion[]>('/analytics/regions');
+    return response.data;
+  },
+
+  putRegion: async (id: string, region: AnalyticsRegion): Promise<AnalyticsRegion> => {
+    const response = await apiClient.put<AnalyticsRegion>(`/analytics/regions/${id}`, region);
+    return response.data;
+  },
+
   getMetrics: async (): Promise<ModelMetrics> => {
     const response = await apiClient.get<ModelMetrics>('/analytics/metrics');
     return response.data;
@@ -21,6 +21,14 @@ export interface HistoricalYieldData {
   years: number[];
 }
 
+export interface UrbanPolicy {
+  urbanGrowthBoundaries?: GeoJSON.FeatureCollection | GeoJSON.Geometry;
+  zoningRegulations?: {
+    nonUrbanValue?: number;
+    zones?: { geometry: GeoJSON.Geometry; value: number }[];
+  };
+}
+
 export interface PredictionRequest {
   urbanDataId: string;
   temperatureDataId: string;
@@ -28,12 +36,17 @@ export interface PredictionRequest {
   historicalYieldDataId?: string;
   year: number;
   region?: Region;
+  tiled?: boolean; // Defaults to automatic tiling for large inputs
+  tileSize?: number;
+  tileOverlap?: number;
+  policy?: UrbanPolicy;
 }
 
 export interface PredictionResponse {
   id: string;
-  status: 'pending' | 'processing' | 'completed' | 'failed';
+  status: 'pending' | 'processing' | 'completed' | 'failed' | 'cancelled';
   predictionMap?: string; // Base64 encoded image or data URL
+  tileUrl?: string; // XYZ tile URL template, e.g. /api/predictions/{id}/tiles/{z}/{x}/{y}.png
   metrics?: {
     mae: number;
     rmse: number;
@@ -43,6 +56,36 @@ export interface PredictionResponse {
   createdAt: string;
   completedAt?: string;
   error?: string;
+  stage?: 'load' | 'prepare' | 'inference' | 'stitch'; // While processing
+  progress?: number; // 0-1 while tiles complete
+  tilesTotal?: number;
+  tilesCompleted?: number;
+  tilesCached?: number; // Tiles reused from the tile result cache
+  timings?: PredictionTimings; // Set on completion
+}
+
+export interface PredictionTimings {
+  total: number; // Seconds from the start of processing
+  stages: Record<string, number>; // Seconds per pipeline stage, summed over tiles
+  bytesRead: number;
+}
+
+export interface BatchPredictionRequest {
+  urbanDataId: string;
+  temperatureDataId: string;
+  precipitationDataId: string;
+  historicalYieldDataId?: string;
+  items: { year: number; region?: Region }[];
+  tiled?: boolean;
+  tileSize?: number;
+  tileOverlap?: number;
+}
+
+export interface BatchPredictionResponse {
+  id: string;
+  status: PredictionResponse['status']; // Overall status derived from the items
+  counts: Partial<Record<PredictionResponse['status'], number>>;
+  items: PredictionResponse[]; // In request order
 }
 
 export interface Scenario {
@@ -60,6 +103,21 @@ export interface Scenario {
   updatedAt: string;
 }
 
+export interface Page<T> {
+  items: T[]; // Partial objects when `fields` is given
+  nextCursor?: string | null;
+}
+
+export interface ListParams {
+  limit?: number;
+  cursor?: string;
+  status?: string; // Comma-separated, predictions only
+  createdAfter?: string;
+  createdBefore?: string;
+  region?: string;
+  fields?: string; // Comma-separated, e.g. 'id,status'
+}
+
 export interface Region {
   id?: string;
   name: string;
@@ -84,8 +142,9 @@ export interface MapLayer {
 export interface PolicySimulation {
   id: string;
   name: string;
-  urbanGrowthBoundaries?: GeoJSON.FeatureCollection;
-  zoningRegulations?: Record<string, any>;
+  baselinePredictionId?: string;
+  urbanGrowthBoundaries?: UrbanPolicy['urbanGrowthBoundaries'];
+  zoningRegulations?: UrbanPolicy['zoningRegulations'];
   prediction?: PredictionResponse;
   impactMetrics?: {
     yieldLossPercentage: number;
@@ -98,14 +157,64 @@ export interface AnalyticsData {
   regionId: string;
   timeSeries: {
     year: number;
-    yield: number;
-    urbanExtent: number;
+    yield: number | null; // null for years without data
+    urbanExtent: number | null; // Share of the region's pixels that are urban
   }[];
   regionalStats: {
-    averageYield: number;
-    totalUrbanExtent: number;
+    averageYield: number | null;
+    totalUrbanExtent: number | null; // Latest year with data
     yieldTrend: 'increasing' | 'decreasing' | 'stable';
   };
+  pending: boolean; // New data is still being aggregated; the series may be incomplete
+}
+
+export interface AnalyticsRegion {
+  id?: string;
+  name: string;
+  bounds?: Region['bounds'];
+  geometry?: Record<string, unknown>; // GeoJSON geometry in WGS84
+}
+
+export interface ScenarioComparisonRequest {
+  scenarioIds: string[]; // The first scenario is the baseline
+  yieldThreshold?: number;
+  urbanThreshold?: number;
+  percentiles?: number[];
+  differenceRasterSize?: number; // Include downsampled difference rasters
+}
+
+export interface DifferenceSummary {
+  error?: string; // Set when a scenario has no raster to compare
+  validPixels?: number;
+  baselineMean?: number | null;
+  meanDelta?: number | null;
+  stdDelta?: number | null;
+  minDelta?: number | null;
+  maxDelta?: number | null;
+  percentiles?: Record<string, number | null>; // e.g. p50
+  threshold?: number;
+  pixelsAboveThreshold?: number;
+  areaAboveThresholdKm2?: number | null;
+  differenceRaster?: {
+    image: string; // PNG data URL
+    width: number;
+    height: number;
+    factor: number; // Source pixels per side of each raster pixel
+    min: number | null;
+    max: number | null;
+  };
+}
+
+export interface ScenarioComparison {
+  scenarios: Scenario[];
+  differences: {
+    scenario_count: number;
+    baselineId: string | null;
+    comparison_metrics: {
+      yield_differences: Record<string, DifferenceSummary>;
+      urban_extent_differences: Record<string, DifferenceSummary>;
+    };
+  };
 }
 
 export interface ModelMetrics {